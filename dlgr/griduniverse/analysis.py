@@ -0,0 +1,115 @@
+"""Columnar analysis of exported Griduniverse data.
+
+The infos of a dataset are parsed once into typed columns, and every metric
+reported by `Griduniverse.analyze` is then computed with grouped aggregations
+over them. Requires pandas, which is installed with ``dallinger[data]``.
+"""
+import datetime
+import json
+
+import pandas
+from cached_property import cached_property
+
+from .storage import decode_latest
+
+
+def _parse(text):
+    return json.loads(text) if isinstance(text, str) and text else {}
+
+
+class GameAnalysis(object):
+    """Metrics for a single game, from a Dallinger `Data` object."""
+
+    def __init__(self, data):
+        self.data = data
+
+    @cached_property
+    def infos(self):
+        infos = self.data.infos.df
+        return infos.assign(
+            creation_time=pandas.to_datetime(infos["creation_time"])
+        ).sort_values("creation_time", kind="stable")
+
+    @cached_property
+    def events(self):
+        """One row per recorded event, with its time, origin node, event type,
+        player and the number of rounds started before it."""
+        infos = self.infos[self.infos["type"] == "event"]
+        details = [_parse(text) for text in infos["details"]]
+        events = pandas.DataFrame(
+            {
+                "time": infos["creation_time"].values,
+                "origin": pandas.to_numeric(infos["origin_id"]).values,
+                "type": [d.get("type") for d in details],
+                "player": [d.get("player_id") for d in details],
+            }
+        )
+        events["round"] = (events["type"] == "new_round").cumsum()
+        return events
+
+    @cached_property
+    def moves(self):
+        return self.events[self.events["type"] == "move"]
+
+    @cached_property
+    def final_state(self):
+        """The last recorded grid state, or None if there isn't one."""
+        states = self.infos[self.infos["type"] == "state"]
+        if states.empty:
+            return None
+        return decode_latest(
+            (contents if isinstance(contents, str) else None, _parse(text))
+            for contents, text in zip(states["contents"][::-1], states["details"][::-1])
+        )
+
+    def _average_over_players(self, key):
+        if self.final_state is None:
+            return 0.0
+        values = [player[key] for player in self.final_state["players"]]
+        return float(sum(values)) / len(values)
+
+    def average_payoff(self):
+        return self._average_over_players("payoff")
+
+    def average_score(self):
+        return self._average_over_players("score")
+
+    def number_of_actions(self):
+        """The number of moves made by each player in each round that had
+        any. Rounds are numbered in order from 1."""
+        if self.final_state is None:
+            return []
+        moves = self.moves
+        counts = moves.groupby(["round", "origin"], sort=True).agg(
+            player_id=("player", "first"), total_moves=("type", "size")
+        )
+        result = []
+        for round_number, (_, round_counts) in enumerate(
+            counts.groupby(level="round"), 1
+        ):
+            result.append(
+                {
+                    "round_number": round_number,
+                    "round_data": [
+                        {
+                            "player_id": row.player_id,
+                            "total_moves": int(row.total_moves),
+                        }
+                        for row in round_counts.itertuples()
+                    ],
+                }
+            )
+        return result
+
+    def average_time_to_start(self):
+        """The mean time from the network being created to each player's
+        first move."""
+        if self.final_state is None:
+            return str(datetime.timedelta(0))
+        network_created = pandas.to_datetime(
+            self.data.networks.df["creation_time"]
+        ).iloc[0]
+        first_moves = self.moves.groupby("origin")["time"].min()
+        if first_moves.empty:
+            return str(datetime.timedelta(0))
+        return str((first_moves - network_created).mean().to_pytimedelta())
@@ -0,0 +1,362 @@
+"""Seeded benchmarks of the Gridworld hot paths.
+
+Each benchmark is timed against a fresh, in-process Gridworld for a range of
+grid sizes and player counts, with no database or Redis connection. Random
+number generators are seeded before every scenario, so runs on the same
+machine are comparable. Results can be written to a JSON file, and compared
+against an earlier run to catch regressions::
+
+    python -m dlgr.griduniverse.benchmark --quick --output results.json
+    python -m dlgr.griduniverse.benchmark --compare results.json
+"""
+import argparse
+import collections
+import json
+import logging
+import platform
+import random
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy
+
+from .experiment import Gridworld, IllegalMove, Item, load_game_config
+from .maze import labyrinth
+from .maze_utils import find_path_astar, labyrinth_to_maze, maze_to_graph
+
+logger = logging.getLogger(__file__)
+
+Scenario = collections.namedtuple("Scenario", ["name", "rows", "columns", "players"])
+
+SCENARIOS = (
+    Scenario("tiny", 25, 25, 3),
+    Scenario("small", 50, 50, 20),
+    Scenario("medium", 100, 100, 100),
+    Scenario("large", 250, 250, 250),
+    Scenario("huge", 500, 500, 500),
+)
+
+#: Scenarios run with --quick
+QUICK_SCENARIOS = ("tiny", "small", "medium")
+
+#: A non-interactive item, which players consume by walking onto it
+FOOD = {
+    "item_id": "food",
+    "name": "Food",
+    "calories": 5,
+    "interactive": False,
+    "respawn": True,
+    "item_count": 0,
+    "spawn_rate": 0,
+}
+
+MOVES = ("up", "down", "left", "right")
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name):
+    """Register a benchmark. It is called with a fresh `World` and a `Timer`,
+    and should time each call of the code being measured with the timer,
+    doing any setup outside of it."""
+
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+class Timer(object):
+    """Collects the duration of each timed call, in seconds."""
+
+    def __init__(self):
+        self.timings = []
+
+    @contextmanager
+    def __call__(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append(time.perf_counter() - start)
+
+
+class World(object):
+    """A seeded Gridworld for one scenario, populated with players and the
+    configured items. Any other keyword arguments override the Gridworld
+    configuration."""
+
+    def __init__(self, scenario, seed=0, game_config=None, **config):
+        random.seed(seed)
+        numpy.random.seed(seed)
+        self.scenario = scenario
+        self.game_config = game_config or load_game_config()
+        item_config = {
+            item_id: dict(item)
+            for item_id, item in self.game_config["item_config"].items()
+        }
+        item_config["food"] = dict(self.game_config.get("item_defaults", {}), **FOOD)
+        grid_config = {
+            "rows": scenario.rows,
+            "columns": scenario.columns,
+            "max_participants": scenario.players,
+            "motion_speed_limit": 0,
+            "contagion": 1,
+            "start_timestamp": time.time(),
+        }
+        grid_config.update(config)
+        if hasattr(Gridworld, "instance"):
+            del Gridworld.instance
+        self.grid = Gridworld(
+            item_config=item_config,
+            transition_config=self.game_config["transition_config"],
+            player_config=dict(self.game_config.get("player_config") or {}),
+            **grid_config,
+        )
+        for player_id in range(1, scenario.players + 1):
+            self.grid.spawn_player(id=player_id)
+        for item_id, item in item_config.items():
+            if item["item_count"]:
+                self.grid.spawn_items(item_id, item["item_count"])
+
+    @property
+    def players(self):
+        return list(self.grid.players.values())
+
+    def place_item(self, item_id, position):
+        """Put a new item at `position`, replacing anything already there."""
+        position = tuple(position)
+        if position in self.grid.item_locations:
+            del self.grid.item_locations[position]
+        item = Item(
+            id=self.grid.allocate_item_id(),
+            position=position,
+            item_config=self.grid.item_config[item_id],
+        )
+        self.grid.item_locations[position] = item
+        return item
+
+
+@benchmark("player_move")
+def bench_player_move(world, timer, calls):
+    """Every player makes one move in a random direction."""
+    players = world.players
+    for _ in range(calls):
+        directions = [random.choice(MOVES) for _ in players]
+        with timer():
+            for player, direction in zip(players, directions):
+                try:
+                    player.move(direction)
+                except IllegalMove:
+                    pass
+
+
+@benchmark("serialize")
+def bench_serialize(world, timer, calls):
+    for _ in range(calls):
+        with timer():
+            world.grid.serialize()
+
+
+@benchmark("consume")
+def bench_consume(world, timer, calls):
+    """Every player stands on food, which is consumed and respawned."""
+    for _ in range(calls):
+        for player in world.players:
+            world.place_item("food", player.position)
+        with timer():
+            world.grid.consume()
+
+
+@benchmark("spawn_item")
+def bench_spawn_item(world, timer, calls):
+    for _ in range(calls):
+        with timer():
+            world.grid.spawn_item(item_id="food")
+
+
+@benchmark("spawn_items")
+def bench_spawn_items(world, timer, calls):
+    """Spawn a batch of food the size of the player population."""
+    for _ in range(calls):
+        with timer():
+            world.grid.spawn_items("food", world.scenario.players)
+
+
+@benchmark("spread_contagion")
+def bench_spread_contagion(world, timer, calls):
+    for _ in range(calls):
+        with timer():
+            world.grid.spread_contagion()
+
+
+@benchmark("labyrinth")
+def bench_labyrinth(world, timer, calls):
+    for _ in range(calls):
+        with timer():
+            labyrinth(columns=world.scenario.columns, rows=world.scenario.rows)
+
+
+@benchmark("find_path_astar")
+def bench_find_path_astar(world, timer, calls):
+    """Paths between random open cells of a labyrinth, reusing its graph."""
+    rows, columns = world.scenario.rows, world.scenario.columns
+    maze = labyrinth_to_maze(labyrinth(columns=columns, rows=rows), rows, columns)
+    graph = maze_to_graph(maze)
+    cells = sorted(graph)
+    for _ in range(calls):
+        start, goal = random.sample(cells, 2)
+        with timer():
+            find_path_astar(maze, start, goal, graph=graph)
+
+
+@benchmark("item_transition")
+def bench_item_transition(world, timer, calls):
+    """A player uses a blank on a hare, through the experiment's handler."""
+    from .simulation import SimulatedGriduniverse
+
+    game = SimulatedGriduniverse(world.grid)
+    players = world.players
+    for _ in range(calls):
+        player = random.choice(players)
+        player.current_item = Item(
+            id=world.grid.allocate_item_id(),
+            item_config=world.grid.item_config["blank"],
+        )
+        world.place_item("hare", player.position)
+        msg = {"player_id": player.id, "position": list(player.position)}
+        with timer():
+            game.handle_item_transition(msg)
+
+
+def run(scenarios=SCENARIOS, benchmarks=None, calls=10, seed=0):
+    """Run the named benchmarks (all of them by default) for each scenario,
+    returning one result per benchmark and scenario."""
+    game_config = load_game_config()
+    results = []
+    for scenario in scenarios:
+        for name in benchmarks or BENCHMARKS:
+            world = World(scenario, seed=seed, game_config=game_config)
+            timer = Timer()
+            BENCHMARKS[name](world, timer, calls)
+            timings = [t * 1e6 for t in timer.timings]
+            results.append(
+                {
+                    "benchmark": name,
+                    "scenario": scenario.name,
+                    "rows": scenario.rows,
+                    "columns": scenario.columns,
+                    "players": scenario.players,
+                    "calls": len(timings),
+                    "min_us": min(timings),
+                    "median_us": statistics.median(timings),
+                    "mean_us": statistics.mean(timings),
+                    "max_us": max(timings),
+                }
+            )
+            logger.info(
+                "{benchmark} [{scenario}]: {median_us:.1f}us".format(**results[-1])
+            )
+    return results
+
+
+def compare(results, baseline, threshold=0.25):
+    """Return the results whose median time is more than `threshold` slower
+    than the same benchmark and scenario in `baseline`, as (result, baseline
+    result) pairs."""
+    previous = {(r["benchmark"], r["scenario"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["benchmark"], result["scenario"]))
+        if before and result["median_us"] > before["median_us"] * (1 + threshold):
+            regressions.append((result, before))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Gridworld hot paths in-process."
+    )
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="Only run the scenarios up to {}".format(QUICK_SCENARIOS[-1]),
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=[s.name for s in SCENARIOS],
+        help="Scenario to run (may be repeated)",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="append",
+        choices=list(BENCHMARKS),
+        help="Benchmark to run (may be repeated)",
+    )
+    parser.add_argument(
+        "--calls", type=int, default=10, help="Timed calls per benchmark"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument(
+        "--compare", help="Fail if slower than the results in this JSON file"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Slowdown of the median time counted as a regression",
+    )
+    args = parser.parse_args(argv)
+
+    names = args.scenario or (QUICK_SCENARIOS if args.quick else None)
+    scenarios = [s for s in SCENARIOS if names is None or s.name in names]
+    # Spawning items logs a warning each time
+    logging.basicConfig(level=logging.ERROR)
+    results = run(scenarios, args.benchmark, calls=args.calls, seed=args.seed)
+
+    for result in results:
+        print(
+            "{benchmark:<18} {scenario:<8} {rows:>4}x{columns:<4} {players:>4} players"
+            "  median {median_us:>12.1f}us  max {max_us:>12.1f}us".format(**result)
+        )
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "seed": args.seed,
+                    "calls": args.calls,
+                    "time": time.time(),
+                    "results": results,
+                },
+                output,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(
+                results, json.load(baseline)["results"], args.threshold
+            )
+        for result, before in regressions:
+            print(
+                "Regression in {} [{}]: median {:.1f}us, was {:.1f}us".format(
+                    result["benchmark"],
+                    result["scenario"],
+                    result["median_us"],
+                    before["median_us"],
+                )
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -323,9 +323,18 @@ class HighPerformanceBaseGridUniverseBot(HighPerformanceBotBase, BaseGridUnivers
         channel, payload = message.split(":", 1)
         data = json.loads(payload)
         if channel == "quorum":
-            handler = "handle_quorum"
+            self.handle_quorum(data)
         else:
-            handler = "handle_{}".format(data["type"])
+            self.handle(data)
+
+    def handle(self, data):
+        """Pass a message from the griduniverse channel to its handler,
+        unpacking batches of messages the server sent together."""
+        if data["type"] == "batch":
+            for message in data["messages"]:
+                self.handle(message)
+            return
+        handler = "handle_{}".format(data["type"])
         getattr(self, handler, lambda x: None)(data)
 
     def publish(self, message):
@@ -486,6 +495,9 @@ class FoodSeekingBot(HighPerformanceBaseGridUniverseBot):
             distance, _ = self.distance(position, food)
             if distance and distance < best_choice[0]:
                 best_choice = distance, j
+        if best_choice[1] is None:
+            # No reachable food
+            return {}
         return {self.player_id: best_choice[1]}
 
     def get_next_key(self):
@@ -1,23 +1,91 @@
+import functools
+import math
 import random
 
 import numpy
 
+#: Standard deviation used by the normal-based distributions
+SIGMA = 15
 
-def _is_valid_boundary(rows, columns, row, column):
-    """Truncate random sample"""
-    if row < rows and row >= 0 and column < columns and column >= 0:
-        return True
-    return False
 
+def _normal_cell_mass(size, mu, sigma):
+    """Probability mass of each integer cell [i, i + 1) in [0, size) under
+    a normal distribution."""
+    edges = numpy.arange(size + 1, dtype=float)
+    cdf = numpy.array(
+        [0.5 * (1 + math.erf((x - mu) / (sigma * math.sqrt(2)))) for x in edges]
+    )
+    return numpy.diff(cdf)
 
-def random_probability_distribution(rows, columns, *args):
-    """A probability distribution function always returns a [row, column] pair."""
-    row = random.randint(0, rows - 1)
-    column = random.randint(0, columns - 1)
-    return [row, column]
 
+def _triangular_cell_mass(size, length):
+    """Mass of each integer cell under `random.triangular(0, size, size)`,
+    truncated to `int` and clipped to a grid axis of `length` cells."""
+    mass = numpy.zeros(length)
+    cells = max(min(size, length), 1)
+    mass[:cells] = 2 * numpy.arange(cells) + 1
+    return mass
 
-def sinusoidal_probability_distribution(rows, columns, *args):
+
+class Sampler(object):
+    """Draws [row, column] positions from a fixed distribution over a grid.
+
+    The cumulative mass of the distribution is computed once, so each draw
+    is a binary search and a batch of draws is a single vectorized call.
+    """
+
+    def __init__(self, rows, columns, weights):
+        self.rows = rows
+        self.columns = columns
+        weights = numpy.asarray(weights, dtype=float).ravel()
+        if weights.size != rows * columns or not weights.sum() > 0:
+            raise ValueError(
+                "Sampler weights must cover a {}x{} grid".format(rows, columns)
+            )
+        self.cdf = numpy.cumsum(weights)
+        self.cdf /= self.cdf[-1]
+
+    def sample_indices(self, k):
+        """Return `k` flat cell indices drawn from the distribution."""
+        indices = self.cdf.searchsorted(numpy.random.random(k), side="right")
+        return numpy.minimum(indices, self.cdf.size - 1)
+
+    def sample(self, k=None):
+        """Return a single [row, column] pair, or a (k, 2) array of them."""
+        if k is None:
+            row, column = divmod(int(self.sample_indices(1)[0]), self.columns)
+            return [row, column]
+        rows, columns = numpy.divmod(self.sample_indices(k), self.columns)
+        return numpy.stack([rows, columns], axis=1)
+
+
+class FunctionSampler(object):
+    """Adapts a plain probability distribution function to the `Sampler`
+    interface, for custom distributions that don't provide weights."""
+
+    def __init__(self, probability_function, rows, columns, *args):
+        self.probability_function = probability_function
+        self.rows = rows
+        self.columns = columns
+        self.args = args
+
+    def sample(self, k=None):
+        if k is None:
+            return self.probability_function(self.rows, self.columns, *self.args)
+        return numpy.array(
+            [
+                self.probability_function(self.rows, self.columns, *self.args)
+                for _ in range(k)
+            ],
+            dtype=int,
+        ).reshape(k, 2)
+
+
+def random_weights(rows, columns, *args):
+    return numpy.ones((rows, columns))
+
+
+def sinusoidal_weights(rows, columns, *args):
     frequency = 10
     if len(args):
         try:
@@ -25,62 +93,117 @@ def sinusoidal_probability_distribution(rows, columns, *args):
         except ValueError:
             pass
     grid = numpy.tile(numpy.linspace(0, 1, columns), (rows, 1))
-    p = 0.5 + 0.5 * numpy.sin(frequency * grid)
-    p = p / numpy.sum(p)
-    value = numpy.random.choice(rows * columns, p=p.flatten())
-    row = value / columns
-    column = value - (row * columns)
-    return [int(row), int(column)]
+    return 0.5 + 0.5 * numpy.sin(frequency * grid)
+
+
+def horizontal_gradient_weights(rows, columns, *args):
+    row_mass = _triangular_cell_mass(columns - 1, rows)
+    return numpy.outer(row_mass, numpy.ones(columns))
+
+
+def vertical_gradient_weights(rows, columns, *args):
+    column_mass = _triangular_cell_mass(rows - 1, columns)
+    return numpy.outer(numpy.ones(rows), column_mass)
+
+
+def edge_bias_weights(rows, columns, *args):
+    """An equal mixture of the four edge-hugging components that
+    `edge_bias_probability_distribution` draws from."""
+    mu = rows / 2
+
+    def normalized(mass):
+        total = mass.sum()
+        return mass / total if total else mass
+
+    bottom = normalized(_normal_cell_mass(rows, 2 * mu, SIGMA))
+    top = normalized(_normal_cell_mass(rows, 0, SIGMA))
+    right = normalized(_normal_cell_mass(columns, 2 * mu, SIGMA))
+    left = normalized(_normal_cell_mass(columns, 0, SIGMA))
+    uniform_rows = numpy.ones(rows) / rows
+    uniform_columns = numpy.ones(columns) / columns
+    return (
+        numpy.outer(bottom, uniform_columns)
+        + numpy.outer(top, uniform_columns)
+        + numpy.outer(uniform_rows, right)
+        + numpy.outer(uniform_rows, left)
+    )
+
+
+def center_bias_weights(rows, columns, *args):
+    mu = rows / 2
+    return numpy.outer(
+        _normal_cell_mass(rows, mu, SIGMA), _normal_cell_mass(columns, mu, SIGMA)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_sampler(weights_function, rows, columns, args):
+    return Sampler(rows, columns, weights_function(rows, columns, *args))
+
+
+def get_sampler(probability_function, rows, columns, *args):
+    """Return a sampler for `probability_function` over a rows x columns grid.
+
+    Built-in distributions share one precomputed `Sampler` per
+    (distribution, rows, columns, args); any other function is wrapped in a
+    `FunctionSampler`.
+    """
+    weights_function = WEIGHT_FUNCTIONS.get(
+        getattr(probability_function, "__name__", None)
+    )
+    if weights_function is None:
+        return FunctionSampler(probability_function, rows, columns, *args)
+    return _cached_sampler(weights_function, rows, columns, tuple(args))
+
+
+def random_probability_distribution(rows, columns, *args):
+    """A probability distribution function always returns a [row, column] pair."""
+    row = random.randint(0, rows - 1)
+    column = random.randint(0, columns - 1)
+    return [row, column]
+
+
+def sinusoidal_probability_distribution(rows, columns, *args):
+    return get_sampler(
+        sinusoidal_probability_distribution, rows, columns, *args
+    ).sample()
 
 
 def horizontal_gradient_probability_distribution(rows, columns, *args):
     """Vertical gradient on the x axis"""
-    size = columns - 1
-    column = random.randint(0, size)
-    row = random.triangular(0, size, size)
-    return [int(row), int(column)]
+    return get_sampler(
+        horizontal_gradient_probability_distribution, rows, columns, *args
+    ).sample()
 
 
 def vertical_gradient_probability_distribution(rows, columns, *args):
     """Vertical gradient on the y axis"""
-    size = rows - 1
-    row = random.randint(0, size)
-    column = random.triangular(0, size, size)
-    return [int(row), int(column)]
+    return get_sampler(
+        vertical_gradient_probability_distribution, rows, columns, *args
+    ).sample()
 
 
 def edge_bias_probability_distribution(rows, columns, *args):
     """Do the inverse to a normal distribution"""
-    mu = rows / 2  # mean
-    sigma = 15  # standard deviation
-    row = numpy.random.normal(mu, sigma)
-    column = numpy.random.normal(mu, sigma)
-    valid = False
-    while not valid:
-        if row > mu and column > mu:
-            row = mu + numpy.random.normal(mu, sigma)
-            column = random.randint(0, columns - 1)
-        elif row > mu and column < mu:
-            row = abs(numpy.random.normal(mu, sigma) - mu)
-            column = random.randint(0, columns - 1)
-        elif row < mu and column > mu:
-            column = mu + numpy.random.normal(mu, sigma)
-            row = random.randint(0, columns - 1)
-        else:
-            column = abs(numpy.random.normal(mu, sigma) - mu)
-            row = random.randint(0, columns - 1)
-        valid = _is_valid_boundary(rows, columns, row, column)
-    return [int(row), int(column)]
+    return get_sampler(
+        edge_bias_probability_distribution, rows, columns, *args
+    ).sample()
 
 
 def center_bias_probability_distribution(rows, columns, *args):
     """Do normal distribution in two dimensions"""
-    mu = rows / 2  # mean
-    sigma = 15  # standard deviation
-    valid = False
-    while not valid:
-        row = numpy.random.normal(mu, sigma)
-        column = numpy.random.normal(mu, sigma)
-        # Create some cutoff for values
-        valid = _is_valid_boundary(rows, columns, row, column)
-    return [int(row), int(column)]
+    return get_sampler(
+        center_bias_probability_distribution, rows, columns, *args
+    ).sample()
+
+
+#: Maps the name of each built-in distribution function to the function
+#: computing its (unnormalized) weight for every grid cell.
+WEIGHT_FUNCTIONS = {
+    "random_probability_distribution": random_weights,
+    "sinusoidal_probability_distribution": sinusoidal_weights,
+    "horizontal_gradient_probability_distribution": horizontal_gradient_weights,
+    "vertical_gradient_probability_distribution": vertical_gradient_weights,
+    "edge_bias_probability_distribution": edge_bias_weights,
+    "center_bias_probability_distribution": center_bias_weights,
+}
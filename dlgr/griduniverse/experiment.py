@@ -2,7 +2,6 @@
 
 import collections
 import datetime
-import itertools
 import json
 import logging
 import math
@@ -11,31 +10,51 @@ import random
 import string
 import time
 import uuid
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 
 import dallinger
 import flask
 import gevent
+import gevent.local
+import numpy
 import yaml
 from cached_property import cached_property
 from dallinger import db
 from dallinger.compat import unicode
 from dallinger.config import get_config
+from dallinger.data import find_experiment_export
 from dallinger.experiment import Experiment
 from faker import Factory
-from sqlalchemy import create_engine, func
-from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy import func
 
 from . import distributions
 from .bots import Bot
 from .maze import Wall, labyrinth
+from .metrics import Metrics
 from .models import Event
+from .replay import KeyframeIndex, read_infos
+from .sessions import (
+    MAX_OVERFLOW,
+    POOL_RECYCLE,
+    POOL_SIZE,
+    greenlet_session,
+    released,
+)
+from .stats import RoundStats
+from .storage import StateDecoder, StateEncoder, decode_latest, is_compact
 
 logger = logging.getLogger(__file__)
 
 
 GAME_CONFIG_FILE = "game_config.yml"
 
+# Redis key holding the latest snapshot of the game's metrics
+METRICS_KEY = "griduniverse:metrics"
+
+# Redis hash of each participant's final payoff, saved when the game ends
+PAYOFFS_KEY = "griduniverse:payoffs"
+
 # Make bot importable without triggering style warnings
 Bot = Bot
 
@@ -110,10 +129,22 @@ GU_PARAMS = {
     "donation_multiplier": float,
     "num_recruits": int,
     "state_interval": float,
+    "state_max_interval": float,
+    "state_budget": float,
     "goal_items": int,
     "game_over_cond": unicode,
     "num_cook": int,
-    "cook_time": int
+    "cook_time": int,
+    "log_metrics": bool,
+    "inbound_batch_interval": float,
+    "batch_outbound": bool,
+    "history_length": int,
+    "db_pool_size": int,
+    "db_max_overflow": int,
+    "db_pool_recycle": int,
+    "state_storage": unicode,
+    "state_compression": unicode,
+    "state_keyframe_interval": int,
 }
 
 DEFAULT_ITEM_CONFIG = {
@@ -125,6 +156,44 @@ DEFAULT_ITEM_CONFIG = {
 }
 
 
+def load_game_config(path=None):
+    """Load the item, transition and player definitions from a game config
+    file, filling in item and transition defaults.
+
+    The parsed file is returned with `item_config` mapping item ids to item
+    definitions, and `transition_config` mapping (actor, target) ids, or
+    ("last", actor, target) for last use transitions, to transitions.
+    """
+    if path is None:
+        path = os.path.join(os.path.dirname(__file__), GAME_CONFIG_FILE)
+    with open(path, "r") as game_config_stream:
+        game_config = yaml.safe_load(game_config_stream)
+    item_config = {o["item_id"]: o for o in game_config.get("items", ())}
+
+    # If any item is missing a key, add it with default value.
+    item_defaults = game_config.get("item_defaults", {})
+    for item in item_config.values():
+        for prop in item_defaults:
+            if prop not in item:
+                item[prop] = item_defaults[prop]
+
+    transition_config = {}
+    transition_defaults = game_config.get("transition_defaults", {})
+    for t in game_config.get("transitions", ()):
+        transition = transition_defaults.copy()
+        transition.update(t)
+        if transition["last_use"]:
+            transition_config[
+                ("last", t["actor_start"], t["target_start"])
+            ] = transition
+        else:
+            transition_config[(t["actor_start"], t["target_start"])] = transition
+
+    game_config["item_config"] = item_config
+    game_config["transition_config"] = transition_config
+    return game_config
+
+
 class PluralFormatter(string.Formatter):
     def format_field(self, value, format_spec):
         if format_spec.startswith("plural"):
@@ -166,7 +235,7 @@ class Gridworld(object):
     GREEN = [0.51, 0.69, 0.61]
     WHITE = [1.00, 1.00, 1.00]
     wall_locations = None
-    item_locations = None
+    _item_locations = None
     walls_updated = True
     items_updated = True
 
@@ -273,8 +342,11 @@ class Gridworld(object):
             "alternate_consumption_donation", False
         )
 
+        # How many recent chat messages and consumed items to keep
+        self.history_length = kwargs.get("history_length", 1000)
+
         # Chat
-        self.chat_message_history = []
+        self.chat_message_history = collections.deque(maxlen=self.history_length)
 
         # Questionnaire
         self.difi_question = kwargs.get("difi_question", False)
@@ -299,11 +371,22 @@ class Gridworld(object):
         # Set some variables.
         self.players = {}
         self.item_locations = {}
-        self.items_consumed = []
+        self.items_consumed = collections.deque(maxlen=self.history_length)
+        # Items consumed in the whole game; items_consumed only keeps the latest
+        self.total_items_consumed = 0
+        # Ids are never reused within a game, so they can key items across
+        # states even when an item is in a player's hand
+        self.next_item_id = 0
+        self._samplers = {}
         self.num_items_consumed = 0
         self.start_timestamp = kwargs.get("start_timestamp", None)
 
         self.round = 0
+        self.round_stats = RoundStats(self.round)
+        # Incremented whenever something players can see changes
+        self.version = 0
+        # Incremented whenever walls are added, removed or replaced
+        self.walls_version = 0
 
         if self.contagion_hierarchy:
             self.contagion_hierarchy = range(self.num_colors)
@@ -354,6 +437,15 @@ class Gridworld(object):
             self.player_config.get("probability_distribution", "")
         )
 
+    @property
+    def item_locations(self):
+        return self._item_locations
+
+    @item_locations.setter
+    def item_locations(self, value):
+        # Always keep the per-type index, whatever mapping is assigned
+        self._item_locations = ItemLocations(value)
+
     def _get_probablity_func_for_config(self, probability_distribution):
         probability_function_args = []
         parts = probability_distribution.split()
@@ -490,11 +582,8 @@ class Gridworld(object):
                     self.spawn_item(item_id=item_type["item_id"])
             '''
 
-            self.spawn_item(item_id = "stag")
-            self.spawn_item(item_id = "hare")
-            self.spawn_item(item_id = "hare")
-            
-            
+            self.spawn_items("stag", 1)
+            self.spawn_items("hare", 2)
 
             self.items_updated = True
 
@@ -505,7 +594,7 @@ class Gridworld(object):
                 item_props = self.item_config["blank"]
 
                 new_item = Item(
-                    id=(len(self.item_locations) + len(self.items_consumed)),
+                    id=self.allocate_item_id(),
                     item_config=item_props,
                 )
 
@@ -587,6 +676,7 @@ class Gridworld(object):
                 "Built {} walls in {} seconds.".format(len(walls), time.time() - start)
             )
             self.wall_locations = {tuple(w.position): w for w in walls}
+            self.walls_changed()
 
     def _start_if_ready(self):
         # Don't start unless we have a least one player
@@ -602,10 +692,30 @@ class Gridworld(object):
         if self.game_over_cond == "time":
             return self.round >= self.num_rounds
         elif self.game_over_cond == "foraging":
-            return len(self.items_consumed) == self.goal_items
+            return self.total_items_consumed == self.goal_items
         elif self.game_over_cond == "cooking":
             return len(self.items_cooked) == self.goal_items
 
+    def item_consumed(self, item):
+        """Note that `item` has been used up."""
+        self.items_consumed.append(item)
+        self.total_items_consumed += 1
+        self.num_items_consumed += 1
+
+    def allocate_item_id(self):
+        """Return a new item id, unique within the game."""
+        item_id = self.next_item_id
+        self.next_item_id += 1
+        return item_id
+
+    def changed(self):
+        """Note that the state shown to players has changed."""
+        self.version += 1
+
+    def walls_changed(self):
+        """Note that the walls have changed."""
+        self.walls_version += 1
+
     def serialize(self, include_walls=True, include_items=True):
         grid_data = {
             "players": [player.serialize() for player in self.players.values()],
@@ -615,6 +725,7 @@ class Gridworld(object):
             "columns": self.columns,
             "chat_visible": self.show_chatroom,
             "others_visible": self.others_visible,
+            "next_item_id": self.next_item_id,
         }
 
         if include_walls:
@@ -635,40 +746,90 @@ class Gridworld(object):
                 )
             )
         self.round = state["round"]
+        self.changed()
         # @@@ can't set donation_active because it's a property
         # self.donation_active = state['donation_active']
 
-        self.players = {}
+        # Update the objects we already have in place, only building new
+        # ones for players, walls and items that weren't there before
+        players = {}
         for player_state in state["players"]:
-            # Avoid mutating the caller's data
-            new_state = player_state.copy()
-            new_state["color_name"] = new_state.pop("color", None)
-            player = Player(
-                pseudonym_locale=self.pseudonyms_locale,
-                pseudonym_gender=self.pseudonyms_gender,
-                grid=self,
-                **new_state,
+            player = self.players.get(player_state["id"])
+            if player is None:
+                # Avoid mutating the caller's data
+                new_state = player_state.copy()
+                new_state["color_name"] = new_state.pop("color", None)
+                player = Player(
+                    pseudonym_locale=self.pseudonyms_locale,
+                    pseudonym_gender=self.pseudonyms_gender,
+                    grid=self,
+                    **new_state,
+                )
+            player.restore(player_state)
+            item_state = player_state.get("current_item")
+            player.current_item = item_state and self._restore_item(
+                player.current_item, item_state
             )
-            self.players[player.id] = player
+            players[player.id] = player
+        self.players = players
 
         if "walls" in state:
-            self.wall_locations = {}
+            walls = {}
             for wall_state in state["walls"]:
                 if isinstance(wall_state, list):
                     wall_state = {"position": wall_state}
-                wall = Wall(**wall_state)
-                self.wall_locations[tuple(wall.position)] = wall
+                position = tuple(wall_state["position"])
+                wall = self.wall_locations.get(position)
+                if wall is None or wall.color != wall_state.get(
+                    "color", Wall.DEFAULT_COLOR
+                ):
+                    wall = Wall(**wall_state)
+                walls[position] = wall
+            self.wall_locations = walls
+            self.walls_changed()
 
         if "items" in state:
-            self.item_locations = {}
+            items = {}
             for item_state in state["items"]:
-                item_props = self.item_config[item_state["item_id"]]
-                invalid_params = ["item_id", "maturity"]
-                item_params = {
-                    k: v for k, v in item_state.items() if k not in invalid_params
-                }
-                obj = Item(item_props, **item_params)
-                self.item_locations[tuple(obj.position)] = obj
+                position = tuple(item_state["position"])
+                items[position] = self._restore_item(
+                    self.item_locations.get(position), item_state
+                )
+            for position in list(self.item_locations):
+                if position not in items:
+                    del self.item_locations[position]
+            for position, item in items.items():
+                if self.item_locations.get(position) is not item:
+                    self.item_locations[position] = item
+
+        if "next_item_id" in state:
+            self.next_item_id = state["next_item_id"]
+        else:
+            # States saved before ids were allocated: start past every id in
+            # use, including the ones in players' hands
+            ids = [p.current_item.id for p in self.players.values() if p.current_item]
+            ids.extend(item.id for item in self.item_locations.values())
+            ids = [i for i in ids if isinstance(i, int)]
+            self.next_item_id = max([self.next_item_id] + [i + 1 for i in ids])
+
+    def _restore_item(self, item, item_state):
+        """Return `item` updated from `item_state` if it's the same item, or a
+        new item built from `item_state` otherwise."""
+        if (
+            item is None
+            or item.id != item_state["id"]
+            or item.item_id != item_state["item_id"]
+            or item.creation_timestamp != item_state["creation_timestamp"]
+        ):
+            item_props = self.item_config[item_state["item_id"]]
+            invalid_params = ["item_id", "maturity"]
+            item_params = {
+                k: v for k, v in item_state.items() if k not in invalid_params
+            }
+            return Item(item_props, **item_params)
+        item.position = item_state["position"]
+        item.remaining_uses = item_state["remaining_uses"]
+        return item
 
     def instructions(self):
         color_costs = ""
@@ -865,8 +1026,7 @@ class Gridworld(object):
                     continue
                 del self.item_locations[position]
                 # Update existence and count of item.
-                self.items_consumed.append(item)
-                self.num_items_consumed += 1
+                self.item_consumed(item)
                 self.items_updated = True
                 if item.respawn:
                     # respawn same type of item.
@@ -878,15 +1038,23 @@ class Gridworld(object):
                 if player.color_idx > 0:
                     calories = item.calories
                 else:
-                    calories = item.calories * self.grid.relative_deprivation
+                    calories = item.calories * self.relative_deprivation
 
                 player.score += calories
+                self.round_stats.harvest(player.id, item.item_id, calories)
                 consumed += 1
 
         if consumed and item.public_good:
             for player_to in self.players.values():
                 player_to.score += item.public_good * consumed
 
+    def end_round_stats(self):
+        """Return the summary of the round's aggregates, and start collecting
+        them afresh for the current round."""
+        summary = self.round_stats.summary(self.players, game_over=self.game_over)
+        self.round_stats = RoundStats(self.round)
+        return summary
+
     def spawn_item(self, position=None, item_id=None):
         """Respawn an item for a single position"""
         if not item_id:
@@ -904,7 +1072,7 @@ class Gridworld(object):
 
         item_props = self.item_config[item_id]
         new_item = Item(
-            id=(len(self.item_locations) + len(self.items_consumed)),
+            id=self.allocate_item_id(),
             position=position,
             item_config=item_props,
         )
@@ -918,6 +1086,74 @@ class Gridworld(object):
             }
         )
 
+    def spawn_items(self, item_id, count):
+        """Spawn `count` items of one type at free positions drawn from its
+        probability distribution.
+
+        Positions are drawn in vectorized batches against a mask of occupied
+        cells, and a single aggregated event is logged for the whole batch.
+        Fewer items are spawned if the grid runs out of free cells.
+        """
+        count = int(count)
+        if count <= 0:
+            return []
+        sampler = self._get_sampler(item_id=item_id)
+        occupied = self._occupied_mask().ravel()
+        chosen = []
+        # Bound the number of passes, in case the distribution puts most of
+        # its mass on cells that are already occupied.
+        for _ in range(100):
+            needed = count - len(chosen)
+            if not needed or occupied.all():
+                break
+            positions = sampler.sample(2 * needed)
+            cells = positions[:, 0] * self.columns + positions[:, 1]
+            cells = cells[~occupied[cells]]
+            # Keep the first draw of each cell, preserving draw order
+            _, first = numpy.unique(cells, return_index=True)
+            cells = cells[numpy.sort(first)][:needed]
+            occupied[cells] = True
+            chosen.extend(cells.tolist())
+
+        if len(chosen) < count:
+            logger.info(
+                "Only found room for {} of {} {} items.".format(
+                    len(chosen), count, item_id
+                )
+            )
+
+        item_props = self.item_config[item_id]
+        new_items = []
+        for cell in chosen:
+            position = list(divmod(cell, self.columns))
+            new_item = Item(
+                id=self.allocate_item_id(), position=position, item_config=item_props
+            )
+            self.item_locations[tuple(position)] = new_item
+            new_items.append(new_item)
+
+        if new_items:
+            self.items_updated = True
+            self.log_event(
+                {
+                    "type": "spawn items",
+                    "item_id": item_id,
+                    "positions": [item.position for item in new_items],
+                }
+            )
+        return new_items
+
+    def _occupied_mask(self):
+        """Return a rows x columns boolean array of cells holding a player,
+        an item or a wall."""
+        mask = numpy.zeros((self.rows, self.columns), dtype=bool)
+        positions = list(self.item_locations) + list(self.wall_locations)
+        positions.extend(tuple(p.position) for p in self.players.values())
+        if positions:
+            positions = numpy.array(positions, dtype=int)
+            mask[positions[:, 0], positions[:, 1]] = True
+        return mask
+
     def items_changed(self, last_items):
         locations = self.item_locations
         if len(last_items) != len(locations):
@@ -942,7 +1178,7 @@ class Gridworld(object):
                 if now - item.creation_timestamp >= item_type["auto_transition_time"]:
                     target = item_type.get("auto_transition_target")
                     new_target_item = target and Item(
-                        id=item.id,
+                        id=self.allocate_item_id(),
                         position=position,
                         item_config=self.item_config[target],
                     )
@@ -956,10 +1192,6 @@ class Gridworld(object):
                 self.item_locations[position] = new_target_item
 
     def replenish_items(self):
-        items_by_type = collections.defaultdict(list)
-        for item in self.item_locations.values():
-            items_by_type[item.item_id].append(item)
-
         for item_type in self.item_config.values():
             # Alternate positive and negative growth rates
             seasonal_growth = item_type["seasonal_growth_rate"] ** (
@@ -986,27 +1218,17 @@ class Gridworld(object):
                 f"item_type: {item_type['name']}, target count: {item_type['item_count']}"
             )
 
-            # Only items of the same type.
-            items_of_this_type = items_by_type[item_type["item_id"]]
-
-            items_to_add_or_remove = round(item_type["item_count"]) - len(
-                items_of_this_type
-            )
-            add_items = items_to_add_or_remove > 1
+            # Live positions of items of the same type.
+            positions = self.item_locations.positions_of(item_type["item_id"])
+            items_to_add_or_remove = round(item_type["item_count"]) - len(positions)
 
-            for i in range(abs(items_to_add_or_remove)):
-                if add_items:
-                    self.spawn_item(item_id=item_type["item_id"])
-                    self.items_updated = True
-                elif item_type["limit_quantity"]:
-                    random_of_type = random.choice(items_of_this_type)
-                    try:
-                        del self.item_locations[tuple(random_of_type.position)]
-                        self.items_updated = True
-                    except (KeyError, TypeError):
-                        pass
-                else:
-                    break
+            if items_to_add_or_remove > 0:
+                self.spawn_items(item_type["item_id"], items_to_add_or_remove)
+            elif items_to_add_or_remove < 0 and item_type["limit_quantity"]:
+                to_remove = random.sample(list(positions), -items_to_add_or_remove)
+                for position in to_remove:
+                    del self.item_locations[position]
+                self.items_updated = True
 
     def spawn_player(self, id=None, **kwargs):
         """Spawn a player."""
@@ -1032,7 +1254,7 @@ class Gridworld(object):
         item_props = self.item_config["blank"]
 
         new_item = Item(
-            id=(len(self.item_locations) + len(self.items_consumed)),
+            id=self.allocate_item_id(),
             item_config=item_props,
         )
 
@@ -1042,23 +1264,33 @@ class Gridworld(object):
         self._start_if_ready()
         return player
 
+    def _get_sampler(self, item_id=None, player=False):
+        """Return the cached position sampler for an item type (or players),
+        built from its configured probability distribution."""
+        key = (item_id, player, self.rows, self.columns)
+        sampler = self._samplers.get(key)
+        if sampler is None:
+            if item_id:
+                prob_func = self.item_config[item_id]["probability_function"]
+                func_args = self.item_config[item_id]["probability_function_args"]
+            elif player:
+                prob_func = self.player_config["probability_function"]
+                func_args = self.player_config["probability_function_args"]
+            else:
+                prob_func = distributions.random_probability_distribution
+                func_args = []
+            sampler = distributions.get_sampler(
+                prob_func, self.rows, self.columns, *func_args
+            )
+            self._samplers[key] = sampler
+        return sampler
+
     def _find_empty_position(self, item_id=None, player=False):
         """Select an empty cell, using the configured probability distribution."""
-        rows = self.rows
-        columns = self.columns
+        sampler = self._get_sampler(item_id=item_id, player=player)
         empty_cell = False
-        if item_id:
-            prob_func = self.item_config[item_id]["probability_function"]
-            func_args = self.item_config[item_id]["probability_function_args"]
-        elif player:
-            prob_func = self.player_config["probability_function"]
-            func_args = self.player_config["probability_function_args"]
-        else:
-            prob_func = distributions.random_probability_distribution
-            func_args = []
-
         while not empty_cell:
-            position = prob_func(rows, columns, *func_args)
+            position = sampler.sample()
             empty_cell = self._empty(position)
 
         return position
@@ -1096,7 +1328,9 @@ class Gridworld(object):
                         color_updates.append((player, plurality_color))
 
         for player, color in color_updates:
-            player.color = color
+            if player.color != color:
+                player.color = color
+                self.changed()
 
     def rank(self, color):
         """Where does this color fall on the color hierarchy?"""
@@ -1176,6 +1410,60 @@ class Item:
         return time.time() - self.creation_timestamp
 
 
+class ItemLocations(dict):
+    """Maps grid positions to the items on them, keeping an index of the
+    occupied positions for each item type up to date as items are added,
+    replaced and removed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ItemLocations, self).__init__()
+        self._positions_by_type = collections.defaultdict(set)
+        self.update(*args, **kwargs)
+
+    def _index(self, position, item):
+        self._positions_by_type[getattr(item, "item_id", None)].add(position)
+
+    def _unindex(self, position):
+        item = dict.get(self, position)
+        positions = self._positions_by_type.get(getattr(item, "item_id", None))
+        if positions is not None:
+            positions.discard(position)
+
+    def __setitem__(self, position, item):
+        self._unindex(position)
+        super(ItemLocations, self).__setitem__(position, item)
+        self._index(position, item)
+
+    def __delitem__(self, position):
+        self._unindex(position)
+        super(ItemLocations, self).__delitem__(position)
+
+    def pop(self, position, *default):
+        if position in self:
+            self._unindex(position)
+        return super(ItemLocations, self).pop(position, *default)
+
+    def clear(self):
+        super(ItemLocations, self).clear()
+        self._positions_by_type.clear()
+
+    def update(self, *args, **kwargs):
+        for position, item in dict(*args, **kwargs).items():
+            self[position] = item
+
+    def positions_of(self, item_id):
+        """The set of positions holding an item of type `item_id`.
+
+        The returned set is live; copy it before mutating the locations.
+        """
+        return self._positions_by_type.get(item_id, set())
+
+    def count(self, item_id):
+        """The number of items of type `item_id` on the grid."""
+        return len(self.positions_of(item_id))
+
+
 class IllegalMove(Exception):
     """A move sent from a client was denied by the server."""
 
@@ -1233,6 +1521,33 @@ class Player(object):
 
         self.motion_timestamp = 0
         self.last_timestamp = 0
+        # Sequence number of the client's latest move the server has handled
+        self.move_sequence = 0
+
+    #: Serialized properties that are restored as they are
+    restored_properties = (
+        "score",
+        "payoff",
+        "motion_auto",
+        "motion_direction",
+        "motion_speed_limit",
+        "motion_timestamp",
+        "name",
+        "identity_visible",
+        "recruiter_id",
+    )
+
+    def restore(self, state):
+        """Update the player in place from its serialized `state`. Properties
+        missing from older exports are left unchanged."""
+        self.position = list(state["position"])
+        for name in self.restored_properties:
+            if name in state:
+                setattr(self, name, state[name])
+        color = state.get("color")
+        if color is not None and color != self.color_name:
+            self.color_idx = Gridworld.player_color_names.index(color)
+            self.color_name = self.color = color
 
     def tremble(self, direction):
         """Change direction with some probability."""
@@ -1274,18 +1589,9 @@ class Player(object):
                 new_position[1] = self.position[1] + 1
 
         # Update motion.
-        if self.motion_speed_limit <= 0:
-            waited_long_enough = True
-        else:
-            wait_time = 1.0 / self.motion_speed_limit
-            if timestamp is None:
-                elapsed = self.grid.elapsed_round_time
-                waited_long_enough = elapsed > (self.motion_timestamp + wait_time)
-            else:
-                waited_long_enough = timestamp > (self.last_timestamp + wait_time)
         can_afford_to_move = self.score >= self.motion_cost
 
-        if not waited_long_enough:
+        if self.moving_too_soon(timestamp):
             raise IllegalMove("Minimum wait time has not passed since last move!")
         if not can_afford_to_move:
             raise IllegalMove("Not enough points to move right now!")
@@ -1294,6 +1600,7 @@ class Player(object):
 
         msgs = {"direction": direction}
         self.position = new_position
+        self.grid.changed()
         self.motion_timestamp = self.grid.elapsed_round_time
         if timestamp:
             self.last_timestamp = timestamp
@@ -1303,12 +1610,31 @@ class Player(object):
         if self.add_wall is not None:
             new_wall = Wall(position=self.add_wall)
             self.grid.wall_locations[tuple(new_wall.position)] = new_wall
+            self.grid.walls_changed()
             self.add_wall = None
             wall_msg = {"type": "wall_built", "wall": new_wall.serialize()}
             msgs["wall"] = wall_msg
 
         return msgs
 
+    def acknowledge_move(self, sequence):
+        """Note that the server has handled the client's move `sequence`,
+        whether or not it was allowed, so the client can drop it from the
+        moves it's still predicting."""
+        if sequence is not None and sequence > self.move_sequence:
+            self.move_sequence = sequence
+
+    def moving_too_soon(self, timestamp=None):
+        """Whether a move now, or at the client's `timestamp`, would come
+        sooner after the last one than the speed limit allows."""
+        if self.motion_speed_limit <= 0:
+            return False
+        wait_time = 1.0 / self.motion_speed_limit
+        if timestamp is None:
+            elapsed = self.grid.elapsed_round_time
+            return elapsed <= (self.motion_timestamp + wait_time)
+        return timestamp <= (self.last_timestamp + wait_time)
+
     def is_neighbor(self, player, d=1):
         """Determine whether other player is adjacent."""
         manhattan_distance = abs(self.position[0] - player.position[0]) + abs(
@@ -1341,6 +1667,7 @@ class Player(object):
             "identity_visible": self.identity_visible,
             "recruiter_id": self.recruiter_id,
             "current_item": self.current_item and self.current_item.serialize(),
+            "move_sequence": self.move_sequence,
         }
 
 
@@ -1349,6 +1676,64 @@ def fermi(beta, p1, p2):
     return 2.0 * ((1.0 / (1 + math.exp(-beta * (p1 - p2)))) - 0.5)
 
 
+class StateScheduler(object):
+    """Decides when to broadcast the state of the game.
+
+    State is published at most once every `interval` seconds, and only when
+    the grid's version has changed since the last broadcast, but at least
+    once every `max_interval` seconds regardless. If serializing and
+    publishing the state take more than `budget` of the interval on average,
+    the interval is doubled, up to `max_interval`, and it's halved back
+    towards `interval` once they take less than half of that.
+    """
+
+    #: Longest to wait before looking for changes again, in seconds
+    poll = 0.005
+
+    #: Weight of each broadcast in the average time they take
+    smoothing = 0.2
+
+    def __init__(self, interval=0.050, max_interval=1.0, budget=0.25):
+        self.min_interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.budget = budget
+        self.interval = interval
+        self.cost = None
+        self.last_published = None
+        self.last_version = None
+
+    @property
+    def rate(self):
+        """Broadcasts per second at the current interval, if the state keeps
+        changing."""
+        return 1.0 / self.interval if self.interval else 0.0
+
+    def delay(self, now, version):
+        """Seconds until the next broadcast is due, given the grid's current
+        `version`, or 0 if it's due now."""
+        if self.last_published is None:
+            return 0.0
+        if version != self.last_version:
+            due = self.last_published + self.interval
+        else:
+            due = self.last_published + self.max_interval
+        return max(due - now, 0.0)
+
+    def published(self, now, version, cost):
+        """Record a broadcast of `version` at `now` that took `cost` seconds,
+        adapting the interval to how long broadcasts are taking."""
+        self.last_published = now
+        self.last_version = version
+        if self.cost is None:
+            self.cost = cost
+        else:
+            self.cost += self.smoothing * (cost - self.cost)
+        if self.cost > self.budget * self.interval:
+            self.interval = min(self.interval * 2, self.max_interval)
+        elif self.cost < self.budget * self.interval / 2:
+            self.interval = max(self.interval / 2, self.min_interval)
+
+
 extra_routes = flask.Blueprint(
     "extra_routes", __name__, template_folder="templates", static_folder="static"
 )
@@ -1374,12 +1759,21 @@ def serve_grid():
     return flask.render_template("grid.html", app_id=config.get("id"))
 
 
+@extra_routes.route("/metrics")
+def serve_metrics():
+    """Return the latest timing and payload metrics saved by the game."""
+    snapshot = db.redis_conn.get(METRICS_KEY)
+    return flask.Response(snapshot or "{}", mimetype="application/json")
+
+
 class Griduniverse(Experiment):
     """Define the structure of the experiment."""
 
     channel = "griduniverse_ctrl"
     state_count = 0
     replay_path = "/grid"
+    # Final payoffs by participant id, once they've been saved or loaded
+    _payoffs = None
 
     def __init__(self, session=None):
         """Initialize the experiment."""
@@ -1398,6 +1792,69 @@ class Griduniverse(Experiment):
             )
             self.session.commit()
 
+    @cached_property
+    def metrics(self):
+        return Metrics()
+
+    @cached_property
+    def state_scheduler(self):
+        return StateScheduler(
+            interval=self.config.get("state_interval", 0.050),
+            max_interval=self.config.get("state_max_interval", 1.0),
+            budget=self.config.get("state_budget", 0.25),
+        )
+
+    @cached_property
+    def _greenlet_local(self):
+        """State kept apart for each greenlet, as messages are handled in
+        greenlets of their own alongside the game loop."""
+        return gevent.local.local()
+
+    @property
+    def _event_batch(self):
+        """Events recorded while this greenlet handles a batch of messages,
+        if it is."""
+        return getattr(self._greenlet_local, "event_batch", None)
+
+    @_event_batch.setter
+    def _event_batch(self, events):
+        self._greenlet_local.event_batch = events
+
+    @property
+    def _outbound(self):
+        """Messages this greenlet is waiting to publish together, while it's
+        queueing them."""
+        return getattr(self._greenlet_local, "outbound", None)
+
+    @_outbound.setter
+    def _outbound(self, messages):
+        self._greenlet_local.outbound = messages
+
+    @cached_property
+    def inbound(self):
+        """Messages waiting to be handled, with the times they arrived."""
+        return collections.deque()
+
+    @cached_property
+    def state_encoder(self):
+        """Encodes persisted states in compact storage, or None if they're
+        stored in full."""
+        if self.config.get("state_storage", "full") != "compact":
+            return None
+        return StateEncoder(
+            keyframe_interval=self.config.get("state_keyframe_interval", 100),
+            compression=self.config.get("state_compression", "none"),
+        )
+
+    @cached_property
+    def state_decoder(self):
+        """Decodes the persisted states being replayed."""
+        return StateDecoder()
+
+    def save_metrics(self):
+        """Save a snapshot of the metrics for the metrics route to serve."""
+        self.redis_conn.set(METRICS_KEY, json.dumps(self.metrics.serialize()))
+
     def configure(self):
         super(Griduniverse, self).configure()
         self.num_participants = self.config.get("max_participants", 3)
@@ -1407,32 +1864,9 @@ class Griduniverse(Experiment):
         )
         self.network_factory = self.config.get("network", "FullyConnected")
 
-        game_config_file = os.path.join(os.path.dirname(__file__), GAME_CONFIG_FILE)
-        with open(game_config_file, "r") as game_config_stream:
-            self.game_config = yaml.safe_load(game_config_stream)
-        self.item_config = {o["item_id"]: o for o in self.game_config.get("items", ())}
-
-        # If any item is missing a key, add it with default value.
-        item_defaults = self.game_config.get("item_defaults", {})
-        for item in self.item_config.values():
-            for prop in item_defaults:
-                if prop not in item:
-                    item[prop] = item_defaults[prop]
-
-        self.transition_config = {}
-        transition_defaults = self.game_config.get("transition_defaults", {})
-        for t in self.game_config.get("transitions", ()):
-            transition = transition_defaults.copy()
-            transition.update(t)
-            if transition["last_use"]:
-                self.transition_config[
-                    ("last", t["actor_start"], t["target_start"])
-                ] = transition
-            else:
-                self.transition_config[
-                    (t["actor_start"], t["target_start"])
-                ] = transition
-
+        self.game_config = load_game_config()
+        self.item_config = self.game_config["item_config"]
+        self.transition_config = self.game_config["transition_config"]
         self.player_config = self.game_config.get("player_config")
         # This is accessed by the grid.html template to load the configuration on the client side:
         # TODO: could this instead be passed as an arg to the template in
@@ -1451,29 +1885,49 @@ class Griduniverse(Experiment):
         for key in GU_PARAMS:
             config.register(key, GU_PARAMS[key])
 
+    #: Id of the environment node, once it's been looked up
+    _environment_id = None
+
     @property
     def environment(self):
-        environment = self.socket_session.query(dallinger.nodes.Environment).one()
-        return environment
+        """The environment node, in the current greenlet's socket session."""
+        if self._environment_id is None:
+            environment = self.socket_session.query(dallinger.nodes.Environment).one()
+            self._environment_id = environment.id
+            return environment
+        return self._node(self._environment_id)
+
+    def _node(self, node_id):
+        """The node with `node_id`, in the current greenlet's socket session.
+
+        Each session queries a node once, so a batch of messages sees
+        whether its nodes have failed since the last batch.
+        """
+        return self.socket_session.query(dallinger.models.Node).get(node_id)
 
     @cached_property
     def socket_session(self):
         from dallinger.db import db_url
 
-        engine = create_engine(db_url, pool_size=1000)
-        session = scoped_session(
-            sessionmaker(autocommit=False, autoflush=True, bind=engine)
+        return greenlet_session(
+            db_url,
+            metrics=self.metrics,
+            pool_size=self.config.get("db_pool_size", POOL_SIZE),
+            max_overflow=self.config.get("db_max_overflow", MAX_OVERFLOW),
+            pool_recycle=self.config.get("db_pool_recycle", POOL_RECYCLE),
         )
-        return session
 
     @property
     def background_tasks(self):
         if self.config.get("replay", False):
             return []
-        return [
+        tasks = [
             self.send_state_thread,
             self.game_loop,
         ]
+        if self.config.get("inbound_batch_interval", 0):
+            tasks.append(self.inbound_thread)
+        return tasks
 
     def create_network(self):
         """Create a new network by reading the configuration file."""
@@ -1510,11 +1964,42 @@ class Griduniverse(Experiment):
 
         Return the value of the bonus to be paid to `participant`.
         """
-        data = self._last_state_for_player(participant.id)
-        if not data:
-            return 0.0
+        payoff = self.payoffs.get(str(participant.id))
+        if payoff is None:
+            data = self._final_summary_for_player(participant.id)
+            if data is None:
+                data = self._last_state_for_player(participant.id)
+            if not data:
+                return 0.0
+            payoff = data["payoff"]
 
-        return float("{0:.2f}".format(data["payoff"]))
+        return float("{0:.2f}".format(payoff))
+
+    @property
+    def payoffs(self):
+        """Each participant's final payoff, by participant id, as saved when
+        the game ended. Empty until then."""
+        if self._payoffs is None:
+            saved = self.redis_conn.hgetall(PAYOFFS_KEY)
+            if not saved:
+                return {}
+            self._payoffs = {}
+            for player_id, payoff in saved.items():
+                if isinstance(player_id, bytes):
+                    player_id = player_id.decode("utf-8")
+                self._payoffs[player_id] = float(payoff)
+        return self._payoffs
+
+    def save_payoffs(self, summary):
+        """Save the final payoffs from the game's last round `summary`, so
+        bonuses can be looked up without reading the final state."""
+        payoffs = {
+            player_id: stats["payoff"]
+            for player_id, stats in summary["players"].items()
+        }
+        if payoffs:
+            self.redis_conn.hset(PAYOFFS_KEY, mapping=payoffs)
+        self._payoffs = payoffs
 
     def bonus_reason(self):
         """The reason offered to the participant for giving the bonus."""
@@ -1523,8 +2008,9 @@ class Griduniverse(Experiment):
             "performance in Griduniverse!"
         )
 
-    def dispatch(self, msg):
-        """Route incoming messages to the appropriate method based on message type"""
+    @cached_property
+    def handlers(self):
+        """Map incoming message types to the methods that handle them"""
         mapping = {
             "connect": self.handle_connect,
             "disconnect": self.handle_disconnect,
@@ -1546,9 +2032,15 @@ class Griduniverse(Experiment):
                     "item_drop": self.handle_item_drop,
                 }
             )
+        return mapping
 
-        if msg["type"] in mapping:
-            mapping[msg["type"]](msg)
+    def dispatch(self, msg):
+        """Route incoming messages to the appropriate method based on message type"""
+        handler = self.handlers.get(msg["type"])
+        if handler is not None:
+            with self.metrics.timer("handle." + msg["type"]):
+                handler(msg)
+            self.grid.changed()
 
     def send(self, raw_message):
         """Socket interface; point of entry for incoming messages.
@@ -1556,50 +2048,228 @@ class Griduniverse(Experiment):
         param raw_message is a string with a channel prefix, for example:
 
             'griduniverse_ctrl:{"type":"move","player_id":0,"move":"left"}'
+
+        If `inbound_batch_interval` is set, the message is queued to be
+        handled with the others that arrive during the interval, or once
+        the game is over, with any still queued straight away.
         """
-        message = self.parse_message(raw_message)
-        if message is not None:
-            message["server_time"] = time.time()
-            self.dispatch((message))
-            if "player_id" in message:
-                self.record_event(message, message["player_id"])
+        if self.config.get("inbound_batch_interval", 0):
+            self.inbound.append((time.time(), raw_message))
+            if self.grid.game_over:
+                self.receive_inbound()
+        else:
+            self.receive([(time.time(), raw_message)])
+
+    def inbound_thread(self):
+        """Handle the queued incoming messages in batches until the game is
+        over, then any left in the queue."""
+        interval = self.config.get("inbound_batch_interval")
+        while not self.grid.game_over:
+            gevent.sleep(interval)
+            try:
+                self.receive_inbound()
+            except Exception:
+                logger.exception("Error handling a batch of messages")
+        self.receive_inbound()
+
+    def receive_inbound(self):
+        """Handle every message queued so far."""
+        raw_messages = []
+        while self.inbound:
+            raw_messages.append(self.inbound.popleft())
+        if raw_messages:
+            self.receive(raw_messages)
+
+    def receive(self, raw_messages):
+        """Handle a batch of raw messages, given with the times they arrived.
+
+        Moves that come too soon after a player's last move are rejected
+        together, with one rejection published per player carrying the
+        highest sequence rejected, as every move up to it has been handled.
+        All of the events recorded while handling the batch are written at
+        once, and the messages published are sent together. A message that
+        can't be handled is logged and skipped, without recording its event.
+        """
+        messages = self.parse_messages(raw_messages)
+        self.metrics.size("inbound.batch", len(messages))
+        rejected = collections.Counter()
+        rejected_sequences = {}
+        self._event_batch = []
+        with released(self.socket_session), self.outbound_batch():
+            try:
+                for message in messages:
+                    try:
+                        if self._move_too_soon(message):
+                            player_id = message["player_id"]
+                            rejected[player_id] += 1
+                            self.grid.players[player_id].acknowledge_move(
+                                message.get("sequence")
+                            )
+                            if message.get("sequence") is not None:
+                                rejected_sequences[player_id] = max(
+                                    message["sequence"],
+                                    rejected_sequences.get(player_id, 0),
+                                )
+                        else:
+                            self.dispatch(message)
+                        if "player_id" in message:
+                            self.record_event(message, message["player_id"])
+                    except Exception:
+                        logger.exception("Error handling message: {}".format(message))
+                for player_id, count in rejected.items():
+                    self.grid.round_stats.add(player_id, "moves_rejected", count)
+                    self.publish(
+                        self._move_rejection(
+                            player_id, rejected_sequences.get(player_id)
+                        )
+                    )
+                    self.metrics.count("moves.coalesced", count - 1)
+            finally:
+                events, self._event_batch = self._event_batch, None
+                self.record_events(events)
+
+    def _move_rejection(self, player_id, sequence=None):
+        """The message telling a client its move was rejected, with the
+        move's sequence number if the client sent one."""
+        message = {"type": "move_rejection", "player_id": player_id}
+        if sequence is not None:
+            message["sequence"] = sequence
+        return message
+
+    def _move_too_soon(self, message):
+        if message.get("type") != "move" or not self.grid.movement_enabled:
+            return False
+        if self.config.get("replay", False):
+            # Moves aren't handled in replay mode
+            return False
+        player = self.grid.players.get(message.get("player_id"))
+        return player is not None and player.moving_too_soon(message.get("timestamp"))
 
     def parse_message(self, raw_message):
         """Strip the channel prefix off the raw message, then return
         the parsed JSON.
         """
-        if raw_message.startswith(self.channel + ":"):
-            body = raw_message.replace(self.channel + ":", "")
-            message = json.loads(body)
-
-            return message
+        prefix = self.channel + ":"
+        start = len(prefix)
+        if raw_message.startswith(prefix):
+            return json.loads(raw_message[start:])
+
+    def parse_messages(self, raw_messages):
+        """Parse a batch of raw messages together, setting the time each one
+        arrived as its `server_time`. Messages for other channels, or that
+        aren't valid JSON, are left out."""
+        prefix = self.channel + ":"
+        start = len(prefix)
+        bodies = []
+        times = []
+        for server_time, raw_message in raw_messages:
+            if raw_message.startswith(prefix):
+                bodies.append(raw_message[start:])
+                times.append(server_time)
+        try:
+            messages = json.loads("[" + ",".join(bodies) + "]")
+        except ValueError:
+            messages = []
+            for body in bodies:
+                try:
+                    messages.append(json.loads(body))
+                except ValueError:
+                    logger.exception("Could not parse message: {}".format(body))
+                    messages.append(None)
+        parsed = []
+        for message, server_time in zip(messages, times):
+            if message is not None:
+                message["server_time"] = server_time
+                parsed.append(message)
+        return parsed
 
     def record_event(self, details, player_id=None):
         """Record an event in the Info table."""
+        info = self._event_info(details, player_id)
+        if info is None:
+            return
+        if self._event_batch is not None:
+            self._event_batch.append(info)
+            return
         session = self.socket_session
+        with self.metrics.timer("db.record_event"):
+            session.add(info)
+            session.commit()
+
+    def record_events(self, infos):
+        """Write a batch of events in a single commit."""
+        if not infos:
+            return
+        session = self.socket_session
+        with self.metrics.timer("db.record_events"):
+            session.add_all(infos)
+            session.commit()
+
+    def _event_info(self, details, player_id=None):
         if player_id == "spectator":
             return
         elif player_id:
-            node_id = self.node_by_player_id[player_id]
-            node = session.query(dallinger.models.Node).get(node_id)
+            node = self._node(self.node_by_player_id[player_id])
         else:
             node = self.environment
 
         try:
-            info = Event(origin=node, details=details)
+            return Event(origin=node, details=details)
         except ValueError:
             logger.info(
                 "Tried to record an event after node#{} failure: {}".format(
                     node.id, details
                 )
             )
-            return
-        session.add(info)
-        session.commit()
 
     def publish(self, msg):
-        """Publish a message to all griduniverse clients"""
-        self.redis_conn.publish("griduniverse", json.dumps(msg))
+        """Publish a message to all griduniverse clients, or queue it if this
+        greenlet is batching outbound messages."""
+        if self._outbound is not None:
+            self._outbound.append(msg)
+        else:
+            self._send([msg])
+
+    @contextmanager
+    def outbound_batch(self):
+        """Queue the messages published in the block and send them together
+        at the end of it, unless they're already being queued."""
+        if self._outbound is not None:
+            yield
+            return
+        self._outbound = []
+        try:
+            yield
+        finally:
+            messages, self._outbound = self._outbound, None
+            self._send(messages)
+
+    def flush_outbound(self):
+        """Send the messages queued so far, and carry on queueing."""
+        if self._outbound:
+            messages, self._outbound = self._outbound, []
+            self._send(messages)
+
+    def _send(self, messages):
+        """Publish messages to Redis in one round trip: framed as a single
+        `batch` message if `batch_outbound` is set, or else pipelined."""
+        if not messages:
+            return
+        if len(messages) > 1 and self.config.get("batch_outbound", False):
+            messages = [{"type": "batch", "messages": messages}]
+        payloads = []
+        for msg in messages:
+            payload = json.dumps(msg)
+            self.metrics.size("publish." + msg.get("type", "unknown"), len(payload))
+            payloads.append(payload)
+        with self.metrics.timer("redis.publish"):
+            if len(payloads) == 1:
+                self.redis_conn.publish("griduniverse", payloads[0])
+            else:
+                pipeline = self.redis_conn.pipeline(transaction=False)
+                for payload in payloads:
+                    pipeline.publish("griduniverse", payload)
+                pipeline.execute()
 
     def handle_connect(self, msg):
         player_id = msg["player_id"]
@@ -1693,16 +2363,15 @@ class Griduniverse(Experiment):
 
     def handle_move(self, msg):
         player = self.grid.players[msg["player_id"]]
+        player.acknowledge_move(msg.get("sequence"))
         try:
             msgs = player.move(msg["move"], timestamp=msg.get("timestamp"))
         except IllegalMove:
-            error_msg = {
-                "type": "move_rejection",
-                "player_id": player.id,
-            }
-            self.publish(error_msg)
+            self.grid.round_stats.add(player.id, "moves_rejected")
+            self.publish(self._move_rejection(player.id, msg.get("sequence")))
         else:
             if msgs is not None:
+                self.grid.round_stats.add(player.id, "moves")
                 msg["actual"] = msgs["direction"]
                 if msgs.get("wall"):
                     wall_msg = msgs.get("wall")
@@ -1731,11 +2400,13 @@ class Griduniverse(Experiment):
 
         if donor.score >= donation and len(recipients):
             donor.score -= donation
+            self.grid.round_stats.add(donor.id, "donated", donation)
             donated = donation * self.grid.donation_multiplier
             if len(recipients) > 1:
                 donated = round(donated / len(recipients), 2)
             for recipient in recipients:
                 recipient.score += donated
+                self.grid.round_stats.add(recipient.id, "received", donated)
             message = {
                 "type": "donation_processed",
                 "donor_id": msg["donor_id"],
@@ -1783,8 +2454,7 @@ class Griduniverse(Experiment):
 
         player_item.remaining_uses -= 1
         if not player_item.remaining_uses:
-            self.grid.items_consumed.append(player_item)
-            self.grid.num_items_consumed += 1
+            self.grid.item_consumed(player_item)
             player.current_item = None
 
         if player.color_idx > 0:
@@ -1793,6 +2463,7 @@ class Griduniverse(Experiment):
             calories = player_item.calories * self.grid.relative_deprivation
 
         player.score += calories
+        self.grid.round_stats.harvest(player.id, player_item.item_id, calories)
         if player_item.public_good:
             for player_to in self.grid.players.values():
                 player_to.score += player_item.public_good
@@ -1851,6 +2522,8 @@ class Griduniverse(Experiment):
             self.publish(error_msg)
             return
 
+        self.grid.round_stats.transition(player.id, target_key or actor_key)
+
         # these values may be positive or negative, so we may add or remove uses
         modify_actor_uses, modify_target_uses = transition.get("modify_uses", (0, 0))
         if player_item and player_item.remaining_uses:
@@ -1862,22 +2535,20 @@ class Griduniverse(Experiment):
         if player_item and (
             (player_item.remaining_uses < 1) or transition["actor_end"] != actor_key
         ):
-            self.grid.items_consumed.append(player_item)
-            self.grid.num_items_consumed += 1
+            self.grid.item_consumed(player_item)
             player.current_item = None
             self.grid.items_updated = True
         if location_item and (
             (location_item.remaining_uses < 1) or transition["target_end"] != target_key
         ):
             del self.grid.item_locations[position]
-            self.grid.items_consumed.append(location_item)
-            self.num_items_consumed += 1
+            self.grid.item_consumed(location_item)
             self.grid.items_updated = True
 
         # The player's item type has changed
         if transition["actor_end"] != actor_key:
             new_player_item = Item(
-                id=len(self.grid.item_locations) + len(self.grid.items_consumed),
+                id=self.grid.allocate_item_id(),
                 item_config=self.item_config[transition["actor_end"]],
             )
             player.current_item = new_player_item
@@ -1886,7 +2557,7 @@ class Griduniverse(Experiment):
         # The location's item type has changed
         if transition["target_end"] != target_key:
             new_target_item = Item(
-                id=len(self.grid.item_locations) + len(self.grid.items_consumed),
+                id=self.grid.allocate_item_id(),
                 position=position,
                 item_config=self.item_config[transition["target_end"]],
             )
@@ -1899,8 +2570,14 @@ class Griduniverse(Experiment):
             per_player = transition_calories // (len(neighbors) + 1)
             for other_player in neighbors:
                 other_player.score += per_player
+                self.grid.round_stats.add(other_player.id, "calories", per_player)
             player.score += per_player
             player.score += transition_calories % (len(neighbors) + 1)
+            self.grid.round_stats.add(
+                player.id,
+                "calories",
+                per_player + transition_calories % (len(neighbors) + 1),
+            )
 
     def handle_item_drop(self, msg):
         player = self.grid.players[msg["player_id"]]
@@ -1929,13 +2606,19 @@ class Griduniverse(Experiment):
         gevent.sleep(1.00)
         last_walls = []
         last_items = []
+        scheduler = self.state_scheduler
 
         # Sleep until we have walls
         while self.grid.walls_density and not self.grid.wall_locations:
             gevent.sleep(0.1)
 
         while True:
-            gevent.sleep(self.config.get("state_interval", 0.050))
+            delay = scheduler.delay(time.time(), self.grid.version)
+            if delay and not self.grid.game_over:
+                gevent.sleep(min(delay, scheduler.poll))
+                continue
+            start = time.time()
+            version = self.grid.version
 
             # Send all item data once every 40 loops
             update_walls = update_items = False
@@ -1955,9 +2638,10 @@ class Griduniverse(Experiment):
             if not last_items or self.grid.items_changed(last_items):
                 update_items = True
 
-            grid_state = self.grid.serialize(
-                include_walls=update_walls, include_items=update_items
-            )
+            with self.metrics.timer("state.serialize"):
+                grid_state = self.grid.serialize(
+                    include_walls=update_walls, include_items=update_items
+                )
 
             if update_walls:
                 last_walls = grid_state["walls"]
@@ -1978,7 +2662,8 @@ class Griduniverse(Experiment):
                     "type": "state",
                     "grid": json.dumps(grid_state),
                     "count": count,
-                    "remaining_time": self.grid.goal_items - len(self.grid.items_consumed),
+                    "remaining_time": self.grid.goal_items
+                    - self.grid.total_items_consumed,
                     "round": self.grid.round,
                 }
 
@@ -1994,37 +2679,42 @@ class Griduniverse(Experiment):
                 }
 
             self.publish(message)
+            scheduler.published(time.time(), version, time.time() - start)
+            self.metrics.gauge("state.interval_ms", scheduler.interval * 1000)
+            self.metrics.gauge("state.rate", scheduler.rate)
             if self.grid.game_over:
                 return
 
     def game_loop(self):
         """Update the world state."""
         gevent.sleep(0.1)
+        # Payoffs saved by an earlier game don't apply to this one
+        self.redis_conn.delete(PAYOFFS_KEY)
         if not self.config.get("replay", False):
             self.grid.build_labyrinth()
             logger.info("Spawning items")
             for item_type in self.item_config.values():
-                for i in range(item_type["item_count"]):
-                    if (i % 250) == 0:
-                        gevent.sleep(0.00001)
-                    self.grid.spawn_item(item_id=item_type["item_id"])
+                self.grid.spawn_items(item_type["item_id"], item_type["item_count"])
+                gevent.sleep(0.00001)
 
         while not self.grid.game_started:
             gevent.sleep(0.01)
 
         previous_second_timestamp = self.grid.start_timestamp
         count = 0
+        tick_budget = self.config.get("state_interval", 0.050)
+        # Messages the game loop publishes are sent together at the end of
+        # each tick
+        self._outbound = []
 
         while not self.grid.game_over:
+            tick_start = time.time()
             # Record grid state to database
-            state_data = self.grid.serialize(
-                include_walls=self.grid.walls_updated,
-                include_items=self.grid.items_updated,
-            )
-            state = self.environment.update(json.dumps(state_data), details=state_data)
-            self.socket_session.add(state)
-            self.socket_session.commit()
+            with self.metrics.timer("tick.persist"):
+                self.persist_state()
             count += 1
+            if self.grid.walls_updated or self.grid.items_updated:
+                self.grid.changed()
             self.grid.walls_updated = False
             self.grid.items_updated = False
             gevent.sleep(0.010)
@@ -2040,62 +2730,110 @@ class Griduniverse(Experiment):
 
             # Update motion.
             if self.grid.motion_auto:
-                for player in self.grid.players.values():
-                    player.move(player.motion_direction, tremble_rate=0)
+                with self.metrics.timer("tick.motion"):
+                    for player in self.grid.players.values():
+                        player.move(player.motion_direction, tremble_rate=0)
 
             # Consume the food.
             if self.grid.consumption_active:
-                self.grid.consume()
+                with self.metrics.timer("tick.consume"):
+                    self.grid.consume()
 
             # Spread through contagion.
             if self.grid.contagion > 0:
-                self.grid.spread_contagion()
+                with self.metrics.timer("tick.contagion"):
+                    self.grid.spread_contagion()
 
             # Trigger time-based events.
             if (now - previous_second_timestamp) > 1.000:
-                # Grow or shrink the item stores.
-                self.grid.replenish_items()
-                # Trigger automatic transitions.
-                self.grid.trigger_transitions()
-
-                abundances = {}
-                for player in self.grid.players.values():
-                    # Apply tax.
-                    player.score = max(player.score - self.grid.tax, 0)
-                    if player.color not in abundances:
-                        abundances[player.color] = 0
-                    abundances[player.color] += 1
-
-                # Apply frequency-dependent payoff.
-                if self.grid.frequency_dependence:
+                with self.metrics.timer("tick.replenish"):
+                    # Grow or shrink the item stores.
+                    self.grid.replenish_items()
+                    # Trigger automatic transitions.
+                    self.grid.trigger_transitions()
+
+                    abundances = {}
                     for player in self.grid.players.values():
-                        relative_frequency = (
-                            1.0 * abundances[player.color] / len(self.grid.players)
-                        )
-                        payoff = (
-                            fermi(
-                                beta=self.grid.frequency_dependence,
-                                p1=relative_frequency,
-                                p2=0.5,
+                        # Apply tax.
+                        player.score = max(player.score - self.grid.tax, 0)
+                        if player.color not in abundances:
+                            abundances[player.color] = 0
+                        abundances[player.color] += 1
+
+                    # Apply frequency-dependent payoff.
+                    if self.grid.frequency_dependence:
+                        for player in self.grid.players.values():
+                            relative_frequency = (
+                                1.0 * abundances[player.color] / len(self.grid.players)
+                            )
+                            payoff = (
+                                fermi(
+                                    beta=self.grid.frequency_dependence,
+                                    p1=relative_frequency,
+                                    p2=0.5,
+                                )
+                                * self.grid.frequency_dependent_payoff_rate
                             )
-                            * self.grid.frequency_dependent_payoff_rate
-                        )
-
-                        player.score = max(player.score + payoff, 0)
 
+                            player.score = max(player.score + payoff, 0)
+                self.grid.changed()
                 previous_second_timestamp = now
+                self.save_metrics()
 
-            self.grid.compute_payoffs()
+            with self.metrics.timer("tick.payoffs"):
+                self.grid.compute_payoffs()
             game_round = self.grid.round
             self.grid.check_round_completion()
+            if self.grid.round != game_round:
+                self.grid.changed()
             if self.grid.round != game_round and not self.grid.game_over:
+                self.record_event(self.grid.end_round_stats())
                 self.publish({"type": "new_round", "round": self.grid.round})
                 self.record_event({"type": "new_round", "round": self.grid.round})
 
+            self.flush_outbound()
+            tick_time = time.time() - tick_start
+            self.metrics.timings["tick"].record(tick_time * 1000)
+            if tick_time > tick_budget:
+                self.metrics.count("tick_overruns")
+
+        self.flush_outbound()
+        self._outbound = None
+        if self.state_encoder is not None:
+            # End on a keyframe, so the final state can be read on its own
+            self.persist_state(keyframe=True)
+        summary = self.grid.end_round_stats()
+        self.record_event(summary)
+        self.save_payoffs(summary)
         self.publish({"type": "stop"})
         self.socket_session.commit()
+        self.socket_session.remove()
+        self.save_metrics()
+        if self.config.get("log_metrics", False):
+            logger.info("Game metrics: {}".format(self.metrics.serialize()))
         return
 
+    def persist_state(self, keyframe=False):
+        """Record the grid state in the database. Walls and items are only
+        included when they've changed, or in a compact storage keyframe."""
+        encoder = self.state_encoder
+        if encoder is None:
+            state_data = self.grid.serialize(
+                include_walls=self.grid.walls_updated,
+                include_items=self.grid.items_updated,
+            )
+            contents, details = json.dumps(state_data), state_data
+        else:
+            keyframe = keyframe or encoder.keyframe_due
+            state_data = self.grid.serialize(
+                include_walls=self.grid.walls_updated or keyframe,
+                include_items=self.grid.items_updated or keyframe,
+            )
+            contents, details = encoder.encode(state_data, keyframe=keyframe)
+        state = self.environment.update(contents, details=details)
+        self.socket_session.add(state)
+        self.socket_session.commit()
+
     def player_feedback(self, data):
         engagement = int(json.loads(data.questions.list[-1][-1])["engagement"])
         difficulty = int(json.loads(data.questions.list[-1][-1])["difficulty"])
@@ -2105,8 +2843,28 @@ class Griduniverse(Experiment):
         except IndexError:
             return engagement, difficulty
 
+    #: Seconds of game time between replay keyframes
+    replay_keyframe_interval = 10
+
+    #: Types of recorded events that are replayed, besides grid states
+    replay_event_types = {"chat", "new_round", "donation_processed", "color_changed"}
+
+    @contextmanager
+    def restore_state_from_replay(
+        self, app_id, session, zip_path=None, **configuration_options
+    ):
+        if zip_path is None:
+            zip_path = find_experiment_export(app_id)
+        self._replay_zip_path = zip_path
+        self._replay_keyframes = None
+        with super(Griduniverse, self).restore_state_from_replay(
+            app_id, session, zip_path=zip_path, **configuration_options
+        ) as scrubber:
+            yield scrubber
+
     def replay_start(self):
         self.grid = Gridworld(log_event=self.record_event, **self.config.as_dict())
+        self.state_decoder = StateDecoder()
 
     def replay_started(self):
         return self.grid.game_started
@@ -2124,12 +2882,46 @@ class Griduniverse(Experiment):
             # If we don't have a specific target time we can't optimise some states away
             return events
 
+        self.seek_to_keyframe(target, events)
+
         # We never care about events after the target time or before the current state
         events = events.filter(
             info_cls.creation_time <= target,
             info_cls.creation_time > self._replay_time_index,
         )
 
+        # Get all eligible updates of the replayed types
+        typed_events = self._replayed_typed_events(events)
+
+        first_state = (
+            events.filter(info_cls.type == "state")
+            .with_entities(info_cls.details)
+            .first()
+        )
+        if first_state is not None and is_compact(first_state.details):
+            # Compact states only hold what changed since the previous one, so
+            # replay every state since the most recent full keyframe
+            state_events = events.filter(info_cls.type == "state")
+            keyframe = (
+                state_events.filter(Event.details["keyframe"].astext == "true")
+                .order_by(Event.creation_time.desc())
+                .with_entities(info_cls.creation_time)
+                .first()
+            )
+            if keyframe is not None:
+                state_events = state_events.filter(
+                    info_cls.creation_time >= keyframe.creation_time
+                )
+            merged_events = state_events.union(typed_events).order_by(
+                Event.creation_time.asc()
+            )
+            return merged_events.with_entities(
+                info_cls.type,
+                info_cls.creation_time,
+                info_cls.details,
+                info_cls.contents,
+            )
+
         # Get the most recent eligible update that changed the food positions
         item_events = (
             events.filter(
@@ -2160,20 +2952,92 @@ class Griduniverse(Experiment):
             .limit(1)
         )
 
-        # Get all eligible updates of the below types
-        event_types = {"chat", "new_round", "donation_processed", "color_changed"}
-        typed_events = events.filter(
-            info_cls.type == "event", Event.details["type"].astext.in_(event_types)
-        )
-
         # Merge the above four queries, discarding duplicates, and put them in time ascending order
         merged_events = item_events.union(
             wall_events, update_events, typed_events
         ).order_by(Event.creation_time.asc())
 
-        # Limit the query to the type, the effective time and the JSONB field containing the data
+        # Limit the query to the type, the effective time and the fields containing the data
         return merged_events.with_entities(
-            info_cls.type, info_cls.creation_time, info_cls.details
+            info_cls.type, info_cls.creation_time, info_cls.details, info_cls.contents
+        )
+
+    @property
+    def replay_keyframes(self):
+        """The keyframe index for the imported dataset, stored alongside
+        the export and only built the first time it is replayed."""
+        if self._replay_keyframes is None:
+            info_cls = dallinger.models.Info
+
+            def events():
+                return (
+                    self.import_session.query(
+                        info_cls.type,
+                        info_cls.creation_time,
+                        info_cls.details,
+                        info_cls.contents,
+                    )
+                    .order_by(info_cls.creation_time, info_cls.id)
+                    .yield_per(1000)
+                )
+
+            self._replay_keyframes = KeyframeIndex.for_export(
+                self._replay_zip_path, events, interval=self.replay_keyframe_interval
+            )
+        return self._replay_keyframes
+
+    def _replayed_typed_events(self, events):
+        """Filter a query of `events` down to the recorded events of the
+        replayed types."""
+        info_cls = dallinger.models.Info
+        from .models import Event
+
+        return events.filter(
+            info_cls.type == "event",
+            Event.details["type"].astext.in_(self.replay_event_types),
+        )
+
+    def seek_to_keyframe(self, target, events=None):
+        """Restore the full grid from the latest keyframe before `target`, if
+        it is ahead of the current replay position, so that only the events
+        since that keyframe need to be replayed.
+
+        Keyframes only hold the grid, so the events of the replayed types
+        skipped over, from the query of `events` if given, are replayed first.
+        """
+        keyframe = self.replay_keyframes.nearest(target)
+        if keyframe is None or keyframe.time <= self._replay_time_index:
+            return
+        if events is not None:
+            info_cls = dallinger.models.Info
+            skipped = (
+                self._replayed_typed_events(events)
+                .filter(
+                    info_cls.creation_time > self._replay_time_index,
+                    info_cls.creation_time <= keyframe.time,
+                )
+                .order_by(info_cls.creation_time.asc())
+                .with_entities(
+                    info_cls.type,
+                    info_cls.creation_time,
+                    info_cls.details,
+                    info_cls.contents,
+                )
+            )
+            for event in skipped:
+                self.replay_event(event)
+        self.state_count += 1
+        self.grid.deserialize(keyframe.state)
+        self.state_decoder.seed(keyframe.state)
+        self._replay_time_index = keyframe.time
+        self.publish(
+            {
+                "type": "state",
+                "grid": keyframe.state,
+                "count": self.state_count,
+                "remaining_time": self.grid.remaining_round_time,
+                "round": keyframe.state["round"],
+            }
         )
 
     def replay_event(self, event):
@@ -2193,10 +3057,9 @@ class Griduniverse(Experiment):
 
         if event.type == "state":
             self.state_count += 1
-            state = event.details
-            if not state:
-                # Allow loading older exports that didn't fill the details column
-                state = json.loads(event.contents)
+            # Older exports didn't fill the details column, and compact states
+            # need decoding against the ones before
+            state = self.state_decoder.decode(event.contents, event.details)
             msg = {
                 "type": "state",
                 "grid": state,
@@ -2207,6 +3070,26 @@ class Griduniverse(Experiment):
             self.grid.deserialize(state)
             self.publish(msg)
 
+    def replay_export(self, zip_path, until=None):
+        """Replay a dataset export straight from its zip file, up to the time
+        `until` if given, without importing it into a database first.
+
+        Rows are streamed from the export in creation time order, so memory
+        use doesn't grow with the length of the game.
+        """
+        self.replay_start()
+        self.state_count = 0
+        for info in read_infos(zip_path):
+            if until is not None and info.creation_time > until:
+                break
+            if info.type == "state" or (
+                info.type == "event"
+                and info.details.get("type") in self.replay_event_types
+            ):
+                self.replay_event(info)
+                self._replay_time_index = info.creation_time
+        self.replay_finish()
+
     @property
     def usable_replay_range(self):
         # Start when the first player connects
@@ -2231,11 +3114,13 @@ class Griduniverse(Experiment):
         self._replay_time_index = self.usable_replay_range[0] - datetime.timedelta(
             minutes=1
         )
-        self.grid.chat_message_history = []
+        self.grid.chat_message_history.clear()
         self.state_count = 0
+        self.state_decoder = StateDecoder()
         self.grid.players = {}
         self.grid.item_locations = {}
         self.grid.wall_locations = {}
+        self.grid.walls_changed()
 
     def replay_finish(self):
         self.publish({"type": "stop"})
@@ -2250,127 +3135,64 @@ class Griduniverse(Experiment):
             }
         )
 
-    def isplit(self, seq, splitters):
-        """Split a list into nested lists on a value (or tuple or list of values)
-        https://stackoverflow.com/questions/4322705/split-a-list-into-nested-lists-on-a-value
-        auxilary function to number_of_actions"""
-        return [
-            list(g)
-            for k, g in itertools.groupby(seq, lambda x: x in splitters)
-            if not k
-        ]
+    def _analysis(self, data):
+        """Parse `data` for analysis, reusing the result for the same data."""
+        from .analysis import GameAnalysis
 
-    def number_of_actions_per_round(self, origin_ids, moves):
-        """Calculate number of moves/player for a specific round
-        auxilary function to number_of_actions"""
-        player_move_data = []
-        for player in origin_ids:
-            players_moves = [
-                x for x in moves if x[11] == player
-            ]  # Get all the moves of a player
-            if len(players_moves) != 0:
-                player_id = json.loads(players_moves[0][9])["player_id"]
-                player_move_data.append(
-                    {"player_id": player_id, "total_moves": len(players_moves)}
-                )
-        return player_move_data
+        if getattr(self, "_analysed_data", None) is not data:
+            self._analysed_data = data
+            self._game_analysis = GameAnalysis(data)
+        return self._game_analysis
 
     def number_of_actions(self, data):
         """Return a dictionary containing the # of actions taken
         for each participant per round"""
-        df = data.infos.df
-        dataState = df.loc[df["type"] == "state"]
-        if dataState.empty:
-            return []
-        dlist = data.infos.list
-        moves_and_round_breaks = [
-            x
-            for x in dlist
-            if x[10] == "event" and ("move" in x[9] or "new_round" in x[9])
-        ]
-        # Find all the round dividers/breaks
-        round_breaks = [x for x in moves_and_round_breaks if "new_round" in x[9]]
-
-        # Get the unique origin_id for each player to differentiate players
-        moves = [x for x in moves_and_round_breaks if "move" in x[9]]
-        origin_ids = [set(x[11] for x in moves)][0]
-
-        # Split the move data of entire game into lists containing move data for each round
-        rounds_moves = self.isplit(moves_and_round_breaks, round_breaks)
-
-        # Parse each rounds moves, one at a time
-        round_number = 1
-        number_of_actions_data = []
-        for moves in rounds_moves:
-            # Note that the round number might not match how griduniverse numbers the rounds
-            # However the system used here to # rounds is verified to be accurate chronologically
-            # Round 1 happened before round 2 etc
-            data_dict = {
-                "round_number": round_number,
-                "round_data": self.number_of_actions_per_round(origin_ids, moves),
-            }
-            number_of_actions_data.append(data_dict)
-            round_number += 1
-
-        return number_of_actions_data
+        return self._analysis(data).number_of_actions()
 
     def average_time_to_start(self, data):
         """The average time to start the game.
-        Compare the time of participant's first move info to the network creation timr
+        Compare the time of participant's first move info to the network creation time
         """
-        df = data.infos.df
-        dataState = df.loc[df["type"] == "state"]
-        if dataState.empty:
-            return str(datetime.timedelta(0))
-        network_creation_time = data.networks.list[0][1]
-        dlist = data.infos.list
-        moves = [x for x in dlist if x[10] == "event" and "move" in x[9]]
-
-        # Get the unique origin_id for each player to differentiate players
-        origin_ids = set(x[11] for x in moves)
-
-        deltasum = datetime.timedelta(0)  # init
-        delta_count = 0
-        for player in origin_ids:
-            players_moves = [
-                x for x in moves if x[11] == player
-            ]  # get all the moves of a player
-            if len(players_moves) != 0:  # Is it possible that the player does not move?
-                # Use the time of their first move
-                delta = players_moves[0][1] - network_creation_time
-                delta_count += 1
-                # Add up the time diffs
-                deltasum += delta
-
-        # Divide by number of players that moved (which should match the # of players present)
-        if delta_count != 0:
-            return str(deltasum / delta_count)
-        return str(deltasum)  # in case nobody moved
+        return self._analysis(data).average_time_to_start()
 
     def average_payoff(self, data):
-        df = data.infos.df
-        dataState = df.loc[df["type"] == "state"]
-        if dataState.empty:
-            return 0.0
-        final_state = json.loads(dataState.iloc[-1][-1])
-        players = final_state["players"]
-        payoff = [player["payoff"] for player in players]
-        return float(sum(payoff)) / len(payoff)
+        return self._analysis(data).average_payoff()
 
     def average_score(self, data):
-        df = data.infos.df
-        dataState = df.loc[df["type"] == "state"]
-        if dataState.empty:
-            return 0.0
-        final_state = json.loads(dataState.iloc[-1][-1])
-        players = final_state["players"]
-        scores = [player["score"] for player in players]
-        return float(sum(scores)) / len(scores)
+        return self._analysis(data).average_score()
+
+    def _final_summary_for_player(self, player_id):
+        """The player's totals from the summary recorded at the end of the
+        game, if there is one."""
+        summary = (
+            self.session.query(Event)
+            .filter(Event.details["type"].astext == "round_summary")
+            .order_by(Event.creation_time.desc())
+            .first()
+        )
+        if summary is not None and summary.details.get("game_over"):
+            return summary.details["players"].get(str(player_id))
+
+    def _latest_state(self):
+        """The latest grid state recorded, decoded forward from the latest
+        keyframe if states are stored compactly, or None."""
+        state_cls = dallinger.information.State
+        with released(self.socket_session):
+            states = (
+                self.socket_session.query(state_cls.contents, state_cls.details)
+                .filter(
+                    state_cls.origin_id == self.environment.id,
+                    state_cls.failed.is_(False),
+                )
+                .order_by(state_cls.creation_time.desc(), state_cls.id.desc())
+                .yield_per(100)
+            )
+            return decode_latest(states)
 
     def _last_state_for_player(self, player_id):
-        most_recent_grid_state = self.environment.state()
+        most_recent_grid_state = self._latest_state()
         if most_recent_grid_state is not None:
-            players = json.loads(most_recent_grid_state.contents)["players"]
+            players = most_recent_grid_state["players"]
             id_matches = [p for p in players if int(p["id"]) == player_id]
             if id_matches:
                 return id_matches[0]
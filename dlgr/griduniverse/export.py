@@ -0,0 +1,282 @@
+"""Convert Griduniverse dataset exports into columnar Parquet tables.
+
+Each state in a Dallinger export is one large JSON blob in a CSV cell. This
+module streams an export once and writes three tables that can be memory
+mapped and filtered without parsing any JSON:
+
+``events``
+    One row per recorded event, with its common fields as columns.
+``players``
+    The position, score and payoff of every player in every grid state.
+``items``
+    One row per item, from the state it first appeared in until the state it
+    was last seen in.
+
+Each table is a directory of Parquet files partitioned by game round, in the
+Hive ``round=N`` layout understood by ``pyarrow.dataset`` and pandas. Requires
+pyarrow, which is installed with the ``export`` extra.
+
+Usage::
+
+    python -m dlgr.griduniverse.export <export.zip> <output directory>
+"""
+import argparse
+import json
+import logging
+import os
+
+import pyarrow
+import pyarrow.dataset
+
+from .replay import read_infos
+from .storage import StateDecoder
+
+logger = logging.getLogger(__file__)
+
+EVENT_SCHEMA = pyarrow.schema(
+    [
+        ("id", pyarrow.int64()),
+        ("time", pyarrow.timestamp("us")),
+        ("round", pyarrow.int64()),
+        ("type", pyarrow.string()),
+        ("player_id", pyarrow.string()),
+        ("move", pyarrow.string()),
+        ("item_id", pyarrow.string()),
+        ("position_row", pyarrow.int64()),
+        ("position_column", pyarrow.int64()),
+        ("contents", pyarrow.string()),
+        ("timestamp", pyarrow.float64()),
+        ("server_time", pyarrow.float64()),
+        # Any other fields, as JSON
+        ("details", pyarrow.string()),
+    ]
+)
+
+PLAYER_SCHEMA = pyarrow.schema(
+    [
+        ("state_id", pyarrow.int64()),
+        ("time", pyarrow.timestamp("us")),
+        ("round", pyarrow.int64()),
+        ("player_id", pyarrow.string()),
+        ("row", pyarrow.int64()),
+        ("column", pyarrow.int64()),
+        ("score", pyarrow.float64()),
+        ("payoff", pyarrow.float64()),
+        ("color", pyarrow.string()),
+        ("current_item", pyarrow.int64()),
+    ]
+)
+
+ITEM_SCHEMA = pyarrow.schema(
+    [
+        ("id", pyarrow.int64()),
+        ("round", pyarrow.int64()),
+        ("item_id", pyarrow.string()),
+        ("first_seen", pyarrow.timestamp("us")),
+        ("last_seen", pyarrow.timestamp("us")),
+        ("row", pyarrow.int64()),
+        ("column", pyarrow.int64()),
+        ("final_row", pyarrow.int64()),
+        ("final_column", pyarrow.int64()),
+    ]
+)
+
+#: Event fields stored in their own columns rather than in `details`
+EVENT_COLUMNS = {"type", "player_id", "move", "item_id", "position", "contents"}
+EVENT_COLUMNS.update({"timestamp", "server_time", "round"})
+
+
+def _text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return str(value)
+
+
+def _position(position):
+    if isinstance(position, (list, tuple)) and len(position) == 2:
+        return position
+    return (None, None)
+
+
+class TableWriter(object):
+    """Buffers rows for one table and writes them out in partitioned batches."""
+
+    def __init__(self, path, schema, batch_rows=50000):
+        self.path = path
+        self.schema = schema
+        self.batch_rows = batch_rows
+        self.rows = []
+        self.batches = 0
+        self.rows_written = 0
+
+    def append(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        table = pyarrow.Table.from_pylist(self.rows, schema=self.schema)
+        pyarrow.dataset.write_dataset(
+            table,
+            self.path,
+            format="parquet",
+            partitioning=pyarrow.dataset.partitioning(
+                pyarrow.schema([("round", pyarrow.int64())]), flavor="hive"
+            ),
+            basename_template="part-{:05d}-{{i}}.parquet".format(self.batches),
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        self.batches += 1
+        self.rows_written += len(self.rows)
+        self.rows = []
+
+
+class ColumnarExport(object):
+    """Streams the infos of an export into the events, players and items
+    tables under `output_dir`."""
+
+    def __init__(self, output_dir, batch_rows=50000):
+        self.events = TableWriter(
+            os.path.join(output_dir, "events"), EVENT_SCHEMA, batch_rows
+        )
+        self.players = TableWriter(
+            os.path.join(output_dir, "players"), PLAYER_SCHEMA, batch_rows
+        )
+        self.items = TableWriter(
+            os.path.join(output_dir, "items"), ITEM_SCHEMA, batch_rows
+        )
+        self.round = 0
+        self._live_items = {}
+        self._decoder = StateDecoder()
+
+    def add(self, info):
+        if info.type == "event":
+            self.add_event(info)
+        elif info.type == "state":
+            self.add_state(info)
+
+    def add_event(self, info):
+        details = info.details
+        if details.get("type") == "new_round":
+            self.round = details.get("round", self.round + 1)
+        row, column = _position(details.get("position"))
+        extra = {k: v for k, v in details.items() if k not in EVENT_COLUMNS}
+        self.events.append(
+            {
+                "id": info.id,
+                "time": info.creation_time,
+                "round": self.round,
+                "type": details.get("type"),
+                "player_id": _text(details.get("player_id")),
+                "move": _text(details.get("move")),
+                "item_id": _text(details.get("item_id")),
+                "position_row": row,
+                "position_column": column,
+                "contents": _text(details.get("contents")),
+                "timestamp": details.get("timestamp"),
+                "server_time": details.get("server_time"),
+                "details": json.dumps(extra) if extra else None,
+            }
+        )
+
+    def add_state(self, info):
+        state = self._decoder.decode(info.contents, info.details)
+        self.round = state.get("round", self.round)
+        for player in state.get("players", ()):
+            row, column = _position(player.get("position"))
+            current_item = player.get("current_item")
+            self.players.append(
+                {
+                    "state_id": info.id,
+                    "time": info.creation_time,
+                    "round": self.round,
+                    "player_id": _text(player["id"]),
+                    "row": row,
+                    "column": column,
+                    "score": player.get("score"),
+                    "payoff": player.get("payoff"),
+                    "color": _text(player.get("color")),
+                    "current_item": current_item and current_item["id"],
+                }
+            )
+        # Older exports called items "food"
+        items = state.get("items", state.get("food"))
+        if items is not None:
+            self.update_items(info, items)
+
+    def update_items(self, info, items):
+        """Track which items are on the grid, finishing the records of items
+        that are no longer there."""
+        seen = set()
+        for item in items:
+            seen.add(item["id"])
+            record = self._live_items.get(item["id"])
+            row, column = _position(item.get("position"))
+            if record is None:
+                record = self._live_items[item["id"]] = {
+                    "id": item["id"],
+                    "round": self.round,
+                    "item_id": _text(item.get("item_id")),
+                    "first_seen": info.creation_time,
+                    "row": row,
+                    "column": column,
+                }
+            record.update(
+                {
+                    "last_seen": info.creation_time,
+                    "final_row": row,
+                    "final_column": column,
+                }
+            )
+        for item_id in list(self._live_items):
+            if item_id not in seen:
+                self.items.append(self._live_items.pop(item_id))
+
+    def close(self):
+        for record in self._live_items.values():
+            self.items.append(record)
+        self._live_items = {}
+        for table in (self.events, self.players, self.items):
+            table.flush()
+
+
+def export_columnar(zip_path, output_dir, batch_rows=50000):
+    """Convert the dataset export at `zip_path` into Parquet tables under
+    `output_dir`, returning the number of rows written to each table."""
+    export = ColumnarExport(output_dir, batch_rows=batch_rows)
+    for info in read_infos(zip_path):
+        export.add(info)
+    export.close()
+    counts = {
+        "events": export.events.rows_written,
+        "players": export.players.rows_written,
+        "items": export.items.rows_written,
+    }
+    logger.info("Exported {} to {}: {}".format(zip_path, output_dir, counts))
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert a Griduniverse dataset export to Parquet tables."
+    )
+    parser.add_argument("zip_path", help="Dallinger dataset export (.zip)")
+    parser.add_argument("output_dir", help="Directory to write the tables to")
+    parser.add_argument(
+        "--batch-rows",
+        type=int,
+        default=50000,
+        help="Rows buffered per table before they are written out",
+    )
+    args = parser.parse_args(argv)
+    counts = export_columnar(args.zip_path, args.output_dir, args.batch_rows)
+    for table, count in counts.items():
+        print("{}: {} rows".format(table, count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,568 @@
+"""Load test the server path of a Griduniverse game.
+
+Streams of client messages, either synthetic or taken from a recorded
+dataset, are delivered at a chosen rate to the experiment's `send` method,
+as the websocket handler would deliver them. Each message then goes through
+`dispatch`, its handler, `record_event` and any broadcasts `publish` makes.
+The time from when each message was due until it has been fully handled is
+reported as latency percentiles, and the highest rate a game sustains within
+a latency budget can be searched for::
+
+    python -m dlgr.griduniverse.loadtest --players 100 --rate 500
+    python -m dlgr.griduniverse.loadtest --players 100 --find-max-rate
+
+By default Redis and the database session are replaced with in-memory
+stand-ins. With ``--redis-url``, messages go through the control channel of
+a real Redis server and broadcasts are published to it, and with
+``--database-url`` events are committed to the Info table of that database.
+"""
+import argparse
+import collections
+import json
+import logging
+import sys
+import threading
+import time
+
+import dallinger.db
+import dallinger.models
+import dallinger.nodes
+import numpy
+
+from .benchmark import Scenario, World
+from .replay import read_infos
+from .sessions import greenlet_session
+from .simulation import SimulatedGriduniverse
+
+logger = logging.getLogger(__file__)
+
+#: Types of message sent by clients, as opposed to events the server records
+CLIENT_MESSAGE_TYPES = {
+    "chat",
+    "change_color",
+    "move",
+    "donation_submitted",
+    "plant_food",
+    "toggle_visible",
+    "build_wall",
+    "item_pick_up",
+    "item_consume",
+    "item_transition",
+    "item_drop",
+}
+
+#: Fields added to recorded messages by the server
+SERVER_FIELDS = {"server_time", "actual", "success", "old_color", "new_color"}
+
+MOVES = ("up", "down", "left", "right")
+
+
+class FakeRedis(object):
+    """Stands in for the Redis connection broadcasts are published to."""
+
+    def __init__(self):
+        self.published = 0
+        self.bytes_published = 0
+        self.round_trips = 0
+
+    def publish(self, channel, payload):
+        self.published += 1
+        self.bytes_published += len(payload)
+        self.round_trips += 1
+        return 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+    """Collects the messages published through it until it's executed."""
+
+    def __init__(self, redis_conn):
+        self.redis_conn = redis_conn
+        self.payloads = []
+
+    def publish(self, channel, payload):
+        self.payloads.append((channel, payload))
+        return self
+
+    def execute(self):
+        for channel, payload in self.payloads:
+            self.redis_conn.published += 1
+            self.redis_conn.bytes_published += len(payload)
+        self.redis_conn.round_trips += 1
+        results = [0] * len(self.payloads)
+        self.payloads = []
+        return results
+
+
+class FakeSession(object):
+    """Stands in for the database session, giving what it commits ids and
+    keeping the events committed together in `committed`."""
+
+    def __init__(self):
+        self.nodes = {}
+        self.pending = []
+        self.committed = []
+
+    def query(self, model):
+        return self
+
+    def get(self, node_id):
+        return self.nodes.get(node_id)
+
+    def add(self, instance):
+        self.pending.append(instance)
+
+    def add_all(self, instances):
+        self.pending.extend(instances)
+
+    def commit(self):
+        events = []
+        for instance in self.pending:
+            if isinstance(instance, dallinger.models.Node):
+                instance.id = len(self.nodes) + 1
+                self.nodes[instance.id] = instance
+            elif isinstance(instance, dallinger.models.Info):
+                events.append(instance)
+        if events:
+            self.committed.append(events)
+        self.pending = []
+
+    def remove(self):
+        self.pending = []
+
+
+def add_nodes(session, player_ids):
+    """Add a network with an environment and a node for each player to
+    `session`, and return the environment's id and the players' node ids."""
+    network = dallinger.models.Network(max_size=len(player_ids) + 1)
+    # Networks count their nodes through Dallinger's own session
+    network.calculate_full = lambda: None
+    environment = dallinger.nodes.Environment(network=network)
+    nodes = {
+        player_id: dallinger.models.Node(network=network) for player_id in player_ids
+    }
+    session.add_all([network, environment] + list(nodes.values()))
+    session.commit()
+    return environment.id, {player_id: node.id for player_id, node in nodes.items()}
+
+
+class LoadTestGriduniverse(SimulatedGriduniverse):
+    """A Griduniverse experiment whose broadcasts go to `redis_conn`, and
+    whose events are committed in `session`, through the usual `send` path."""
+
+    def __init__(self, grid, redis_conn=None, session=None, config=None):
+        super(LoadTestGriduniverse, self).__init__(grid, config=config)
+        self.redis_conn = redis_conn or FakeRedis()
+        self.socket_session = session or FakeSession()
+        self._environment_id, self.node_by_player_id = add_nodes(
+            self.socket_session, grid.players
+        )
+
+    def publish(self, msg):
+        super(SimulatedGriduniverse, self).publish(msg)
+        self.messages_published += 1
+
+    def record_event(self, details, player_id=None):
+        self.events_recorded += 1
+        super(SimulatedGriduniverse, self).record_event(details, player_id)
+
+
+def synthetic_stream(player_ids, count, chat_rate=0.01, seed=0):
+    """Return `count` messages from random players, each a move in a random
+    direction or, with probability `chat_rate`, a chat message, spaced one
+    second apart (see `retime`)."""
+    rng = numpy.random.RandomState(seed)
+    player_ids = list(player_ids)
+    players = rng.randint(len(player_ids), size=count)
+    chats = rng.random_sample(count) < chat_rate
+    moves = rng.randint(len(MOVES), size=count)
+    stream = []
+    for i in range(count):
+        msg = {"player_id": player_ids[players[i]], "timestamp": float(i)}
+        if chats[i]:
+            msg.update({"type": "chat", "contents": "Message {}".format(i)})
+        else:
+            msg.update({"type": "move", "move": MOVES[moves[i]]})
+        stream.append((float(i), msg))
+    return stream
+
+
+def recorded_stream(zip_path, player_ids):
+    """Return the client messages recorded in a dataset export, at their
+    original offsets in seconds from the first one. The recorded players
+    are assigned to `player_ids` in the order they first appear."""
+    player_ids = list(player_ids)
+    players = {}
+    stream = []
+    start = None
+    for info in read_infos(zip_path):
+        details = info.details
+        if info.type != "event" or details.get("type") not in CLIENT_MESSAGE_TYPES:
+            continue
+        if details.get("player_id") is None:
+            continue
+        if start is None:
+            start = info.creation_time
+        player = details["player_id"]
+        if player not in players:
+            players[player] = player_ids[len(players) % len(player_ids)]
+        msg = {k: v for k, v in details.items() if k not in SERVER_FIELDS}
+        msg["player_id"] = players[player]
+        stream.append(((info.creation_time - start).total_seconds(), msg))
+    return stream
+
+
+def retime(stream, rate=None):
+    """Rescale the offsets of a stream so that messages arrive at an average
+    of `rate` per second, keeping their relative timing. With no rate, every
+    message is due at once."""
+    if not rate:
+        return [(0.0, msg) for _, msg in stream]
+    span = stream[-1][0] - stream[0][0] if stream else 0
+    if not span:
+        return [(i / float(rate), msg) for i, (_, msg) in enumerate(stream)]
+    scale = (len(stream) - 1) / (span * rate)
+    return [((offset - stream[0][0]) * scale, msg) for offset, msg in stream]
+
+
+class DirectTransport(object):
+    """Hands each message straight to the experiment's `send`."""
+
+    #: How often `poll` needs to be called, in seconds
+    interval = float("inf")
+
+    def __init__(self, game):
+        self.game = game
+        self.latencies = []
+
+    def deliver(self, raw_message, due):
+        self.game.send(raw_message)
+        self.latencies.append(time.perf_counter() - due)
+
+    def poll(self):
+        pass
+
+    def wait(self, count, timeout=None):
+        return len(self.latencies) >= count
+
+
+class BatchTransport(DirectTransport):
+    """Hands each message to the experiment's `send` to be queued, and has
+    the queue handled every `interval` seconds, as the experiment's inbound
+    thread does when `inbound_batch_interval` is set."""
+
+    def __init__(self, game, interval):
+        super(BatchTransport, self).__init__(game)
+        self.interval = interval
+        self.due = []
+        self.next_batch = time.perf_counter() + interval
+
+    def deliver(self, raw_message, due):
+        self.poll()
+        self.game.send(raw_message)
+        self.due.append(due)
+
+    def poll(self):
+        if time.perf_counter() >= self.next_batch:
+            self.flush()
+
+    def flush(self):
+        self.game.receive_inbound()
+        now = time.perf_counter()
+        self.latencies.extend(now - due for due in self.due)
+        self.due = []
+        self.next_batch = now + self.interval
+
+    def wait(self, count, timeout=None):
+        self.flush()
+        return len(self.latencies) >= count
+
+
+class RedisTransport(DirectTransport):
+    """Publishes each message to the experiment's control channel on a Redis
+    server, as the websocket route does, and hands the messages received
+    from the channel to the experiment's `send` in a background thread."""
+
+    def __init__(self, game, redis_conn):
+        super(RedisTransport, self).__init__(game)
+        self.redis_conn = redis_conn
+        self.due = collections.deque()
+        self.pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(game.channel)
+        self.thread = threading.Thread(target=self.listen, daemon=True)
+        self.thread.start()
+
+    def deliver(self, raw_message, due):
+        channel, data = raw_message.split(":", 1)
+        # Messages on one channel arrive in the order they were published
+        self.due.append(due)
+        self.redis_conn.publish(channel, data)
+
+    def listen(self):
+        for message in self.pubsub.listen():
+            raw_message = "{}:{}".format(
+                message["channel"].decode("utf-8"), message["data"].decode("utf-8")
+            )
+            super(RedisTransport, self).deliver(raw_message, self.due.popleft())
+
+    def wait(self, count, timeout=None):
+        deadline = timeout and time.perf_counter() + timeout
+        while len(self.latencies) < count:
+            if deadline and time.perf_counter() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+
+class LoadTestResult(object):
+    """Latencies of the messages handled in one load test run."""
+
+    def __init__(self, rate, latencies, elapsed, game):
+        self.rate = rate
+        self.latencies = numpy.array(latencies) * 1000
+        self.elapsed = elapsed
+        self.events_recorded = game.events_recorded
+        self.messages_published = game.messages_published
+
+    @property
+    def messages(self):
+        return len(self.latencies)
+
+    @property
+    def throughput(self):
+        """Messages handled per second over the whole run."""
+        return self.messages / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, q):
+        if not self.messages:
+            return 0.0
+        return float(numpy.percentile(self.latencies, q))
+
+    def sustainable(self, latency_budget):
+        """Whether 99% of messages were handled within `latency_budget` ms."""
+        return self.percentile(99) <= latency_budget
+
+    def serialize(self):
+        return {
+            "rate": self.rate,
+            "messages": self.messages,
+            "elapsed": self.elapsed,
+            "throughput": self.throughput,
+            "latency_ms": {
+                "p50": self.percentile(50),
+                "p90": self.percentile(90),
+                "p99": self.percentile(99),
+                "max": float(self.latencies.max()) if self.messages else 0.0,
+            },
+            "events_recorded": self.events_recorded,
+            "messages_published": self.messages_published,
+        }
+
+
+class LoadTest(object):
+    """Runs message streams against fresh games of `players` players on a
+    `rows` x `columns` grid. If `batch_interval` is given, the games handle
+    incoming messages in batches that often. Other keyword arguments override
+    the Gridworld configuration."""
+
+    def __init__(
+        self,
+        players=20,
+        rows=50,
+        columns=50,
+        redis_url=None,
+        database_url=None,
+        batch_interval=0,
+        seed=0,
+        **config
+    ):
+        if redis_url and batch_interval:
+            raise ValueError("Batches are only handled without Redis.")
+        self.scenario = Scenario("load", rows, columns, players)
+        self.redis_url = redis_url
+        self.database_url = database_url
+        self.batch_interval = batch_interval
+        self.seed = seed
+        self.config = config
+
+    def player_ids(self):
+        return range(1, self.scenario.players + 1)
+
+    def setup(self):
+        """Return a fresh game and the transport to deliver messages with."""
+        world = World(self.scenario, seed=self.seed, **self.config)
+        session = None
+        if self.database_url:
+            session = greenlet_session(self.database_url)
+            dallinger.db.Base.metadata.create_all(session.get_bind())
+        if self.redis_url:
+            import redis
+
+            redis_conn = redis.from_url(self.redis_url)
+            game = LoadTestGriduniverse(world.grid, redis_conn, session)
+            return game, RedisTransport(game, redis_conn)
+        if self.batch_interval:
+            game = LoadTestGriduniverse(
+                world.grid,
+                session=session,
+                config={"inbound_batch_interval": self.batch_interval},
+            )
+            return game, BatchTransport(game, self.batch_interval)
+        game = LoadTestGriduniverse(world.grid, session=session)
+        return game, DirectTransport(game)
+
+    def run(self, stream, rate=None, timeout=60):
+        """Deliver the stream's messages at `rate` per second (or as fast as
+        possible), and return the result once they have all been handled."""
+        game, transport = self.setup()
+        timed = retime(stream, rate)
+        # Moves carry the client's clock, which players' speed limits are
+        # checked against. Sent as fast as possible, they keep their own.
+        clock = timed if rate else stream
+        messages = []
+        for (offset, msg), (client_time, _) in zip(timed, clock):
+            if "timestamp" in msg:
+                msg = dict(msg, timestamp=client_time + 1)
+            messages.append((offset, "{}:{}".format(game.channel, json.dumps(msg))))
+        start = time.perf_counter()
+        for offset, raw_message in messages:
+            due = start + offset
+            delay = due - time.perf_counter()
+            while delay > 0:
+                time.sleep(min(delay, transport.interval))
+                transport.poll()
+                delay = due - time.perf_counter()
+            transport.deliver(raw_message, due)
+        if not transport.wait(len(messages), timeout):
+            logger.warning("Timed out waiting for messages to be handled.")
+        elapsed = time.perf_counter() - start
+        return LoadTestResult(rate, transport.latencies, elapsed, game)
+
+    def find_max_rate(
+        self,
+        stream,
+        latency_budget=100,
+        start_rate=100,
+        max_rate=100000,
+        steps=5,
+        duration=5,
+    ):
+        """Return the highest rate, in messages per second, at which 99% of
+        messages are handled within `latency_budget` ms, with the result of
+        the run at that rate.
+
+        The rate is doubled until the budget is exceeded, then narrowed down
+        over `steps` bisections. The search stops at `max_rate` if the budget
+        is never exceeded. Each run sends up to `duration` seconds of the
+        stream.
+        """
+
+        def run(rate):
+            return self.run(stream[: max(100, int(rate * duration))], rate)
+
+        low, high = 0, start_rate
+        best = None
+        while True:
+            result = run(high)
+            logger.info(
+                "{} messages/s: p99 {:.1f}ms".format(high, result.percentile(99))
+            )
+            if not result.sustainable(latency_budget):
+                break
+            low, best = high, result
+            if high >= max_rate:
+                return low, best
+            high = min(high * 2, max_rate)
+        for _ in range(steps):
+            rate = (low + high) / 2.0
+            result = run(rate)
+            logger.info(
+                "{} messages/s: p99 {:.1f}ms".format(rate, result.percentile(99))
+            )
+            if result.sustainable(latency_budget):
+                low, best = rate, result
+            else:
+                high = rate
+        return low, best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load test the server path of a Griduniverse game."
+    )
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=50)
+    parser.add_argument("--columns", type=int, default=50)
+    parser.add_argument(
+        "--motion-speed-limit",
+        type=float,
+        default=8,
+        help="Moves per second allowed per player",
+    )
+    parser.add_argument(
+        "--messages", type=int, default=5000, help="Synthetic messages to send"
+    )
+    parser.add_argument(
+        "--recording", help="Replay the client messages in this dataset export"
+    )
+    parser.add_argument(
+        "--rate", type=float, help="Messages per second (default: as fast as possible)"
+    )
+    parser.add_argument(
+        "--find-max-rate",
+        action="store_true",
+        help="Search for the highest rate within the latency budget",
+    )
+    parser.add_argument(
+        "--latency-budget",
+        type=float,
+        default=100,
+        help="99th percentile latency allowed, in ms",
+    )
+    parser.add_argument(
+        "--batch-interval",
+        type=float,
+        default=0,
+        help="Handle incoming messages in batches this often, in seconds",
+    )
+    parser.add_argument("--redis-url", help="Send messages through this Redis")
+    parser.add_argument("--database-url", help="Commit events to this database")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+    load_test = LoadTest(
+        players=args.players,
+        rows=args.rows,
+        columns=args.columns,
+        redis_url=args.redis_url,
+        database_url=args.database_url,
+        batch_interval=args.batch_interval,
+        seed=args.seed,
+        motion_speed_limit=args.motion_speed_limit,
+    )
+    if args.recording:
+        stream = recorded_stream(args.recording, load_test.player_ids())
+    else:
+        stream = synthetic_stream(load_test.player_ids(), args.messages, seed=args.seed)
+
+    output = {"players": args.players, "rows": args.rows, "columns": args.columns}
+    if args.find_max_rate:
+        rate, result = load_test.find_max_rate(stream, args.latency_budget)
+        output["max_rate"] = rate
+        print("Max sustainable rate: {:.0f} messages/s".format(rate))
+    else:
+        result = load_test.run(stream, args.rate)
+    if result is not None:
+        output["result"] = result.serialize()
+        print(json.dumps(output["result"], indent=2))
+    if args.output:
+        with open(args.output, "w") as results:
+            json.dump(output, results, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
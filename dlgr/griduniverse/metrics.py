@@ -0,0 +1,81 @@
+"""Lightweight instrumentation of the game's hot paths.
+
+Timings are kept as fixed-bucket histograms, so recording a value is cheap
+and the memory used doesn't grow with the length of the game.
+"""
+import bisect
+import collections
+import time
+from contextlib import contextmanager
+
+#: Upper bounds of the timing buckets, in milliseconds
+TIMING_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+#: Upper bounds of the size buckets, in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram(object):
+    """Counts of recorded values falling into each bucket, plus the total
+    count, sum and maximum. The last bucket holds values above every bound."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def serialize(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "buckets": dict(zip([str(b) for b in self.bounds] + ["inf"], self.buckets)),
+        }
+
+
+class Metrics(object):
+    """Timing histograms, payload size histograms, counters and gauges (the
+    latest value of a setting that changes as the game runs), by name."""
+
+    def __init__(self):
+        self.timings = collections.defaultdict(lambda: Histogram(TIMING_BUCKETS))
+        self.sizes = collections.defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.started = time.time()
+
+    @contextmanager
+    def timer(self, name):
+        """Record how long the body of the `with` block takes, in ms."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name].record((time.perf_counter() - start) * 1000)
+
+    def size(self, name, size):
+        self.sizes[name].record(size)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def serialize(self):
+        return {
+            "uptime": time.time() - self.started,
+            "timings_ms": {k: v.serialize() for k, v in sorted(self.timings.items())},
+            "sizes_bytes": {k: v.serialize() for k, v in sorted(self.sizes.items())},
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+        }
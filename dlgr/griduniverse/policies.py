@@ -0,0 +1,208 @@
+"""Vectorized bot policies.
+
+A batch policy chooses an action for every agent at once from array views of
+the world: an (n, 2) array of agent positions, an (m, 2) array of item
+positions and a rows x columns boolean wall bitmap. Actions are returned as
+an array of indexes into `ACTIONS`.
+
+The policies here are NumPy versions of the strategies implemented one agent
+at a time by the bots in :mod:`dlgr.griduniverse.bots`.
+"""
+import numpy
+
+#: The move sent for each action index; 0 means "no move"
+ACTIONS = (None, "up", "down", "left", "right")
+
+#: The (row, column) offset of each action
+OFFSETS = numpy.array([[0, 0], [-1, 0], [1, 0], [0, -1], [0, 1]])
+
+NOOP = 0
+
+
+def distance_field(targets, walls):
+    """Return the number of steps from every cell to the nearest target,
+    going around walls. Unreachable cells are `inf`.
+
+    This is a breadth first search from all targets at once, expanding the
+    whole frontier with array shifts at each step.
+    """
+    distances = numpy.full(walls.shape, numpy.inf)
+    frontier = numpy.zeros(walls.shape, dtype=bool)
+    if len(targets):
+        frontier[targets[:, 0], targets[:, 1]] = True
+    frontier &= ~walls
+    step = 0
+    while frontier.any():
+        distances[frontier] = step
+        step += 1
+        grown = numpy.zeros_like(frontier)
+        grown[1:] |= frontier[:-1]
+        grown[:-1] |= frontier[1:]
+        grown[:, 1:] |= frontier[:, :-1]
+        grown[:, :-1] |= frontier[:, 1:]
+        frontier = grown & ~walls & numpy.isinf(distances)
+    return distances
+
+
+def candidate_positions(agents):
+    """Return the (n, 5, 2) positions each agent would reach with each action."""
+    return agents[:, None, :] + OFFSETS[None, :, :]
+
+
+def gather(grid, positions, fill):
+    """Look up `grid` at an array of positions, using `fill` for positions
+    that are off the grid."""
+    rows, columns = grid.shape
+    outside = (
+        (positions[..., 0] < 0)
+        | (positions[..., 0] >= rows)
+        | (positions[..., 1] < 0)
+        | (positions[..., 1] >= columns)
+    )
+    values = grid[
+        numpy.clip(positions[..., 0], 0, rows - 1),
+        numpy.clip(positions[..., 1], 0, columns - 1),
+    ]
+    values[outside] = fill
+    return values
+
+
+def open_moves(agents, walls):
+    """Return an (n, 5) mask of the moves that lead to a free cell, as
+    `get_expected_position` would predict: not off the grid, and not into a
+    wall or another agent. "No move" is not included."""
+    occupied = walls.copy()
+    occupied[agents[:, 0], agents[:, 1]] = True
+    allowed = ~gather(occupied, candidate_positions(agents), True)
+    allowed[:, NOOP] = False
+    return allowed
+
+
+def random_choice(allowed):
+    """Pick one allowed action per row of the (n, 5) mask `allowed`, uniformly
+    at random. Rows with nothing allowed get "no move"."""
+    scores = numpy.random.random(allowed.shape)
+    scores[~allowed] = -1
+    choice = scores.argmax(axis=1)
+    choice[~allowed.any(axis=1)] = NOOP
+    return choice
+
+
+def as_positions(positions):
+    return numpy.asarray(positions, dtype=int).reshape(-1, 2)
+
+
+class BatchPolicy(object):
+    """Chooses actions for a whole population of agents at once."""
+
+    def actions(self, agents, items, walls):
+        """Return an array with one index into `ACTIONS` per agent.
+
+        :param agents: (n, 2) integer array of agent positions
+        :param items: (m, 2) integer array of item positions
+        :param walls: rows x columns boolean array, True where there is a wall
+        """
+        raise NotImplementedError
+
+    def random_keys(self, count):
+        """The `RandomBot` strategy: one of eight keys, four of which move."""
+        keys = numpy.random.randint(0, 2 * (len(ACTIONS) - 1), size=count)
+        return numpy.where(keys < len(ACTIONS) - 1, keys + 1, NOOP)
+
+    def with_fallback(self, chosen, found):
+        """Use `chosen` where `found` is set, and random keys elsewhere."""
+        return numpy.where(found, chosen, self.random_keys(len(chosen)))
+
+
+class RandomPolicy(BatchPolicy):
+    """Press a random key, as `RandomBot` does."""
+
+    def actions(self, agents, items, walls):
+        return self.random_keys(len(agents))
+
+
+class FoodSeekingPolicy(BatchPolicy):
+    """Step towards the closest reachable item, as `FoodSeekingBot` does.
+
+    A single distance field to the nearest item is shared by all agents.
+    Agents with no reachable item move at random to a free neighboring cell,
+    or press a random key if there is none.
+    """
+
+    def actions(self, agents, items, walls):
+        agents, items = as_positions(agents), as_positions(items)
+        distances = distance_field(items, walls)
+        ahead = gather(distances, candidate_positions(agents), numpy.inf)
+        here = ahead[:, NOOP].copy()
+        ahead[:, NOOP] = numpy.inf
+        best = ahead.argmin(axis=1)
+        improves = ahead[numpy.arange(len(agents)), best] < here
+
+        allowed = open_moves(agents, walls)
+        wander = self.with_fallback(random_choice(allowed), allowed.any(axis=1))
+        return numpy.where(improves, best, wander)
+
+
+class AdvantageSeekingPolicy(BatchPolicy):
+    """Go for the closest item that isn't a better target for another agent,
+    as `AdvantageSeekingBot` does, otherwise spread out.
+
+    Unlike the bot, distances are rectilinear and ignore walls, so that all
+    agent/item pairs can be compared in one array; moves into walls are still
+    never chosen. The greedy closest-pair assignment is resolved in rounds:
+    each unassigned agent claims its nearest unclaimed item, and the closest
+    claimant of each item wins it.
+    """
+
+    def assign(self, agents, items):
+        """Return the index of the item each agent targets, or -1."""
+        targets = numpy.full(len(agents), -1)
+        if not len(agents) or not len(items):
+            return targets
+        distances = numpy.abs(agents[:, None, :] - items[None, :, :]).sum(axis=-1)
+        distances = distances.astype(float)
+        while True:
+            nearest = distances.argmin(axis=1)
+            nearest_distance = distances[numpy.arange(len(agents)), nearest]
+            claimants = numpy.flatnonzero(numpy.isfinite(nearest_distance))
+            if not len(claimants):
+                return targets
+            # Sort claims by item, then distance, and keep the first per item
+            claimants = claimants[
+                numpy.lexsort((nearest_distance[claimants], nearest[claimants]))
+            ]
+            _, first = numpy.unique(nearest[claimants], return_index=True)
+            winners = claimants[first]
+            targets[winners] = nearest[winners]
+            distances[winners, :] = numpy.inf
+            distances[:, nearest[winners]] = numpy.inf
+
+    def actions(self, agents, items, walls):
+        agents, items = as_positions(agents), as_positions(items)
+        count = len(agents)
+        candidates = candidate_positions(agents)
+
+        # Step towards the assigned item, if a move gets closer to it
+        targets = self.assign(agents, items)
+        has_target = targets >= 0
+        target_positions = items[targets.clip(0)] if len(items) else agents
+        ahead = numpy.abs(candidates - target_positions[:, None, :]).sum(axis=-1)
+        ahead = ahead.astype(float)
+        ahead[gather(walls, candidates, True)] = numpy.inf
+        here = ahead[:, NOOP].copy()
+        ahead[:, NOOP] = numpy.inf
+        best = ahead.argmin(axis=1)
+        improves = has_target & (ahead[numpy.arange(count), best] < here)
+
+        # Otherwise, pick a move that increases the mean distance between
+        # agents. Only this agent's distances change when it moves.
+        spread = numpy.zeros(candidates.shape[:2])
+        for axis in (0, 1):
+            spread += numpy.abs(
+                candidates[:, :, None, axis] - agents[None, None, :, axis]
+            ).sum(axis=-1)
+        # Remove the distance from each agent's candidate cell to itself
+        spread -= numpy.abs(OFFSETS).sum(axis=1)[None, :]
+        spreads = (spread > spread[:, NOOP : NOOP + 1]) & open_moves(agents, walls)
+        spread_out = self.with_fallback(random_choice(spreads), spreads.any(axis=1))
+        return numpy.where(improves, best, spread_out)
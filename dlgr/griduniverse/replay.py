@@ -0,0 +1,255 @@
+"""Support for replaying exported Griduniverse games."""
+import bisect
+import csv
+import datetime
+import heapq
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import zipfile
+
+from .storage import StateDecoder
+
+logger = logging.getLogger(__file__)
+
+#: The table of infos, including states and events, in a dataset export
+INFO_CSV = "data/info.csv"
+
+#: Contents and details of the rows of an export sorted in memory at once
+CHUNK_BYTES = 64 * 1024 * 1024
+
+# Serialized states can be far larger than the csv module's default limit
+csv.field_size_limit(sys.maxsize)
+
+
+def event_details(event, decoder=None):
+    """Return the parsed details of an exported `Info` row, falling back to
+    its contents for older exports that didn't fill the details column.
+    States are decoded with `decoder`, which must have seen the states before
+    if they're stored compactly."""
+    if event.type == "state":
+        return (decoder or StateDecoder()).decode(event.contents, event.details)
+    return event.details or {}
+
+
+class Keyframe(object):
+    """A full snapshot of the grid state at a point in a replay."""
+
+    def __init__(self, time, state):
+        self.time = time
+        self.state = state
+
+    def serialize(self):
+        return {
+            "time": self.time.isoformat(),
+            "state": self.state,
+        }
+
+    @classmethod
+    def deserialize(cls, data):
+        return cls(
+            time=datetime.datetime.fromisoformat(data["time"]),
+            state=data["state"],
+        )
+
+
+class KeyframeIndex(object):
+    """Full grid snapshots taken every `interval` seconds of a recorded game.
+
+    Persisted states only include walls and items when they changed, so
+    rebuilding the grid at an arbitrary time would otherwise require searching
+    back through the whole game. With the index, a replay loads the nearest
+    earlier keyframe and applies only the events recorded since.
+    """
+
+    def __init__(self, interval, keyframes=()):
+        self.interval = interval
+        self.keyframes = list(keyframes)
+        self._times = [k.time for k in self.keyframes]
+
+    def __len__(self):
+        return len(self.keyframes)
+
+    @classmethod
+    def build(cls, events, interval=10):
+        """Build an index from exported `Info` rows in creation time order."""
+        step = datetime.timedelta(seconds=interval)
+        keyframes = []
+        state = {"walls": [], "items": []}
+        next_time = None
+        decoder = StateDecoder()
+        for event in events:
+            if event.type != "state":
+                continue
+            # Each state replaces only the sections it includes
+            state.update(event_details(event, decoder))
+            if "players" not in state:
+                continue
+            if next_time is None or event.creation_time >= next_time:
+                keyframes.append(Keyframe(event.creation_time, dict(state)))
+                next_time = event.creation_time + step
+        return cls(interval, keyframes)
+
+    def nearest(self, target):
+        """Return the latest keyframe at or before `target`, or None."""
+        index = bisect.bisect_right(self._times, target)
+        if index:
+            return self.keyframes[index - 1]
+
+    def save(self, path):
+        with open(path, "w") as index_file:
+            json.dump(
+                {
+                    "interval": self.interval,
+                    "keyframes": [k.serialize() for k in self.keyframes],
+                },
+                index_file,
+            )
+
+    @classmethod
+    def load(cls, path, interval=None):
+        """Load a saved index, or return None if there isn't an up to date one
+        with the requested interval."""
+        try:
+            with open(path, "r") as index_file:
+                data = json.load(index_file)
+        except (OSError, ValueError):
+            return None
+        if interval is not None and data.get("interval") != interval:
+            return None
+        return cls(
+            data["interval"], [Keyframe.deserialize(k) for k in data["keyframes"]]
+        )
+
+    @staticmethod
+    def path_for(zip_path):
+        """Where the index for a dataset export is stored."""
+        return os.path.splitext(zip_path)[0] + "-keyframes.json"
+
+    @classmethod
+    def for_export(cls, zip_path, events, interval=10):
+        """Load the index stored alongside an export, building and saving it
+        first if needed."""
+        path = cls.path_for(zip_path)
+        index = None
+        if os.path.getmtime(zip_path) <= cls._mtime(path):
+            index = cls.load(path, interval=interval)
+        if index is None:
+            logger.info("Building replay keyframe index for {}".format(zip_path))
+            index = cls.build(events(), interval=interval)
+            try:
+                index.save(path)
+            except OSError:
+                logger.info("Could not save replay keyframe index to {}".format(path))
+        return index
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0
+
+
+class ExportedInfo(object):
+    """An `Info` row read from the CSV table of a dataset export.
+
+    The JSON `details` are only decoded when first accessed, so rows that are
+    skipped cost no more than splitting the CSV line.
+    """
+
+    __slots__ = ("id", "type", "creation_time", "contents", "_details")
+
+    def __init__(self, id, type, creation_time, contents, details):
+        self.id = id
+        self.type = type
+        self.creation_time = creation_time
+        self.contents = contents
+        self._details = details
+
+    @property
+    def details(self):
+        if not isinstance(self._details, dict):
+            self._details = json.loads(self._details) if self._details else {}
+        return self._details
+
+
+def _parse_time(value):
+    # Exported times drop trailing zeros from the microseconds
+    seconds, _, fraction = value.partition(".")
+    if fraction:
+        value = seconds + "." + fraction.ljust(6, "0")
+    return datetime.datetime.fromisoformat(value)
+
+
+def _info_rows(csv_file):
+    """Yield (creation time, id, raw fields) for each row of an info table."""
+    reader = csv.reader(csv_file)
+    header = next(reader)
+    columns = [
+        header.index(column)
+        for column in ("id", "type", "creation_time", "contents", "details")
+    ]
+    for row in reader:
+        info_id, info_type, creation_time, contents, details = (
+            row[column] for column in columns
+        )
+        yield (
+            _parse_time(creation_time),
+            int(info_id),
+            [info_id, info_type, creation_time, contents, details],
+        )
+
+
+def _spill(chunk):
+    """Write a sorted chunk of rows to a temporary file and return it."""
+    spilled = tempfile.TemporaryFile(mode="w+", newline="", encoding="utf8")
+    writer = csv.writer(spilled)
+    writer.writerow(["id", "type", "creation_time", "contents", "details"])
+    writer.writerows(fields for _, _, fields in chunk)
+    spilled.seek(0)
+    return spilled
+
+
+def read_infos(zip_path, chunk_bytes=CHUNK_BYTES):
+    """Iterate the `Info` rows of a dataset export in creation time order,
+    reading them straight out of the zip file.
+
+    Exports aren't written in creation time order, so this is an external
+    merge sort: rows are sorted in chunks holding up to `chunk_bytes` of
+    contents and details, spilled to temporary files when there is more
+    than one chunk, and merged. At most one chunk is held in memory at a
+    time, however large the states in it are.
+    """
+    spilled = []
+    chunk = []
+    size = 0
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            with archive.open(INFO_CSV) as info_file:
+                text = io.TextIOWrapper(info_file, encoding="utf8", newline="")
+                for row in _info_rows(text):
+                    chunk.append(row)
+                    size += len(row[2][3]) + len(row[2][4])
+                    if size >= chunk_bytes:
+                        chunk.sort(key=lambda row: row[:2])
+                        spilled.append(_spill(chunk))
+                        chunk = []
+                        size = 0
+        chunk.sort(key=lambda row: row[:2])
+        if spilled:
+            if chunk:
+                spilled.append(_spill(chunk))
+            rows = heapq.merge(*(_info_rows(f) for f in spilled), key=lambda r: r[:2])
+        else:
+            rows = iter(chunk)
+        for creation_time, _, (info_id, info_type, _, contents, details) in rows:
+            yield ExportedInfo(
+                int(info_id), info_type, creation_time, contents, details
+            )
+    finally:
+        for spilled_file in spilled:
+            spilled_file.close()
@@ -0,0 +1,110 @@
+"""Database sessions for the game's greenlets.
+
+The game loop, the state broadcaster and the websocket handlers all write to
+the database from their own greenlets. Each greenlet gets its own session,
+drawn from one small connection pool, so a busy game holds a handful of
+connections rather than one per greenlet.
+
+A session holds on to its connection until it commits, rolls back or is
+closed, even after its greenlet has ended, so code handling a message or a
+request should run in `released` to return the connection to the pool.
+"""
+from contextlib import contextmanager
+
+import gevent.local
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.util import ThreadLocalRegistry
+
+#: Connections kept open in the pool
+POOL_SIZE = 5
+
+#: Connections opened beyond the pool size when it's exhausted, closed again
+#: once they're returned
+MAX_OVERFLOW = 10
+
+#: Seconds after which a connection is replaced rather than reused
+POOL_RECYCLE = 3600
+
+
+class GreenletRegistry(ThreadLocalRegistry):
+    """Keeps one session per greenlet, whether or not gevent has patched
+    `threading`."""
+
+    def __init__(self, createfunc):
+        self.createfunc = createfunc
+        self.registry = gevent.local.local()
+
+
+def instrument(engine, metrics):
+    """Count connections and checkouts of the engine's pool in `metrics`, and
+    keep gauges of how many connections are open and in use."""
+    # The pool's own counts are only updated after the events fire
+    open_connections = set()
+    checked_out = set()
+
+    def update_gauges():
+        metrics.gauge("db.pool.open", len(open_connections))
+        metrics.gauge("db.pool.checked_out", len(checked_out))
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        metrics.count("db.pool.connects")
+        open_connections.add(id(connection_record))
+        update_gauges()
+
+    @event.listens_for(engine, "close")
+    def close(dbapi_connection, connection_record):
+        open_connections.discard(id(connection_record))
+        update_gauges()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.count("db.pool.checkouts")
+        checked_out.add(id(connection_record))
+        update_gauges()
+
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        checked_out.discard(id(connection_record))
+        update_gauges()
+
+    @event.listens_for(engine, "invalidate")
+    def invalidate(dbapi_connection, connection_record, exception):
+        metrics.count("db.pool.invalidated")
+
+
+def greenlet_session(url, metrics=None, **engine_options):
+    """Return a scoped session bound to a new engine for `url`, with one
+    session per greenlet.
+
+    Objects stay loaded after a commit, so a session looks up each node by
+    id once, whatever it commits in between.
+    """
+    options = {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+    options.update(engine_options)
+    engine = create_engine(url, **options)
+    if metrics is not None:
+        instrument(engine, metrics)
+    factory = sessionmaker(
+        autocommit=False, autoflush=True, expire_on_commit=False, bind=engine
+    )
+    session = scoped_session(factory)
+    session.registry = GreenletRegistry(factory)
+    return session
+
+
+@contextmanager
+def released(session):
+    """Close the current greenlet's session from the scoped `session` at the
+    end of the block, returning its connection to the pool whether or not
+    anything was committed."""
+    try:
+        yield session
+    finally:
+        session.remove()
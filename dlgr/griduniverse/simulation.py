@@ -0,0 +1,239 @@
+"""Run populations of Griduniverse bots in-process.
+
+The bots in :mod:`dlgr.griduniverse.bots` normally talk to the server over
+Redis, parse every state broadcast and sleep between key presses. The classes
+here instead drive many bot policies directly against a :class:`Gridworld`,
+routing their moves through the experiment's own message handlers, so large
+populations can be load-tested or trained on a single core.
+"""
+import collections
+import logging
+
+import numpy
+from selenium.webdriver.common.keys import Keys
+
+from . import policies
+from .bots import RandomBot
+from .experiment import Griduniverse
+from .maze_utils import maze_to_graph, positions_to_maze
+
+logger = logging.getLogger(__file__)
+
+
+class SimulatedGriduniverse(Griduniverse):
+    """A Griduniverse experiment without a database or Redis connection.
+
+    Incoming messages go through the usual `dispatch` table and `handle_*`
+    methods. The most recent outgoing messages are kept in `published`
+    instead of being sent to clients, and recorded events are only counted.
+    """
+
+    #: How many published messages to keep for inspection
+    published_history = 1000
+
+    def __init__(self, grid, config=None):
+        self.config = config or {}
+        self.grid = grid
+        self.item_config = grid.item_config
+        self.transition_config = grid.transition_config
+        self.published = collections.deque(maxlen=self.published_history)
+        self.messages_published = 0
+        self.events_recorded = 0
+
+    def publish(self, msg):
+        self.published.append(msg)
+        self.messages_published += 1
+
+    def record_event(self, details, player_id=None):
+        self.events_recorded += 1
+
+
+class BotPopulation(object):
+    """Drives a population of bot policies against a Gridworld.
+
+    Each tick, the grid is serialized once into the view that every bot
+    observes. Each bot then picks a key with its usual `get_next_key`
+    method, and the resulting move is dispatched to the game in-process.
+    Time is simulated, advancing by `tick_interval` seconds per tick, so no
+    bot ever sleeps.
+    """
+
+    #: Maps the Selenium keys chosen by bots to the move sent by the client
+    KEY_MOVES = {
+        Keys.UP: "up",
+        Keys.DOWN: "down",
+        Keys.LEFT: "left",
+        Keys.RIGHT: "right",
+    }
+
+    def __init__(self, grid, tick_interval=0.25, config=None):
+        self.grid = grid
+        self.game = SimulatedGriduniverse(grid, config=config)
+        self.tick_interval = tick_interval
+        self.clock = 0.0
+        self.ticks = 0
+        self.bots = {}
+        self._maze_walls = None
+
+    def add_bot(self, bot_class=RandomBot, player_id=None, **kwargs):
+        """Spawn a player on the grid and attach a new bot of `bot_class`."""
+        if player_id is None:
+            player_id = len(self.grid.players) + 1
+            while player_id in self.grid.players:
+                player_id += 1
+        self.grid.spawn_player(id=player_id, **kwargs)
+        # An empty URL skips all of the bot's server signup state
+        bot = bot_class("")
+        bot.participant_id = bot.player_id = player_id
+        self.bots[player_id] = bot
+        return bot
+
+    def add_bots(self, count, bot_class=RandomBot):
+        return [self.add_bot(bot_class) for _ in range(count)]
+
+    def world_view(self):
+        """Serialize the grid into the state dictionary bots expect."""
+        state = self.grid.serialize()
+        state["food"] = state["items"]
+        state["walls"] = [
+            wall if isinstance(wall, dict) else {"position": wall}
+            for wall in state["walls"]
+        ]
+        return state
+
+    def _share_maze(self, state):
+        """Give every bot the same path-finding maze, rebuilt only when the
+        walls change."""
+        walls = frozenset(tuple(w["position"]) for w in state["walls"])
+        if walls != self._maze_walls:
+            self._maze_walls = walls
+            self._maze = positions_to_maze(walls, state["rows"], state["columns"])
+            self._graph = maze_to_graph(self._maze)
+        for bot in self.bots.values():
+            bot._maze = self._maze
+            bot._graph = self._graph
+
+    def step(self):
+        """Advance the simulation by one tick.
+
+        Returns the number of moves the game accepted.
+        """
+        self.ticks += 1
+        self.clock += self.tick_interval
+        state = self.world_view()
+        self._share_maze(state)
+        moves = 0
+        for player_id, bot in self.bots.items():
+            bot.state = state
+            moves += self.send_move(player_id, self.KEY_MOVES.get(bot.get_next_key()))
+        self.end_step()
+        return moves
+
+    def send_move(self, player_id, move):
+        """Dispatch a move for a player, returning 1 if it was accepted."""
+        if move is None:
+            return 0
+        msg = {
+            "type": "move",
+            "player_id": player_id,
+            "move": move,
+            "timestamp": self.clock,
+            "server_time": self.clock,
+        }
+        self.game.dispatch(msg)
+        self.game.record_event(msg, player_id)
+        return int("actual" in msg)
+
+    def end_step(self):
+        if self.grid.consumption_active:
+            self.grid.consume()
+
+    def run(self, ticks):
+        """Run for `ticks` ticks and return the number of accepted moves."""
+        moves = 0
+        for _ in range(ticks):
+            moves += self.step()
+        logger.info(
+            "Simulated {} bots for {} ticks: {} moves accepted.".format(
+                len(self.bots), ticks, moves
+            )
+        )
+        return moves
+
+    def scores(self):
+        return {
+            player_id: self.grid.players[player_id].score for player_id in self.bots
+        }
+
+
+class PolicyPopulation(BotPopulation):
+    """Drives a population of agents with a single batch policy.
+
+    Each tick, the positions of all agents, the positions of ripe items and
+    the wall bitmap are gathered into arrays once, and the policy chooses
+    every agent's action in one call (see :mod:`dlgr.griduniverse.policies`).
+    """
+
+    def __init__(self, grid, policy=None, **kwargs):
+        super(PolicyPopulation, self).__init__(grid, **kwargs)
+        self.policy = policy or policies.RandomPolicy()
+        self.agent_ids = []
+        self._walls = None
+        self._walls_key = None
+
+    def add_agent(self, player_id=None, **kwargs):
+        """Spawn a player on the grid, to be controlled by the policy."""
+        if player_id is None:
+            player_id = len(self.grid.players) + 1
+            while player_id in self.grid.players:
+                player_id += 1
+        self.grid.spawn_player(id=player_id, **kwargs)
+        self.agent_ids.append(player_id)
+        return player_id
+
+    def add_agents(self, count):
+        return [self.add_agent() for _ in range(count)]
+
+    def wall_bitmap(self):
+        """A rows x columns boolean array of walls, rebuilt when walls are
+        added or replaced."""
+        walls = self.grid.wall_locations
+        key = (self.grid.walls_version, self.grid.rows, self.grid.columns)
+        if key != self._walls_key:
+            self._walls_key = key
+            self._walls = numpy.zeros((self.grid.rows, self.grid.columns), dtype=bool)
+            if walls:
+                positions = numpy.array(list(walls), dtype=int)
+                self._walls[positions[:, 0], positions[:, 1]] = True
+        return self._walls
+
+    def arrays(self):
+        """Return the agent positions, ripe item positions and wall bitmap."""
+        players = self.grid.players
+        agents = policies.as_positions(
+            [players[player_id].position for player_id in self.agent_ids]
+        )
+        items = policies.as_positions(
+            [
+                position
+                for position, item in self.grid.item_locations.items()
+                if item.maturity >= item.maturation_threshold
+            ]
+        )
+        return agents, items, self.wall_bitmap()
+
+    def step(self):
+        self.ticks += 1
+        self.clock += self.tick_interval
+        actions = self.policy.actions(*self.arrays())
+        moves = 0
+        for player_id, action in zip(self.agent_ids, actions.tolist()):
+            moves += self.send_move(player_id, policies.ACTIONS[action])
+        self.end_step()
+        return moves
+
+    def scores(self):
+        return {
+            player_id: self.grid.players[player_id].score
+            for player_id in self.agent_ids
+        }
@@ -8,11 +8,12 @@ var position = require("mouse-position");
 var Mousetrap = require("mousetrap");
 var ReconnectingWebSocket = require("reconnecting-websocket");
 var $ = require("jquery");
-var gaussian = require("gaussian");
 var Color = require('color');
 var Identicon = require('./util/identicon');
 var _ = require('lodash');
 var md5 = require('./util/md5');
+var VisibilityMask = require('./util/visibility');
+var WallMap = require('./util/walls');
 var itemlib = require ("./items");
 
 function coordsToIdx(x, y, columns) {
@@ -82,6 +83,20 @@ class Section {
     }
   }
 
+  indexesOf(positions) {
+    // Section data array indexes of the [row, column] positions inside it
+    var indexes = [];
+    for (var k = 0; k < positions.length; k++) {
+      var x = positions[k][1],
+          y = positions[k][0];
+      if (x >= this.left && x < this.left + this.columns &&
+          y >= this.top && y < this.top + this.rows) {
+        indexes.push(this.gridCoordsToSectionIdx(x, y));
+      }
+    }
+    return indexes;
+  }
+
   map(func) {
     // For each cell, call func with (x, y, color) to get the new color
     for (var j = 0; j < this.rows; j++) {
@@ -127,8 +142,9 @@ var mouse = position(pixels.canvas);
 var isSpectator = false;
 var start = performance.now();
 var gridItems = new itemlib.GridItems();
-var walls = [];
-var wall_map = {};
+var wallMap = new WallMap(settings.rows, settings.columns);
+var visibilityMask = new VisibilityMask(settings.window_rows, settings.window_columns);
+var drawnWindow = {left: null, top: null};
 var transitionsUsed = new Set();
 var rand;
 
@@ -161,6 +177,10 @@ var Wall = function (settings) {
   if (!(this instanceof Wall)) {
     return new Wall();
   }
+  if (settings instanceof Array) {
+    // Walls of the default color are sent as bare positions
+    settings = {position: settings, color: [0.5, 0.5, 0.5]};
+  }
   this.position = settings.position;
   this.color = settings.color;
   return this;
@@ -171,6 +191,19 @@ var Player = function (settings, dimness) {
     return new Player();
   }
   this.id = settings.id;
+  this.dimness = dimness;
+  this.pendingMoves = [];
+  this.serverPosition = settings.position;
+  // Number of our latest move, carrying on from the server's count so moves
+  // made after reloading the page aren't taken as already handled
+  this.moveSequence = settings.move_sequence || 0;
+  this.update(settings);
+  return this;
+};
+
+Player.prototype.update = function (settings) {
+  // Take on the player's state from the server
+  var item = settings.current_item || null;
   this.position = settings.position;
   this.positionInSync = true;
   this.color = settings.color;
@@ -182,60 +215,78 @@ var Player = function (settings, dimness) {
   this.payoff = settings.payoff;
   this.name = settings.name;
   this.identity_visible = settings.identity_visible;
-  this.dimness = dimness;
-  this.replaceItem(settings.current_item || null);
-  return this;
+  if (item && this.currentItem && this.currentItem.id === item.id &&
+      this.currentItem.itemId === item.item_id) {
+    this.currentItem.maturity = item.maturity;
+    this.currentItem.remainingUses = item.remaining_uses;
+    item = this.currentItem;
+  }
+  this.replaceItem(item);
 };
 
-Player.prototype.move = function(direction) {
+Player.prototype.nextPosition = function(position, direction) {
+  // The position one step from `position` in `direction`, or null if that
+  // square can't be moved to.
 
   function _isCrossable(position) {
-    const hasWall = ! _.isUndefined(wall_map[[position[1], position[0]]]);
-    if (hasWall) {
+    if (wallMap.has(position[0], position[1])) {
       return false;
     }
     const itemHere = gridItems.atPosition(position);
     return _.isNull(itemHere) || itemHere.crossable;
   }
 
-  this.motion_direction = direction;
+  var newPosition = position.slice();
 
-  var ts = performance.now() - start,
-      waitTime = 1000 / this.motion_speed_limit;
+  switch (direction) {
+    case "up":
+      if (position[0] > 0) {
+        newPosition[0] -= 1;
+      }
+      break;
 
-  if (ts > this.motion_timestamp + waitTime) {
-    var newPosition = this.position.slice();
+    case "down":
+      if (position[0] < settings.rows - 1) {
+        newPosition[0] += 1;
+      }
+      break;
 
-    switch (direction) {
-      case "up":
-        if (this.position[0] > 0) {
-          newPosition[0] -= 1;
-        }
-        break;
+    case "left":
+      if (position[1] > 0) {
+        newPosition[1] -= 1;
+      }
+      break;
 
-      case "down":
-        if (this.position[0] < settings.rows - 1) {
-          newPosition[0] += 1;
-        }
-        break;
+    case "right":
+      if (position[1] < settings.columns - 1) {
+        newPosition[1] += 1;
+      }
+      break;
 
-      case "left":
-        if (this.position[1] > 0) {
-          newPosition[1] -= 1;
-        }
-        break;
+    default:
+      console.log("Direction not recognized.");
+  }
 
-      case "right":
-        if (this.position[1] < settings.columns - 1) {
-          newPosition[1] += 1;
-        }
-        break;
+  if (positionsAreEqual(newPosition, position)) {
+    // Against the edge of the grid
+    return null;
+  }
+  if (_isCrossable(newPosition) && (!players.isPlayerAt(newPosition, this) || settings.player_overlap)) {
+    return newPosition;
+  }
+  return null;
+};
 
-      default:
-        console.log("Direction not recognized.");
-    }
+Player.prototype.move = function(direction) {
+  this.motion_direction = direction;
 
-    if (_isCrossable(newPosition) && (!players.isPlayerAt(newPosition) || settings.player_overlap)) {
+  var ts = performance.now() - start,
+      waitTime = 1000 / this.motion_speed_limit;
+
+  if (ts > this.motion_timestamp + waitTime) {
+    var newPosition = this.nextPosition(this.position, direction);
+    if (newPosition) {
+      players.markDirty(this.position, newPosition);
       this.position = newPosition;
       this.motion_timestamp = ts;
       return true;
@@ -244,6 +295,25 @@ Player.prototype.move = function(direction) {
   return false;
 };
 
+Player.prototype.predictMove = function(sequence, direction) {
+  // Remember a move the server hasn't handled yet, which has already been
+  // applied to our position
+  this.pendingMoves.push({sequence: sequence, direction: direction});
+};
+
+Player.prototype.reconcile = function(serverPosition, acknowledged) {
+  // Return our predicted position: the position the server last reported,
+  // with the moves it hadn't handled by then replayed on top.
+  this.serverPosition = serverPosition;
+  this.pendingMoves = this.pendingMoves.filter(function (move) {
+    return move.sequence > acknowledged;
+  });
+  var position = serverPosition;
+  for (var i = 0; i < this.pendingMoves.length; i++) {
+    position = this.nextPosition(position, this.pendingMoves[i].direction) || position;
+  }
+  return position;
+};
 
 Player.prototype.replaceItem = function(item) {
   if (item && !(item instanceof itemlib.Item)) {
@@ -284,15 +354,30 @@ var playerSet = (function () {
 
         this._players = {};
         this.ego_id = settings.ego_id;
+        // Positions players have left or arrived at since takeDirty()
+        this._dirty = [];
+    };
+
+    PlayerSet.prototype.markDirty = function () {
+      for (var i = 0; i < arguments.length; i++) {
+        this._dirty.push(arguments[i]);
+      }
+    };
+
+    PlayerSet.prototype.takeDirty = function () {
+      var dirty = this._dirty;
+      this._dirty = [];
+      return dirty;
     };
 
-    PlayerSet.prototype.isPlayerAt = function (position) {
+    PlayerSet.prototype.isPlayerAt = function (position, except) {
+      /* Whether any player, other than `except` if given, is at position */
       var id, player;
 
       for (id in this._players) {
         if (this._players.hasOwnProperty(id)) {
           player = this._players[id];
-          if (positionsAreEqual(position, player.position)) {
+          if (player !== except && positionsAreEqual(position, player.position)) {
             return true;
           }
         }
@@ -407,32 +492,52 @@ var playerSet = (function () {
     };
 
     PlayerSet.prototype.update = function (allPlayersData) {
+      /* Reconcile with the full list of players from the server, by id */
       var freshPlayerData,
           existingPlayer,
+          seen = {},
+          id,
           i;
 
       for (i = 0; i < allPlayersData.length; i++) {
         freshPlayerData = allPlayersData[i];
         existingPlayer = this._players[freshPlayerData.id];
+        seen[freshPlayerData.id] = true;
         if (existingPlayer && existingPlayer.id === this.ego_id) {
 
           /* Don't override current player motion timestamp */
           freshPlayerData.motion_timestamp = existingPlayer.motion_timestamp;
 
+          if (!_.isUndefined(freshPlayerData.move_sequence)) {
+            // Take the server's position as of the last move it handled,
+            // and replay our moves it hasn't got to yet.
+            freshPlayerData.position = existingPlayer.reconcile(
+              freshPlayerData.position, freshPlayerData.move_sequence);
           // Only override position from server if tremble is enabled,
           // or if we know the Player's position is out of sync with the server.
           // Otherwise, the ego player's motion is constantly jittery.
-          if (settings.motion_tremble_rate === 0 && existingPlayer.positionInSync) {
+          } else if (settings.motion_tremble_rate === 0 && existingPlayer.positionInSync) {
             freshPlayerData.position = existingPlayer.position;
           } else {
             console.log("Overriding position from server!");
           }
         }
-        var last_dimness = 1;
-        if (! _.isUndefined(this._players[freshPlayerData.id])) {
-          last_dimness = this._players[freshPlayerData.id].dimness;
+        if (_.isUndefined(existingPlayer)) {
+          this._players[freshPlayerData.id] = new Player(freshPlayerData, 1);
+          this.markDirty(freshPlayerData.position);
+        } else {
+          if (!positionsAreEqual(existingPlayer.position, freshPlayerData.position)) {
+            this.markDirty(existingPlayer.position, freshPlayerData.position);
+          }
+          existingPlayer.update(freshPlayerData);
+        }
+      }
+
+      for (id in this._players) {
+        if (this._players.hasOwnProperty(id) && !seen[id]) {
+          this.markDirty(this._players[id].position);
+          delete this._players[id];
         }
-        this._players[freshPlayerData.id] = new Player(freshPlayerData, last_dimness);
       }
     };
 
@@ -535,8 +640,17 @@ var GUSocket = (function () {
             "Message was not on channel " + self.broadcastChannel + ". Ignoring.");
           return;
         }
-        var msg = JSON.parse(event.data.substring(marker.length));
+        handle(self, JSON.parse(event.data.substring(marker.length)));
+    };
 
+    var handle = function (self, msg) {
+        if (msg.type === "batch") {
+          // Messages the server sent together, in the order they were published
+          for (var i = 0; i < msg.messages.length; i++) {
+            handle(self, msg.messages[i]);
+          }
+          return;
+        }
         var callback = self.callbackMap[msg.type];
         if (! _.isUndefined(callback)) {
           callback(msg);
@@ -613,9 +727,12 @@ pixels.frame(function() {
   var ego = players.ego(),
       w = getWindowPosition(),
       section = new Section(background, w.left, w.top),
+      data = section.data,
+      mask,
+      color,
       dimness,
-      rescaling,
-      x, y;
+      dirty,
+      idx;
 
   // Animate background for each visible cell
   section.map(function(x, y, color) {
@@ -659,49 +776,50 @@ pixels.frame(function() {
   if (settings.highlightEgo) {
     visibilityNow = Math.min(visibilityNow, 4);
   }
-  var g = gaussian(0, Math.pow(visibilityNow, 2));
-  rescaling = 1 / g.pdf(0);
+  mask = visibilityMask.update(
+    _.isUndefined(ego) ? null : ego.position, w.left, w.top, visibilityNow
+  );
 
-  if (! _.isUndefined(ego)) {
-    x = ego.position[1];
-    y = ego.position[0];
-  } else {
-    x = 1e100;
-    y = 1e100;
-  }
-  section.map(function(i, j, color) {
-    var newColor;
-    // Draw walls
-    if (settings.walls_visible) {
-      color = wall_map[[i,j]] || color;
-    }
-    // Add Blur
-    players.each(function (i, player) {
-      dimness = g.pdf(distance(y, x, player.position[0], player.position[1])) * rescaling;
-      player["dimness"] = dimness;
-    });
-    newColor = color;
-    if (!isSpectator) {
-      dimness = g.pdf(distance(x, y, i, j)) * rescaling;
-      newColor = [
-        color[0] * dimness,
-        color[1] * dimness,
-        color[2] * dimness
-      ];
-    }
-    return newColor;
+  // Players are dimmed by their distance from the ego
+  players.each(function (i, player) {
+    player.dimness = visibilityMask.dimness(player.position[0], player.position[1]);
   });
-  pixels.update(section.data, section.textures);
+
+  for (var j = 0; j < section.rows; j++) {
+    for (var i = 0; i < section.columns; i++) {
+      idx = j * section.columns + i;
+      color = data[idx];
+      // Draw walls
+      if (settings.walls_visible && wallMap.has(w.top + j, w.left + i)) {
+        color = wallMap.colorAt(w.top + j, w.left + i);
+      }
+      // Add Blur
+      if (!isSpectator) {
+        dimness = mask[idx];
+        color = [
+          color[0] * dimness,
+          color[1] * dimness,
+          color[2] * dimness
+        ];
+      }
+      data[idx] = color;
+    }
+  }
+
+  // Only cells with items or players coming or going can change texture,
+  // unless the window has scrolled
+  dirty = section.indexesOf(gridItems.takeDirty().concat(players.takeDirty()));
+  if (w.left !== drawnWindow.left || w.top !== drawnWindow.top) {
+    dirty = undefined;
+    drawnWindow = w;
+  }
+  pixels.update(data, section.textures, dirty);
 });
 
 function clamp(val, min, max) {
   return Math.max(min, Math.min(max, val));
 }
 
-function distance(x, y, xx, yy) {
-  return Math.sqrt((xx - x) * (xx - x) + (yy - y) * (yy - y));
-}
-
 function arraysEqual(arr1, arr2) {
   for (var i = arr1.length; i--; ) {
     if (arr1[i] !== arr2[i]) {
@@ -749,11 +867,14 @@ function bindGameKeys(socket) {
   function moveInDir(direction) {
     var ego = players.ego();
     if (ego.move(direction) ) {
+      ego.moveSequence++;
+      ego.predictMove(ego.moveSequence, direction);
       var msg = {
         type: "move",
         player_id: ego.id,
         move: direction,
-        timestamp: ego.motion_timestamp
+        timestamp: ego.motion_timestamp,
+        sequence: ego.moveSequence
       };
       socket.send(msg);
     }
@@ -977,9 +1098,16 @@ function onColorChanged(msg) {
 
 function onMoveRejected(msg) {
   var offendingPlayerId = msg.player_id,
-      ego = players.ego();
-
-  if (ego && offendingPlayerId === ego.id) {
+      ego = players.ego(),
+      position;
+
+  if (ego && offendingPlayerId === ego.id && !_.isUndefined(msg.sequence)) {
+    // The server has handled every move up to the rejected one, so replay
+    // only the later moves we're still predicting
+    position = ego.reconcile(ego.serverPosition, msg.sequence);
+    players.markDirty(ego.position, position);
+    ego.position = position;
+  } else if (ego && offendingPlayerId === ego.id) {
     ego.positionInSync = false;
     console.log("Marking your player (" + ego.id + ") as out of sync with server. Should sync on next state update");
   }
@@ -1117,11 +1245,8 @@ function onGameStateChange(msg) {
   var $donationButtons = $('#individual-donate, #group-donate, #public-donate, #ingroup-donate'),
       $timeElement = $("#time"),
       $loading = $('.grid-loading'),
-      cur_wall,
       ego,
-      state,
-      j,
-      k;
+      state;
 
   performance.mark('state_start');
   if ($loading.is(':visible')) $loading.fadeOut();
@@ -1146,54 +1271,12 @@ function onGameStateChange(msg) {
 
   updateDonationStatus(state.donation_active);
 
-  // Update gridItems
+  // Update gridItems and walls in place, when they've been sent.
   if (! _.isNil(state.items)) {
-    gridItems = new itemlib.GridItems();
-    for (j = 0; j < state.items.length; j++) {
-
-      gridItems.add(
-        new itemlib.Item(
-          state.items[j].id,
-          state.items[j].item_id,
-          state.items[j].maturity,
-          state.items[j].remaining_uses
-        ),
-        state.items[j].position
-      );
-    }
-  }
-  // Update walls if they haven't been created yet.
-  if (! _.isUndefined(state.walls) && walls.length === 0) {
-    for (k = 0; k < state.walls.length; k++) {
-      cur_wall = state.walls[k];
-      if (cur_wall instanceof Array) {
-        cur_wall = {
-          position: cur_wall,
-          color: [0.5, 0.5, 0.5]
-        };
-      }
-      walls.push(
-        new Wall({
-          position: cur_wall.position,
-          color: cur_wall.color
-        })
-      );
-      wall_map[[cur_wall.position[1], cur_wall.position[0]]] = cur_wall.color;
-    }
+    gridItems.update(state.items);
   }
-
-  // If new walls have been added, draw them
-  if (! _.isUndefined(state.walls) && walls.length < state.walls.length) {
-    for (k = walls.length; k < state.walls.length; k++) {
-      cur_wall = state.walls[k];
-      walls.push(
-        new Wall({
-          position: cur_wall.position,
-          color: cur_wall.color
-        })
-      );
-      wall_map[[cur_wall.position[1], cur_wall.position[0]]] = cur_wall.color;
-    }
+  if (! _.isNil(state.walls)) {
+    wallMap.reconcile(state.walls);
   }
 
   // Update displayed score, set donation info.
@@ -1217,13 +1300,8 @@ function onGameStateChange(msg) {
 function addWall(msg) {
   var wall = msg.wall;
   if (wall) {
-    walls.push(
-      new Wall({
-        position: wall.position,
-        color: wall.color
-      })
-    );
-    wall_map[[wall.position[1], wall.position[0]]] = wall.color;
+    wall = new Wall(wall);
+    wallMap.set(wall.position, wall.color);
   }
 }
 
@@ -100,6 +100,8 @@ function Pixels(data, textures, opts) {
       texturePromises.push(itemTexture);
       itemTexture.then(function (texture) {
         self.itemTextures[itemId] = texture;
+        // Cells showing this item can now be drawn with its texture
+        self._geometry = null;
       });
     } else {
       self.itemTextures[itemId] = itemTexture;
@@ -291,12 +293,37 @@ Pixels.prototype.updateItems = function(texturePositions) {
   }
 }
 
-Pixels.prototype.update = function(data, textures) {
+Pixels.prototype.update = function(data, textures, dirty) {
+  // `dirty` lists the indexes of the cells whose texture may have changed
+  // since the last update. The vertex positions and texture coordinates are
+  // only rebuilt when one of them actually has, otherwise just the colors
+  // are. Without it every cell is checked.
   var self = this;
-  const opts = this.opts;
   var colors = self._formatted ? data : convert(data);
+  var geometry = self._geometry;
   var expanded_colors = [];
+
+  if (!geometry || texturesChanged(geometry.textures, textures, dirty)) {
+    geometry = self._geometry = self._buildGeometry(textures);
+  }
+
+  const untextured = geometry.untextured;
+  for (let i = 0; i < untextured.length; i++) {
+    let color = colors[untextured[i]];
+    for (let n = 0; n < 6; ++n) {
+      expanded_colors.push(color);
+    }
+  }
+
+  self._draw(geometry.position, geometry.texcoords, self._buffer.color(expanded_colors), geometry.count);
+  self.updateItems(geometry.texturePositions);
+};
+
+Pixels.prototype._buildGeometry = function(textures) {
+  var self = this;
+  const opts = this.opts;
   var positions = [];
+  var untextured = [];
   var idx = 0;
   var texturePositions = {};
 
@@ -306,12 +333,13 @@ Pixels.prototype.update = function(data, textures) {
     let has_texture = _.isString(texture);
     if (has_texture) {
       var texture_coords = texturePositions[texture] = (texturePositions[texture] || []);
+    } else {
+      untextured.push(i);
     }
     for (let n = 0; n < 6; ++n) {
       if (has_texture) {
         texture_coords.push(self.positions[idx]);
       } else {
-        expanded_colors.push(colors[i]);
         positions.push(self.positions[idx]);
       }
       idx++;
@@ -326,8 +354,34 @@ Pixels.prototype.update = function(data, textures) {
     true
   );
 
-  self._draw(self._buffer.position(positions), self._buffer.texcoords(texcoords), self._buffer.color(expanded_colors), texcoords.length);
-  self.updateItems(texturePositions);
+  return {
+    textures: textures.slice(),
+    untextured: untextured,
+    texturePositions: texturePositions,
+    position: self._buffer.position(positions),
+    texcoords: self._buffer.texcoords(texcoords),
+    count: texcoords.length
+  };
 };
 
+function texturesChanged(previous, textures, dirty) {
+  if (previous.length !== textures.length) {
+    return true;
+  }
+  if (dirty) {
+    for (let i = 0; i < dirty.length; i++) {
+      if (previous[dirty[i]] !== textures[dirty[i]]) {
+        return true;
+      }
+    }
+    return false;
+  }
+  for (let i = 0; i < textures.length; i++) {
+    if (previous[i] !== textures[i]) {
+      return true;
+    }
+  }
+  return false;
+}
+
 module.exports = Pixels;
@@ -58,11 +58,19 @@ export class GridItems {
   constructor() {
     this._itemsByPosition = new Map();
     this._positionsById = new Map();
+    // Positions whose contents changed since the last call to takeDirty()
+    this._dirty = [];
   }
 
   add(item, position) {
-    this._itemsByPosition.set(JSON.stringify(position), item);
-    this._positionsById.set(item.id, JSON.stringify(position));
+    const key = JSON.stringify(position);
+    const displaced = this._itemsByPosition.get(key);
+    if (displaced && displaced.id !== item.id) {
+      this._positionsById.delete(displaced.id);
+    }
+    this._itemsByPosition.set(key, item);
+    this._positionsById.set(item.id, position);
+    this._dirty.push(position);
   }
 
   atPosition(position) {
@@ -70,9 +78,14 @@ export class GridItems {
     return this._itemsByPosition.get(key) || null;
   }
 
+  byId(id) {
+    const position = this._positionsById.get(id);
+    return position ? this.atPosition(position) : null;
+  }
+
   positionOf(item) {
     if (this._positionsById.has(item.id)) {
-      return JSON.parse(this._positionsById.get(item.id));
+      return this._positionsById.get(item.id).slice();
     }
 
     return undefined;
@@ -84,16 +97,71 @@ export class GridItems {
     if (item) {
       this._itemsByPosition.delete(JSON.stringify(position));
       this._positionsById.delete(item.id);
+      this._dirty.push(position);
     }
   }
 
+  /**
+   * Reconcile with the full list of items from a state message, by id.
+   * Items that haven't changed type are updated in place, and only new,
+   * moved and removed items touch the position index.
+   * @param {Array} itemStates serialized items, each with an id and position
+   */
+  update(itemStates) {
+    const seen = new Set();
+    const toPlace = [];
+
+    for (const state of itemStates) {
+      let item = this.byId(state.id);
+      seen.add(state.id);
+      if (item && item.itemId !== state.item_id) {
+        this.remove(this._positionsById.get(state.id));
+        item = null;
+      }
+      if (!item) {
+        toPlace.push([
+          new Item(state.id, state.item_id, state.maturity, state.remaining_uses),
+          state.position
+        ]);
+        continue;
+      }
+      item.maturity = state.maturity;
+      item.remainingUses = state.remaining_uses;
+      const position = this._positionsById.get(state.id);
+      if (position[0] !== state.position[0] || position[1] !== state.position[1]) {
+        this.remove(position);
+        toPlace.push([item, state.position]);
+      }
+    }
+    // Remove everything that's gone before placing, so an item moving onto
+    // a position another item is leaving isn't displaced by it
+    for (const [id, position] of this._positionsById) {
+      if (!seen.has(id)) {
+        this.remove(position);
+      }
+    }
+    for (const [item, position] of toPlace) {
+      this.add(item, position);
+    }
+  }
+
+  /**
+   * Return the positions whose contents changed since the last call, and
+   * start collecting again.
+   */
+  takeDirty() {
+    const dirty = this._dirty;
+    this._dirty = [];
+    return dirty;
+  }
+
   /**
    * Retrieve pairs of positions and Item objects (like Python's dict.items())
    * @returns Map.prototype[@@iterator] of[position, Item] pairs
    */
   *entries() {
-    for (const [itemPosition, currentItem] of this._itemsByPosition.entries()) {
-      yield [JSON.parse(itemPosition), currentItem];
+    for (const currentItem of this._itemsByPosition.values()) {
+      yield [this._positionsById.get(currentItem.id), currentItem];
     }
   }
 }
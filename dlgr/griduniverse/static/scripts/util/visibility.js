@@ -0,0 +1,75 @@
+/*jshint esversion: 6 */
+
+class VisibilityMask {
+  // Dimness of each cell of the visible window, falling off from 1 at the
+  // ego's position as a Gaussian whose standard deviation is the current
+  // visibility. This is the Gaussian pdf of the distance, rescaled by its
+  // value at 0, computed directly so the square root can be skipped.
+  //
+  // The mask is only recomputed when the ego moves, the window scrolls or
+  // the visibility changes.
+
+  constructor(rows, columns) {
+    this.rows = rows;
+    this.columns = columns;
+    this.data = new Float32Array(rows * columns);
+    this.egoRow = null;
+    this.egoColumn = null;
+    this.left = null;
+    this.top = null;
+    this.visibility = null;
+  }
+
+  dimness(row, column) {
+    // Dimness at a position in full-grid coordinates
+    if (this.egoRow === null) {
+      return 0;
+    }
+    var dy = row - this.egoRow,
+        dx = column - this.egoColumn;
+    return Math.exp(-(dx * dx + dy * dy) / (2 * this.visibility * this.visibility));
+  }
+
+  update(egoPosition, left, top, visibility) {
+    // Return the mask for the window at (left, top), recomputing it if
+    // anything it depends on has changed.
+    var egoRow = egoPosition ? egoPosition[0] : null,
+        egoColumn = egoPosition ? egoPosition[1] : null;
+    if (egoRow === this.egoRow && egoColumn === this.egoColumn &&
+        left === this.left && top === this.top &&
+        visibility === this.visibility) {
+      return this.data;
+    }
+    this.egoRow = egoRow;
+    this.egoColumn = egoColumn;
+    this.left = left;
+    this.top = top;
+    this.visibility = visibility;
+
+    if (egoRow === null) {
+      this.data.fill(0);
+      return this.data;
+    }
+    // The mask is separable: exp(-(dx² + dy²) / 2σ²) = exp(-dx² / 2σ²) * exp(-dy² / 2σ²)
+    var scale = -1 / (2 * visibility * visibility),
+        rowFactors = new Float32Array(this.rows),
+        columnFactors = new Float32Array(this.columns),
+        i, j, d;
+    for (j = 0; j < this.rows; j++) {
+      d = top + j - egoRow;
+      rowFactors[j] = Math.exp(d * d * scale);
+    }
+    for (i = 0; i < this.columns; i++) {
+      d = left + i - egoColumn;
+      columnFactors[i] = Math.exp(d * d * scale);
+    }
+    for (j = 0; j < this.rows; j++) {
+      for (i = 0; i < this.columns; i++) {
+        this.data[j * this.columns + i] = rowFactors[j] * columnFactors[i];
+      }
+    }
+    return this.data;
+  }
+}
+
+module.exports = VisibilityMask;
@@ -0,0 +1,94 @@
+/*jshint esversion: 6 */
+
+// Walls sent as bare positions are this color
+var DEFAULT_COLOR = [0.5, 0.5, 0.5];
+
+class WallMap {
+  // The walls on the grid as a bitmap, with the color of each wall, indexed
+  // by row * columns + column.
+
+  constructor(rows, columns) {
+    this.rows = rows;
+    this.columns = columns;
+    this.bitmap = new Uint8Array(rows * columns);
+    this.colors = new Float32Array(rows * columns * 3);
+    this.count = 0;
+    // Indexes of the cells holding a wall, so they can be reconciled
+    // without scanning the whole grid
+    this.indices = new Set();
+  }
+
+  index(row, column) {
+    return row * this.columns + column;
+  }
+
+  has(row, column) {
+    if (row < 0 || row >= this.rows || column < 0 || column >= this.columns) {
+      return false;
+    }
+    return this.bitmap[this.index(row, column)] === 1;
+  }
+
+  set(position, color) {
+    var idx = this.index(position[0], position[1]);
+    if (!this.bitmap[idx]) {
+      this.bitmap[idx] = 1;
+      this.indices.add(idx);
+      this.count++;
+    }
+    this.colors[idx * 3] = color[0];
+    this.colors[idx * 3 + 1] = color[1];
+    this.colors[idx * 3 + 2] = color[2];
+  }
+
+  remove(position) {
+    this._removeIndex(this.index(position[0], position[1]));
+  }
+
+  _removeIndex(idx) {
+    if (this.bitmap[idx]) {
+      this.bitmap[idx] = 0;
+      this.indices.delete(idx);
+      this.count--;
+    }
+  }
+
+  reconcile(walls) {
+    // Bring the map in line with the full list of walls from a state
+    // message, adding, recoloring and removing walls as needed. Each wall
+    // is an object with a position and color, or a bare position for a wall
+    // of the default color.
+    var seen = new Set(),
+        wall, position, idx, i;
+    for (i = 0; i < walls.length; i++) {
+      wall = walls[i];
+      position = wall.position || wall;
+      seen.add(this.index(position[0], position[1]));
+      this.set(position, wall.color || DEFAULT_COLOR);
+    }
+    if (seen.size < this.indices.size) {
+      for (idx of this.indices) {
+        if (!seen.has(idx)) {
+          this._removeIndex(idx);
+        }
+      }
+    }
+  }
+
+  colorAt(row, column) {
+    // The color of the wall at a position, or undefined if there isn't one
+    if (!this.has(row, column)) {
+      return undefined;
+    }
+    var idx = this.index(row, column) * 3;
+    return [this.colors[idx], this.colors[idx + 1], this.colors[idx + 2]];
+  }
+
+  clear() {
+    this.bitmap.fill(0);
+    this.indices.clear();
+    this.count = 0;
+  }
+}
+
+module.exports = WallMap;
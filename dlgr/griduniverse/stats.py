@@ -0,0 +1,54 @@
+"""Running aggregates of player activity in each round."""
+import collections
+
+
+class RoundStats(object):
+    """Totals of each player's activity during one round, kept up to date as
+    the game is played, so that bonuses and analyses can read a compact
+    summary instead of reprocessing the event log.
+    """
+
+    #: Running totals kept for every player
+    COUNTS = ("moves", "moves_rejected", "calories", "donated", "received")
+
+    def __init__(self, round=0):
+        self.round = round
+        self.players = {}
+
+    def for_player(self, player_id):
+        stats = self.players.get(player_id)
+        if stats is None:
+            stats = self.players[player_id] = dict.fromkeys(self.COUNTS, 0)
+            # Items harvested, and transitions made, by item type
+            stats["harvested"] = collections.Counter()
+            stats["transitions"] = collections.Counter()
+        return stats
+
+    def add(self, player_id, name, amount=1):
+        self.for_player(player_id)[name] += amount
+
+    def harvest(self, player_id, item_id, calories):
+        stats = self.for_player(player_id)
+        stats["harvested"][str(item_id)] += 1
+        stats["calories"] += calories
+
+    def transition(self, player_id, item_id):
+        self.for_player(player_id)["transitions"][str(item_id)] += 1
+
+    def summary(self, players, game_over=False):
+        """Return the round's totals, with each player's current score and
+        payoff, as an event to record."""
+        summary = {}
+        for player in players.values():
+            stats = dict(self.for_player(player.id))
+            stats["harvested"] = dict(stats["harvested"])
+            stats["transitions"] = dict(stats["transitions"])
+            stats["score"] = player.score
+            stats["payoff"] = player.payoff
+            summary[str(player.id)] = stats
+        return {
+            "type": "round_summary",
+            "round": self.round,
+            "game_over": game_over,
+            "players": summary,
+        }
@@ -0,0 +1,220 @@
+"""Compact storage of persisted grid states.
+
+By default each state is stored twice, as JSON text in the `contents` of a
+`State` info and as JSONB in its `details`. In compact storage a state is
+stored once, and only as much of it as changed:
+
+* Every `keyframe_interval` states, a keyframe holds the full grid,
+  including walls and items.
+* In between, a state only holds the top-level values that changed since the
+  previous one, and for each player whose data changed, its id and the fields
+  that changed. Players that left are listed in `removed_players`. Walls and
+  items are only included when they changed, as before.
+
+The `details` of a compact state mark it as such. Uncompressed, they hold
+the encoded state under `state`; compressed, the encoded state is stored as
+base64 text in `contents`. Use a `StateDecoder` to turn a sequence of stored
+states, in creation order, back into the states the game serialized.
+"""
+import base64
+import json
+import zlib
+
+#: Marks the `details` of a compact state
+COMPACT = "compact"
+
+#: Supported compression of compact states
+COMPRESSIONS = ("none", "zlib", "zstd")
+
+#: Sections of a state only included when they changed. Older games called
+#: items "food".
+GRID_SECTIONS = ("walls", "items", "food")
+
+#: Sections of a state that aren't top-level values
+SECTIONS = ("players", "removed_players") + GRID_SECTIONS
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            "zstd state compression requires the zstandard package to be installed"
+        )
+    return zstandard
+
+
+def compress(data, compression):
+    if compression == "zlib":
+        return zlib.compress(data)
+    if compression == "zstd":
+        return _zstandard().ZstdCompressor().compress(data)
+    raise ValueError("Unknown state compression: {}".format(compression))
+
+
+def decompress(data, compression):
+    if compression == "zlib":
+        return zlib.decompress(data)
+    if compression == "zstd":
+        return _zstandard().ZstdDecompressor().decompress(data)
+    raise ValueError("Unknown state compression: {}".format(compression))
+
+
+def is_compact(details):
+    return isinstance(details, dict) and details.get("storage") == COMPACT
+
+
+def is_keyframe(details):
+    """Whether stored state `details` hold a full state on their own."""
+    return not is_compact(details) or details["keyframe"]
+
+
+def _values(state):
+    return {k: v for k, v in state.items() if k not in SECTIONS}
+
+
+class StateEncoder(object):
+    """Encodes each state the game persists against the previous one."""
+
+    def __init__(self, keyframe_interval=100, compression="none"):
+        if compression not in COMPRESSIONS:
+            raise ValueError("Unknown state compression: {}".format(compression))
+        if compression == "zstd":
+            # Fail when the game starts rather than on the first state
+            _zstandard()
+        self.keyframe_interval = keyframe_interval
+        self.compression = compression
+        self._values = None
+        self._players = None
+        self._since_keyframe = 0
+
+    @property
+    def keyframe_due(self):
+        """Whether the next state should be a keyframe, and so include the
+        walls and items."""
+        return self._players is None or self._since_keyframe >= self.keyframe_interval
+
+    def encode(self, state, keyframe=False):
+        """Return the `contents` and `details` to store for `state`. It's a
+        keyframe if one is due or `keyframe` is set, as long as it includes
+        the walls and items, and the first state always is."""
+        keyframe = self._players is None or (
+            (keyframe or self.keyframe_due) and "walls" in state and "items" in state
+        )
+        if keyframe:
+            record = state
+            self._since_keyframe = 0
+        else:
+            record = self._diff(state)
+            self._since_keyframe += 1
+        self._values = _values(state)
+        self._players = {p["id"]: p for p in state["players"]}
+
+        details = {
+            "storage": COMPACT,
+            "keyframe": keyframe,
+            "round": state.get("round"),
+        }
+        if self.compression == "none":
+            details["state"] = record
+            return None, details
+        details["compression"] = self.compression
+        data = compress(json.dumps(record).encode("utf-8"), self.compression)
+        return base64.b64encode(data).decode("ascii"), details
+
+    def _diff(self, state):
+        record = {
+            k: v
+            for k, v in _values(state).items()
+            if k not in self._values or self._values[k] != v
+        }
+        previous = dict(self._players)
+        players = []
+        for player in state["players"]:
+            before = previous.pop(player["id"], None)
+            if before is None:
+                players.append(player)
+            elif before != player:
+                changed = {k: v for k, v in player.items() if before.get(k) != v}
+                changed["id"] = player["id"]
+                players.append(changed)
+        if players:
+            record["players"] = players
+        if previous:
+            record["removed_players"] = list(previous)
+        for section in GRID_SECTIONS:
+            if section in state:
+                record[section] = state[section]
+        return record
+
+
+class StateDecoder(object):
+    """Rebuilds stored states, in creation order, as the game serialized
+    them. States stored in full are returned as they are."""
+
+    def __init__(self):
+        self._values = None
+        self._players = None
+
+    def seed(self, state):
+        """Decode the following states against `state`, for instance when
+        resuming a replay from a snapshot."""
+        self._values = _values(state)
+        self._players = {p["id"]: p for p in state.get("players", ())}
+
+    def decode(self, contents, details):
+        if not is_compact(details):
+            state = details if isinstance(details, dict) and details else None
+            if state is None:
+                state = json.loads(contents) if contents else {}
+            if "players" in state:
+                self.seed(state)
+            return state
+
+        if "state" in details:
+            record = details["state"]
+        else:
+            data = decompress(base64.b64decode(contents), details["compression"])
+            record = json.loads(data)
+        if details["keyframe"]:
+            self.seed(record)
+            return record
+        if self._players is None:
+            raise ValueError("Compact state can't be decoded before a keyframe")
+
+        values = dict(self._values)
+        values.update(_values(record))
+        players = dict(self._players)
+        for changed in record.get("players", ()):
+            players[changed["id"]] = dict(players.get(changed["id"], {}), **changed)
+        for player_id in record.get("removed_players", ()):
+            players.pop(player_id, None)
+        state = dict(values, players=list(players.values()))
+        for section in GRID_SECTIONS:
+            if section in record:
+                state[section] = record[section]
+        self._values = values
+        self._players = players
+        return state
+
+
+def decode_state(contents, details):
+    """Decode a single stored state, which must be a keyframe if it's
+    compact."""
+    return StateDecoder().decode(contents, details)
+
+
+def decode_latest(states):
+    """Decode the latest of the stored `states`, given as (contents, details)
+    pairs from the newest back. Only the states since the latest keyframe
+    are read. Returns None if there are none."""
+    rows = []
+    for contents, details in states:
+        rows.append((contents, details))
+        if is_keyframe(details):
+            break
+    state = None
+    decoder = StateDecoder()
+    for contents, details in reversed(rows):
+        state = decoder.decode(contents, details)
+    return state
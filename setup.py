@@ -84,6 +84,12 @@ setup_args = dict(
             "pip-tools",
             "pre-commit",
         ],
+        "export": [
+            "pyarrow",
+        ],
+        "zstd": [
+            "zstandard",
+        ],
     },
 )
 setup(**setup_args)
@@ -0,0 +1,80 @@
+import datetime
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture
+def data():
+    from dallinger.data import Data
+
+    return Data(os.path.join(os.path.dirname(__file__), "griduniverse_bots.zip"))
+
+
+@pytest.fixture
+def analysis(data):
+    from dlgr.griduniverse.analysis import GameAnalysis
+
+    return GameAnalysis(data)
+
+
+class TestGameAnalysis(object):
+    def test_events_are_parsed_into_columns(self, analysis):
+        events = analysis.events
+
+        assert list(events.columns) == ["time", "origin", "type", "player", "round"]
+        assert events["time"].is_monotonic_increasing
+        assert len(analysis.moves) == 143
+
+    def test_averages_over_final_state(self, analysis):
+        assert analysis.average_score() == 0.5
+        assert analysis.average_payoff() == pytest.approx(0.01)
+
+    def test_final_state_from_compact_states(self, analysis):
+        from dlgr.griduniverse.storage import StateDecoder, StateEncoder
+
+        infos = analysis.infos.copy()
+        states = infos["type"] == "state"
+        decoder = StateDecoder()
+        encoder = StateEncoder(keyframe_interval=5, compression="zlib")
+        rows = [
+            encoder.encode(decoder.decode(contents, json.loads(details)))
+            for contents, details in zip(
+                infos.loc[states, "contents"], infos.loc[states, "details"]
+            )
+        ]
+        expected = analysis.final_state
+        infos.loc[states, "contents"] = [contents for contents, _ in rows]
+        infos.loc[states, "details"] = [json.dumps(details) for _, details in rows]
+        del analysis.final_state
+        analysis.infos = infos
+
+        assert not rows[-1][1]["keyframe"]
+        assert analysis.final_state == expected
+
+    def test_number_of_actions(self, analysis):
+        assert analysis.number_of_actions() == [
+            {
+                "round_number": 1,
+                "round_data": [
+                    {"player_id": "1", "total_moves": 72},
+                    {"player_id": "3", "total_moves": 71},
+                ],
+            }
+        ]
+
+    def test_average_time_to_start(self, analysis):
+        assert analysis.average_time_to_start() == str(
+            datetime.timedelta(seconds=21, microseconds=624890)
+        )
+
+    def test_analyze_reports_all_metrics(self, data):
+        from dlgr.griduniverse.experiment import Griduniverse
+
+        exp = Griduniverse.__new__(Griduniverse)
+
+        results = json.loads(exp.analyze(data))
+
+        assert results["average_score"] == 0.5
+        assert results["number_of_actions"][0]["round_number"] == 1
@@ -0,0 +1,42 @@
+import json
+
+from dlgr.griduniverse import benchmark
+
+
+class TestBenchmarks(object):
+    def test_every_benchmark_runs(self, fresh_gridworld):
+        results = benchmark.run(benchmark.SCENARIOS[:1], calls=2)
+
+        assert [r["benchmark"] for r in results] == list(benchmark.BENCHMARKS)
+        for result in results:
+            assert result["scenario"] == "tiny"
+            assert result["calls"] == 2
+            assert 0 < result["min_us"] <= result["median_us"] <= result["max_us"]
+
+    def test_compare_finds_regressions(self):
+        baseline = [
+            {"benchmark": "serialize", "scenario": "tiny", "median_us": 10.0},
+            {"benchmark": "consume", "scenario": "tiny", "median_us": 10.0},
+        ]
+        results = [
+            {"benchmark": "serialize", "scenario": "tiny", "median_us": 12.0},
+            {"benchmark": "consume", "scenario": "tiny", "median_us": 13.0},
+            {"benchmark": "labyrinth", "scenario": "tiny", "median_us": 99.0},
+        ]
+
+        regressions = benchmark.compare(results, baseline, threshold=0.25)
+
+        assert [r["benchmark"] for r, _ in regressions] == ["consume"]
+
+    def test_main_writes_results(self, fresh_gridworld, tmp_path):
+        output = tmp_path / "results.json"
+
+        status = benchmark.main(
+            ["--scenario", "tiny", "--benchmark", "serialize", "--calls", "3"]
+            + ["--output", str(output)]
+        )
+
+        assert status == 0
+        results = json.loads(output.read_text())
+        assert results["seed"] == 0
+        assert len(results["results"]) == 1
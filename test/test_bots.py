@@ -177,6 +177,21 @@ class TestAdvantageSeekingBot(object):
         assert bot._skip_experiment
         assert bot.participate()  # Harmless no-op
 
+    def test_unpacks_batched_messages(self, bot, grid_state):
+        bot.grid = {}
+        batch = {
+            "type": "batch",
+            "messages": [
+                {"type": "state", "grid": grid_state, "remaining_time": 60},
+                {"type": "stop"},
+            ],
+        }
+
+        bot.send("griduniverse:" + json.dumps(batch))
+
+        assert bot.grid["remaining_time"] == 0
+        assert bot.grid["grid"]["rows"] == json.loads(grid_state)["rows"]
+
     def test_runs_experiment_if_not_overrecruited(self, bot, working_response):
         bot.on_signup(working_response)
 
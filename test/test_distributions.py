@@ -0,0 +1,67 @@
+import numpy
+import pytest
+
+from dlgr.griduniverse import distributions
+
+
+class TestSampler(object):
+    def test_single_sample_is_row_column_pair(self):
+        sampler = distributions.Sampler(3, 4, numpy.ones((3, 4)))
+        row, column = sampler.sample()
+        assert 0 <= row < 3
+        assert 0 <= column < 4
+
+    def test_batch_sample_shape(self):
+        sampler = distributions.Sampler(3, 4, numpy.ones((3, 4)))
+        positions = sampler.sample(100)
+        assert positions.shape == (100, 2)
+        assert positions[:, 0].max() < 3
+        assert positions[:, 1].max() < 4
+
+    def test_only_weighted_cells_are_drawn(self):
+        weights = numpy.zeros((5, 5))
+        weights[2, 3] = 1.0
+        sampler = distributions.Sampler(5, 5, weights)
+        positions = sampler.sample(50)
+        assert (positions == [2, 3]).all()
+
+    def test_rejects_weights_of_wrong_size(self):
+        with pytest.raises(ValueError):
+            distributions.Sampler(5, 5, numpy.ones((4, 4)))
+
+
+class TestGetSampler(object):
+    @pytest.mark.parametrize("name", sorted(distributions.WEIGHT_FUNCTIONS))
+    def test_builtin_distributions_stay_on_grid(self, name):
+        func = getattr(distributions, name)
+        positions = distributions.get_sampler(func, 20, 30).sample(500)
+        assert positions[:, 0].min() >= 0
+        assert positions[:, 0].max() < 20
+        assert positions[:, 1].min() >= 0
+        assert positions[:, 1].max() < 30
+
+    def test_samplers_are_cached_per_arguments(self):
+        func = distributions.sinusoidal_probability_distribution
+        first = distributions.get_sampler(func, 10, 10, "15")
+        assert distributions.get_sampler(func, 10, 10, "15") is first
+        assert distributions.get_sampler(func, 10, 10, "5") is not first
+
+    def test_custom_function_is_wrapped(self):
+        def custom_probability_distribution(rows, columns, *args):
+            return [rows - 1, columns - 1]
+
+        sampler = distributions.get_sampler(custom_probability_distribution, 4, 6)
+        assert sampler.sample() == [3, 5]
+        assert (sampler.sample(3) == [3, 5]).all()
+
+    def test_center_bias_prefers_center(self):
+        func = distributions.center_bias_probability_distribution
+        positions = distributions.get_sampler(func, 100, 100).sample(2000)
+        assert abs(positions[:, 0].mean() - 50) < 5
+
+
+class TestWrappers(object):
+    def test_sinusoidal_returns_pair(self):
+        row, column = distributions.sinusoidal_probability_distribution(10, 10, "15")
+        assert 0 <= row < 10
+        assert 0 <= column < 10
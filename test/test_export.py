@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+pyarrow_dataset = pytest.importorskip("pyarrow.dataset")
+
+EXPORT = os.path.join(os.path.dirname(__file__), "griduniverse_bots.zip")
+
+
+def read_table(output_dir, name):
+    dataset = pyarrow_dataset.dataset(
+        os.path.join(output_dir, name), format="parquet", partitioning="hive"
+    )
+    return dataset.to_table().to_pandas()
+
+
+class TestColumnarExport(object):
+    @pytest.fixture
+    def output_dir(self, tmp_path):
+        from dlgr.griduniverse.export import export_columnar
+
+        self.counts = export_columnar(EXPORT, str(tmp_path), batch_rows=100)
+        return str(tmp_path)
+
+    def test_row_counts(self, output_dir):
+        assert self.counts == {"events": 214, "players": 1197, "items": 19}
+
+    def test_tables_are_partitioned_by_round(self, output_dir):
+        assert os.listdir(os.path.join(output_dir, "events")) == ["round=0"]
+        # Small batches are written to several files
+        assert len(os.listdir(os.path.join(output_dir, "players", "round=0"))) == 12
+
+    def test_events_are_flattened(self, output_dir):
+        events = read_table(output_dir, "events")
+
+        moves = events[events["type"] == "move"]
+        assert len(moves) == 143
+        assert set(moves["move"]) <= {"up", "down", "left", "right"}
+        assert set(moves["player_id"]) == {"1", "3"}
+
+    def test_player_positions_per_state(self, output_dir):
+        players = read_table(output_dir, "players")
+
+        assert set(players["player_id"]) == {"1", "3"}
+        assert players["row"].between(0, 24).all()
+        assert players.groupby("player_id")["score"].max().sum() == 1
+
+    def test_item_lifecycles(self, output_dir):
+        items = read_table(output_dir, "items")
+
+        assert (items["first_seen"] <= items["last_seen"]).all()
+        # Older games reused ids, so each appearance of an item is a record
+        for _, appearances in items.sort_values("first_seen").groupby("id"):
+            assert (
+                appearances["first_seen"].iloc[1:].values
+                > appearances["last_seen"].iloc[:-1].values
+            ).all()
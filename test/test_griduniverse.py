@@ -104,6 +104,85 @@ class TestItem(object):
         assert item.remaining_uses == 1
 
 
+class TestPayoffs(object):
+    @pytest.fixture
+    def game(self):
+        from dlgr.griduniverse.experiment import Griduniverse
+
+        game = Griduniverse.__new__(Griduniverse)
+        game.redis_conn = mock.Mock()
+        game.redis_conn.hgetall.return_value = {}
+        return game
+
+    def test_bonus_is_read_from_saved_payoffs(self, game):
+        game.save_payoffs(
+            {
+                "type": "round_summary",
+                "game_over": True,
+                "players": {"1": {"payoff": 1.234}, "2": {"payoff": 0.5}},
+            }
+        )
+
+        game.redis_conn.hset.assert_called_once_with(
+            "griduniverse:payoffs", mapping={"1": 1.234, "2": 0.5}
+        )
+        assert game.bonus(mock.Mock(id=1)) == 1.23
+        assert game.bonus(mock.Mock(id=2)) == 0.5
+        game.redis_conn.hgetall.assert_not_called()
+
+    def test_payoffs_saved_by_another_process_are_loaded_once(self, game):
+        game.redis_conn.hgetall.return_value = {b"1": b"1.5", b"2": b"0.25"}
+
+        assert game.bonus(mock.Mock(id=1)) == 1.5
+        assert game.bonus(mock.Mock(id=2)) == 0.25
+        game.redis_conn.hgetall.assert_called_once()
+
+    def test_payoffs_are_empty_until_the_game_ends(self, game):
+        assert game.payoffs == {}
+        game.redis_conn.hgetall.return_value = {b"1": b"1.5"}
+
+        assert game.payoffs == {"1": 1.5}
+
+
+class TestStateScheduler(object):
+    @pytest.fixture
+    def scheduler(self):
+        from dlgr.griduniverse.experiment import StateScheduler
+
+        return StateScheduler(interval=0.05, max_interval=1.0, budget=0.25)
+
+    def test_first_broadcast_is_due_at_once(self, scheduler):
+        assert scheduler.delay(100.0, 0) == 0
+
+    def test_waits_for_changes(self, scheduler):
+        scheduler.published(100.0, 1, 0.001)
+
+        assert scheduler.delay(100.01, 2) == pytest.approx(0.04)
+        assert scheduler.delay(100.01, 1) == pytest.approx(0.99)
+        assert scheduler.delay(101.5, 1) == 0
+
+    def test_backs_off_when_broadcasts_are_slow(self, scheduler):
+        scheduler.published(100.0, 1, 0.02)
+        assert scheduler.interval == 0.1
+        assert scheduler.rate == 10
+
+        scheduler.published(100.1, 2, 0.02)
+        assert scheduler.interval == 0.1
+
+    def test_recovers_when_broadcasts_speed_up(self, scheduler):
+        scheduler.published(100.0, 1, 0.02)
+        for version in range(2, 20):
+            scheduler.published(100.0 + version, version, 0.001)
+
+        assert scheduler.interval == 0.05
+
+    def test_never_backs_off_past_the_max_interval(self, scheduler):
+        for version in range(10):
+            scheduler.published(100.0 + version, version, 10)
+
+        assert scheduler.interval == 1.0
+
+
 @pytest.mark.usefixtures("env")
 class TestExperimentClass(object):
     def test_initialization(self, exp):
@@ -162,15 +241,33 @@ class TestExperimentClass(object):
         exp.recruit()
 
     def test_bonus(self, participants, exp):
+        from dlgr.griduniverse.experiment import PAYOFFS_KEY
+
+        exp.redis_conn.delete(PAYOFFS_KEY)
         # With no experiment state, bonus returns 0
         assert exp.bonus(participants[0]) == 0.0
 
-        with mock.patch("dlgr.griduniverse.experiment.Griduniverse.environment") as env:
-            state_mock = mock.Mock()
-            env.state.return_value = state_mock
-            # State contents is JSON grid state
-            state_mock.contents = '{"players": [{"id": "1", "payoff": 100.0}]}'
-            assert exp.bonus(participants[0]) == 100.0
+        state = {"players": [{"id": "1", "payoff": 100.0}]}
+        exp.socket_session.add(exp.environment.update(json.dumps(state), details=state))
+        exp.socket_session.commit()
+        assert exp.bonus(participants[0]) == 100.0
+
+    def test_bonus_from_compact_states(self, participants, exp):
+        from dlgr.griduniverse.experiment import PAYOFFS_KEY
+        from dlgr.griduniverse.storage import StateEncoder
+
+        exp.redis_conn.delete(PAYOFFS_KEY)
+        encoder = StateEncoder()
+        for payoff in (50.0, 100.0):
+            contents, details = encoder.encode(
+                {"round": 0, "players": [{"id": "1", "payoff": payoff}]}
+            )
+            exp.socket_session.add(exp.environment.update(contents, details=details))
+            exp.socket_session.commit()
+
+        # The game ended without a final keyframe
+        assert not details["keyframe"]
+        assert exp.bonus(participants[0]) == 100.0
 
 
 @pytest.mark.usefixtures("env", "fake_gsleep")
@@ -258,20 +355,61 @@ class TestGameLoops(object):
 
         assert exp.grid.players["1"].payoff == 5.0
 
+    def test_loop_saves_final_payoffs(self, loop_exp_3x):
+        exp = loop_exp_3x
+        exp.grid.dollars_per_point = 0.5
+        exp.grid.players = {"1": Player(id="1", score=10.0)}
+
+        exp.game_loop()
+
+        assert exp.payoffs == {"1": 5.0}
+        assert exp.bonus(mock.Mock(id=1)) == 5.0
+
     def test_loop_publishes_stop_event(self, loop_exp_3x):
         # publish called with stop event at end of round
         exp = loop_exp_3x
         exp.game_loop()
         exp.publish.assert_called_once_with({"type": "stop"})
 
+    def test_loop_stores_compact_states(self, loop_exp_3x):
+        from dlgr.griduniverse.storage import StateDecoder, StateEncoder
+
+        exp = loop_exp_3x
+        exp.state_encoder = StateEncoder()
+        with mock.patch("dlgr.griduniverse.experiment.Griduniverse.environment") as env:
+            exp.game_loop()
+
+        stored = [(c.args[0], c.kwargs["details"]) for c in env.update.call_args_list]
+        # One state per loop, then a final keyframe
+        assert [details["keyframe"] for _, details in stored] == [
+            True,
+            False,
+            False,
+            True,
+        ]
+        decoder = StateDecoder()
+        states = [decoder.decode(*row) for row in stored]
+        assert states[-1] == exp.grid.serialize()
+
     def test_send_state_thread(self, loop_exp_3x):
         exp = loop_exp_3x
+        # Publish on every pass, whether or not anything has changed
+        exp.state_scheduler.interval = exp.state_scheduler.max_interval = 0
         exp.send_state_thread()
 
         # State thread will loop 4 times before the loop is broken,
         # and publish called with grid state message once per loop
         assert exp.publish.call_count == 4
 
+    def test_send_state_thread_skips_unchanged_state(self, loop_exp_3x):
+        exp = loop_exp_3x
+        exp.send_state_thread()
+
+        # Nothing changes after the first broadcast, so the only other one
+        # is when the game ends
+        assert exp.publish.call_count == 2
+        assert exp.metrics.gauges["state.rate"] == exp.state_scheduler.rate
+
 
 @pytest.mark.usefixtures("env")
 class TestPlayerConnects(object):
@@ -367,6 +505,65 @@ class TestRecordPlayerActivity(object):
         assert info.details["data"] == ["some data"]
         assert info.origin.id == node.id
 
+    def test_batch_events_recorded_in_one_commit(self, exp, a):
+        participant = a.participant()
+        exp.handle_connect({"player_id": participant.id})
+        exp.socket_session.add_all = mock.Mock()
+        exp.socket_session.commit = mock.Mock()
+        raw_message = (
+            "griduniverse_ctrl:"
+            '{{"type":"chat","player_id":{},"contents":"hello!"}}'.format(
+                participant.id
+            )
+        )
+        exp.receive([(1.0, raw_message), (2.0, raw_message)])
+        exp.socket_session.add_all.assert_called_once()
+        exp.socket_session.commit.assert_called_once()
+        infos = exp.socket_session.add_all.call_args[0][0]
+        assert [info.details["server_time"] for info in infos] == [1.0, 2.0]
+
+    def test_receive_releases_its_connection(self, exp, a):
+        import gevent
+
+        participant = a.participant()
+        exp.handle_connect({"player_id": participant.id})
+        raw_message = (
+            "griduniverse_ctrl:"
+            '{{"type":"chat","player_id":{},"contents":"hello!"}}'.format(
+                participant.id
+            )
+        )
+
+        checked_out = exp.metrics.gauges.get("db.pool.checked_out", 0)
+        for _ in range(2):
+            gevent.spawn(exp.receive, [(1.0, raw_message)]).get()
+
+        assert exp.metrics.gauges["db.pool.checked_out"] == checked_out
+
+    def test_record_event_for_node_failed_elsewhere(self, exp, a, db_session):
+        import dallinger.models
+        import gevent
+
+        participant = a.participant()
+        exp.handle_connect({"player_id": participant.id})
+        raw_message = (
+            "griduniverse_ctrl:"
+            '{{"type":"chat","player_id":{},"contents":"hello!"}}'.format(
+                participant.id
+            )
+        )
+        gevent.spawn(exp.receive, [(1.0, raw_message)]).get()
+
+        node_id = exp.node_by_player_id[participant.id]
+        db_session.query(dallinger.models.Node).get(node_id).fail()
+        db_session.commit()
+        with mock.patch("dlgr.griduniverse.experiment.logger.info") as logger:
+            gevent.spawn(exp.receive, [(2.0, raw_message)]).get()
+        logger.assert_called_once()
+        assert logger.call_args[0][0].startswith(
+            "Tried to record an event after node#{} failure:".format(node_id)
+        )
+
     def test_record_event_with_failed_node(self, exp, a):
         # Does not save event, but logs failure
         node = exp.environment
@@ -472,3 +669,48 @@ class TestDonation(object):
 
         assert donor_player.score == 1
         assert opponent_player.score == 1
+
+
+@pytest.mark.usefixtures("env")
+class TestReplay(object):
+    def test_seeking_to_a_keyframe_replays_the_events_it_skips(
+        self, exp, a, db_session
+    ):
+        import datetime
+
+        import dallinger.nodes
+
+        from dlgr.griduniverse.models import Event
+        from dlgr.griduniverse.replay import Keyframe, KeyframeIndex
+
+        start = datetime.datetime(2020, 1, 1, 12, 0, 0)
+        environment = dallinger.nodes.Environment(network=a.network())
+        db_session.add(environment)
+        for seconds, contents in [(5, "skipped"), (25, "after")]:
+            chat = Event(
+                origin=environment, details={"type": "chat", "contents": contents}
+            )
+            chat.creation_time = start + datetime.timedelta(seconds=seconds)
+            db_session.add(chat)
+        db_session.flush()
+
+        exp.replay_start()
+        exp.state_count = 0
+        exp._replay_time_index = start
+        keyframe_time = start + datetime.timedelta(seconds=20)
+        exp._replay_keyframes = KeyframeIndex(
+            10, [Keyframe(keyframe_time, exp.grid.serialize())]
+        )
+        exp.publish = mock.Mock()
+        with mock.patch.object(exp, "handle_chat_message"):
+            events = list(
+                exp.events_for_replay(
+                    session=db_session, target=start + datetime.timedelta(seconds=30)
+                )
+            )
+
+        published = [c[0][0] for c in exp.publish.call_args_list]
+        assert [m["type"] for m in published] == ["chat", "state"]
+        assert published[0]["contents"] == "skipped"
+        assert exp._replay_time_index == keyframe_time
+        assert [e.details["contents"] for e in events] == ["after"]
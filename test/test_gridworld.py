@@ -23,6 +23,32 @@ class TestItemSpawning(object):
         assert gridworld.items_updated is True
         assert len(gridworld.item_locations.keys()) == 1
 
+    def test_spawn_items_in_bulk(self, gridworld):
+        gridworld.items_updated = False
+        gridworld.log_event.reset_mock()
+
+        items = gridworld.spawn_items(1, 20)
+
+        assert len(items) == 20
+        assert len(gridworld.item_locations) == 20
+        assert len({item.id for item in items}) == 20
+        assert gridworld.items_updated is True
+        # One aggregated event for the whole batch
+        gridworld.log_event.assert_called_once()
+        event = gridworld.log_event.call_args[0][0]
+        assert event["type"] == "spawn items"
+        assert len(event["positions"]) == 20
+
+    def test_spawn_items_avoids_occupied_cells(self, gridworld):
+        gridworld.rows = gridworld.columns = 3
+        gridworld.spawn_item(position=(1, 1), item_id=1)
+
+        items = gridworld.spawn_items(1, 20)
+
+        # Only the 8 remaining free cells can be filled
+        assert len(items) == 8
+        assert len(gridworld.item_locations) == 9
+
     def test_replenish_items_boosts_item_count_to_target(self, gridworld):
         target = sum(item.get("item_count") for item in gridworld.item_config.values())
 
@@ -30,6 +56,29 @@ class TestItemSpawning(object):
 
         target == len(gridworld.item_locations)
 
+    def test_item_counts_follow_spawns_and_removals(self, gridworld):
+        gridworld.spawn_items(1, 5)
+        assert gridworld.item_locations.count(1) == 5
+
+        position = next(iter(gridworld.item_locations.positions_of(1)))
+        del gridworld.item_locations[position]
+        assert gridworld.item_locations.count(1) == 4
+        assert position not in gridworld.item_locations.positions_of(1)
+
+        gridworld.item_locations = {}
+        assert gridworld.item_locations.count(1) == 0
+
+    def test_replenish_items_prunes_limited_items(self, gridworld):
+        item_type = gridworld.item_config[1]
+        item_type["limit_quantity"] = True
+        gridworld.spawn_items(1, 12)
+        item_type["item_count"] = 8
+
+        gridworld.replenish_items()
+
+        assert gridworld.item_locations.count(1) == 8
+        assert len(gridworld.item_locations) == 8
+
 
 @pytest.mark.usefixtures("env")
 class TestSerialize(object):
@@ -99,6 +148,37 @@ class TestDeserialize(object):
 
         assert saved == refetched
 
+    def test_updates_existing_objects_in_place(self, gridworld):
+        gridworld.replenish_items()
+        gridworld.spawn_player(1)
+        player = gridworld.players[1]
+        player.current_item = next(iter(gridworld.item_locations.values()))
+        items = dict(gridworld.item_locations)
+        saved = gridworld.serialize()
+
+        player.position = [0, 0]
+        player.score = 10
+        player.current_item = None
+        gridworld.deserialize(saved)
+
+        assert gridworld.players[1] is player
+        assert gridworld.serialize()["players"] == saved["players"]
+        assert all(gridworld.item_locations[p] is item for p, item in items.items())
+
+    def test_removes_and_adds_players_and_items(self, gridworld):
+        gridworld.replenish_items()
+        gridworld.spawn_player(1)
+        saved = gridworld.serialize()
+        removed = next(iter(gridworld.item_locations))
+
+        gridworld.spawn_player(2)
+        del gridworld.item_locations[removed]
+        gridworld.deserialize(saved)
+
+        assert list(gridworld.players) == [1]
+        assert removed in gridworld.item_locations
+        assert len(gridworld.item_locations) == len(saved["items"])
+
 
 @pytest.mark.usefixtures("env")
 class TestRoundState(object):
@@ -157,3 +237,89 @@ class TestInstructions(object):
         # Just test something basic
         html = gridworld.instructions()
         assert "🫐 Gooseberry (3 points)" in html
+
+
+class TestHistory(object):
+    @pytest.fixture
+    def grid(self, fresh_gridworld, item_config):
+        from dlgr.griduniverse.experiment import Gridworld
+
+        return Gridworld(item_config=item_config, history_length=2)
+
+    def test_keeps_recent_consumed_items_and_counts_them_all(self, grid):
+        from dlgr.griduniverse.experiment import Item
+
+        items = [Item(id=i, item_config=grid.item_config[1]) for i in range(5)]
+        for item in items:
+            grid.item_consumed(item)
+
+        assert list(grid.items_consumed) == items[-2:]
+        assert grid.total_items_consumed == 5
+        assert grid.num_items_consumed == 5
+
+    def test_foraging_game_ends_on_total_consumed(self, grid, item_config):
+        from dlgr.griduniverse.experiment import Item
+
+        grid.game_over_cond = "foraging"
+        grid.goal_items = 3
+        for i in range(3):
+            assert not grid.game_over
+            grid.item_consumed(Item(id=i, item_config=item_config[1]))
+
+        assert grid.game_over
+
+    def test_chat_history_is_bounded(self, grid):
+        for i in range(3):
+            grid.chat_message_history.append((None, i, "hi"))
+
+        assert [entry[1] for entry in grid.chat_message_history] == [1, 2]
+
+
+class TestItemIds(object):
+    @pytest.fixture
+    def grid(self, fresh_gridworld, item_config):
+        from dlgr.griduniverse.experiment import Gridworld
+
+        item_config["blank"] = dict(item_config[1], item_id="blank", name="Blank")
+        return Gridworld(item_config=item_config)
+
+    def new_grid(self, grid):
+        from dlgr.griduniverse.experiment import Gridworld
+
+        del Gridworld.instance
+        return Gridworld(item_config=grid.item_config)
+
+    def test_ids_are_unique_with_items_in_hand(self, grid):
+        player = grid.spawn_player(id=1)
+        held = grid.spawn_items(1, 3)[-1]
+        # The player picks up an item, taking it off the grid
+        del grid.item_locations[tuple(held.position)]
+        player.current_item = held
+        grid.spawn_item(item_id=1)
+
+        ids = [player.current_item.id] + [i.id for i in grid.item_locations.values()]
+        assert len(ids) == 4
+        assert len(set(ids)) == len(ids)
+
+    def test_deserialize_restores_the_allocator(self, grid):
+        grid.spawn_player(id=1)
+        grid.spawn_items(1, 3)
+        state = grid.serialize()
+
+        restored = self.new_grid(grid)
+        restored.deserialize(state)
+
+        assert restored.allocate_item_id() == grid.allocate_item_id()
+
+    def test_deserialize_older_state_starts_past_ids_in_use(self, grid):
+        from dlgr.griduniverse.experiment import Item
+
+        player = grid.spawn_player(id=1)
+        player.current_item = Item(id=99, item_config=grid.item_config["blank"])
+        state = grid.serialize()
+        del state["next_item_id"]
+
+        restored = self.new_grid(grid)
+        restored.deserialize(state)
+
+        assert restored.allocate_item_id() == 100
@@ -0,0 +1,182 @@
+import json
+import os
+
+import gevent
+import pytest
+
+from dlgr.griduniverse import loadtest
+
+
+@pytest.fixture
+def load_test(fresh_gridworld):
+    return loadtest.LoadTest(players=5, rows=15, columns=15)
+
+
+class TestStreams(object):
+    def test_synthetic_stream(self):
+        stream = loadtest.synthetic_stream([1, 2, 3], 200, chat_rate=0.1)
+
+        assert len(stream) == 200
+        assert [offset for offset, _ in stream[:3]] == [0.0, 1.0, 2.0]
+        assert {msg["player_id"] for _, msg in stream} == {1, 2, 3}
+        assert {msg["type"] for _, msg in stream} == {"move", "chat"}
+
+    def test_recorded_stream_maps_players(self):
+        path = os.path.join(os.path.dirname(__file__), "griduniverse_bots.zip")
+
+        stream = loadtest.recorded_stream(path, [10, 11])
+
+        assert len(stream) == 181
+        assert stream[0][0] == 0.0
+        assert {msg["player_id"] for _, msg in stream} == {10, 11}
+        assert {msg["type"] for _, msg in stream} == {"move", "plant_food"}
+        assert not any("actual" in msg for _, msg in stream)
+
+    def test_retime_keeps_relative_timing(self):
+        stream = [(5.0, "a"), (6.0, "b"), (9.0, "c")]
+
+        assert loadtest.retime(stream, 0.5) == [(0.0, "a"), (1.0, "b"), (4.0, "c")]
+        assert loadtest.retime(stream) == [(0.0, "a"), (0.0, "b"), (0.0, "c")]
+
+
+class TestLoadTest(object):
+    def test_messages_go_through_send(self, load_test):
+        stream = loadtest.synthetic_stream(load_test.player_ids(), 50)
+
+        result = load_test.run(stream, rate=1000)
+
+        assert result.messages == 50
+        assert result.events_recorded == 50
+        assert 0 <= result.percentile(50) <= result.percentile(99)
+        serialized = result.serialize()
+        assert serialized["rate"] == 1000
+        assert set(serialized["latency_ms"]) == {"p50", "p90", "p99", "max"}
+
+    def test_batched_messages(self, fresh_gridworld):
+        load_test = loadtest.LoadTest(
+            players=5, rows=15, columns=15, batch_interval=0.01
+        )
+        stream = loadtest.synthetic_stream(load_test.player_ids(), 50)
+
+        result = load_test.run(stream, rate=1000)
+
+        assert result.messages == 50
+        assert result.events_recorded == 50
+
+    def test_published_messages_share_a_round_trip(self, load_test):
+        game, transport = load_test.setup()
+        player_ids = load_test.player_ids()[:2]
+        # Both players are against the top edge, so both moves are rejected
+        for column, player_id in enumerate(player_ids):
+            game.grid.players[player_id].position = [0, column]
+        raw_messages = [
+            (
+                1.0,
+                'griduniverse_ctrl:{"type": "move", "player_id": %d, '
+                '"move": "up"}' % player_id,
+            )
+            for player_id in player_ids
+        ]
+
+        game.receive(raw_messages)
+        assert game.redis_conn.published == 2
+        assert game.redis_conn.round_trips == 1
+
+        game.config["batch_outbound"] = True
+        game.receive(raw_messages)
+        assert game.redis_conn.published == 3
+        assert game.redis_conn.round_trips == 2
+
+    def test_overlapping_batches_keep_their_events(self, load_test):
+        game, transport = load_test.setup()
+        dispatch = game.dispatch
+
+        def slow_dispatch(message):
+            gevent.sleep(0.01)
+            dispatch(message)
+
+        game.dispatch = slow_dispatch
+
+        def chats(player_id):
+            msg = {"type": "chat", "player_id": player_id, "contents": "hi"}
+            return [(1.0, "griduniverse_ctrl:" + json.dumps(msg))] * 2
+
+        player_ids = load_test.player_ids()[:2]
+        batches = [gevent.spawn(game.receive, chats(p)) for p in player_ids]
+        gevent.sleep(0.005)
+        # The game loop records an event while both batches are open
+        game.record_event({"type": "round_summary"})
+        gevent.joinall(batches, raise_error=True)
+
+        committed = [
+            [(event.details["type"], event.origin_id) for event in events]
+            for events in game.socket_session.committed
+        ]
+        # The game loop's event isn't held back in either batch
+        assert committed[0] == [("round_summary", game.environment.id)]
+        assert sorted(committed[1:]) == [
+            [("chat", game.node_by_player_id[p])] * 2 for p in player_ids
+        ]
+
+    def test_overlapping_outbound_batches_are_kept_apart(self, load_test):
+        game, transport = load_test.setup()
+        sent = []
+        game._send = sent.append
+        player_id = load_test.player_ids()[0]
+        msg = {"type": "chat", "player_id": player_id, "contents": "hi"}
+
+        def game_loop():
+            with game.outbound_batch():
+                game.publish({"type": "new_round", "round": 1})
+                gevent.sleep(0.01)
+                game.publish({"type": "new_round", "round": 2})
+
+        loop = gevent.spawn(game_loop)
+        gevent.sleep(0)
+        # The game loop's batch is open while the messages are handled
+        game.receive([(1.0, "griduniverse_ctrl:" + json.dumps(msg))] * 2)
+        assert [[m["type"] for m in messages] for messages in sent] == [
+            ["chat", "chat"]
+        ]
+
+        loop.join()
+        assert [m["type"] for m in sent[1]] == ["new_round", "new_round"]
+
+    def test_events_are_recorded_against_players_nodes(self, load_test):
+        stream = loadtest.synthetic_stream(load_test.player_ids(), 20)
+        game, transport = load_test.setup()
+
+        for _, msg in stream:
+            transport.deliver("griduniverse_ctrl:" + json.dumps(msg), 0)
+
+        events = [event for events in game.socket_session.committed for event in events]
+        assert [event.details["type"] for event in events] == [
+            msg["type"] for _, msg in stream
+        ]
+        assert [event.origin_id for event in events] == [
+            game.node_by_player_id[msg["player_id"]] for _, msg in stream
+        ]
+
+    def test_events_are_committed_to_database(self, load_test, db_session):
+        from dallinger.db import db_url
+
+        from dlgr.griduniverse.models import Event
+
+        load_test.database_url = db_url
+        stream = loadtest.synthetic_stream(load_test.player_ids(), 20)
+        game, transport = load_test.setup()
+
+        for _, msg in stream:
+            transport.deliver("griduniverse_ctrl:" + json.dumps(msg), 0)
+
+        assert db_session.query(Event).count() == 20
+
+    def test_find_max_rate_within_budget(self, load_test):
+        stream = loadtest.synthetic_stream(load_test.player_ids(), 100)
+
+        rate, result = load_test.find_max_rate(
+            stream, latency_budget=1000, start_rate=500, max_rate=1000, duration=0.1
+        )
+
+        assert rate == 1000
+        assert result.sustainable(1000)
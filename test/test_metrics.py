@@ -0,0 +1,44 @@
+from dlgr.griduniverse.metrics import Histogram, Metrics
+
+
+class TestHistogram(object):
+    def test_records_values_into_buckets(self):
+        histogram = Histogram((1, 10))
+        for value in (0.5, 1, 5, 50):
+            histogram.record(value)
+
+        values = histogram.serialize()
+
+        assert values["count"] == 4
+        assert values["mean"] == 14.125
+        assert values["max"] == 50
+        assert values["buckets"] == {"1": 2, "10": 1, "inf": 1}
+
+
+class TestMetrics(object):
+    def test_timer_records_milliseconds(self):
+        metrics = Metrics()
+        with metrics.timer("handle.move"):
+            pass
+
+        timing = metrics.serialize()["timings_ms"]["handle.move"]
+        assert timing["count"] == 1
+        assert timing["max"] < 100
+
+    def test_sizes_and_counters(self):
+        metrics = Metrics()
+        metrics.size("publish.state", 2000)
+        metrics.count("tick_overruns")
+        metrics.count("tick_overruns")
+
+        values = metrics.serialize()
+
+        assert values["sizes_bytes"]["publish.state"]["buckets"]["4096"] == 1
+        assert values["counters"] == {"tick_overruns": 2}
+
+    def test_gauges_keep_the_latest_value(self):
+        metrics = Metrics()
+        metrics.gauge("state.rate", 20.0)
+        metrics.gauge("state.rate", 10.0)
+
+        assert metrics.serialize()["gauges"] == {"state.rate": 10.0}
@@ -0,0 +1,75 @@
+import numpy
+import pytest
+
+from dlgr.griduniverse import policies
+
+
+@pytest.fixture
+def walls():
+    # ......
+    # ..W...
+    # ..W...
+    # ..W...
+    # ......
+    walls = numpy.zeros((5, 6), dtype=bool)
+    walls[1:4, 2] = True
+    return walls
+
+
+class TestDistanceField(object):
+    def test_goes_around_walls(self, walls):
+        distances = policies.distance_field(numpy.array([[2, 3]]), walls)
+        assert distances[2, 3] == 0
+        assert distances[2, 1] == 6
+        assert numpy.isinf(distances[2, 2])
+
+    def test_no_targets_is_unreachable(self, walls):
+        distances = policies.distance_field(numpy.zeros((0, 2), dtype=int), walls)
+        assert numpy.isinf(distances).all()
+
+
+class TestRandomPolicy(object):
+    def test_one_action_per_agent(self, walls):
+        actions = policies.RandomPolicy().actions(
+            numpy.array([[0, 0], [4, 5]]), numpy.zeros((0, 2)), walls
+        )
+        assert actions.shape == (2,)
+        assert set(actions.tolist()) <= set(range(len(policies.ACTIONS)))
+
+
+class TestFoodSeekingPolicy(object):
+    def test_steps_towards_nearest_item(self, walls):
+        agents = numpy.array([[0, 0], [4, 5]])
+        items = numpy.array([[0, 3], [4, 3]])
+        actions = policies.FoodSeekingPolicy().actions(agents, items, walls)
+        assert [policies.ACTIONS[a] for a in actions] == ["right", "left"]
+
+    def test_wanders_without_items(self, walls):
+        agents = numpy.array([[0, 0]])
+        actions = policies.FoodSeekingPolicy().actions(
+            agents, numpy.zeros((0, 2)), walls
+        )
+        assert policies.ACTIONS[actions[0]] in ("down", "right")
+
+
+class TestAdvantageSeekingPolicy(object):
+    def test_closest_agent_wins_contested_item(self):
+        agents = numpy.array([[0, 0], [0, 3]])
+        items = numpy.array([[0, 4], [0, 9]])
+        targets = policies.AdvantageSeekingPolicy().assign(agents, items)
+        assert targets.tolist() == [1, 0]
+
+    def test_steps_towards_assigned_item(self):
+        walls = numpy.zeros((1, 10), dtype=bool)
+        agents = numpy.array([[0, 0], [0, 3]])
+        items = numpy.array([[0, 4], [0, 9]])
+        actions = policies.AdvantageSeekingPolicy().actions(agents, items, walls)
+        assert [policies.ACTIONS[a] for a in actions] == ["right", "right"]
+
+    def test_spreads_out_without_items(self):
+        walls = numpy.zeros((1, 10), dtype=bool)
+        agents = numpy.array([[0, 4], [0, 5]])
+        actions = policies.AdvantageSeekingPolicy().actions(
+            agents, numpy.zeros((0, 2)), walls
+        )
+        assert [policies.ACTIONS[a] for a in actions] == ["left", "right"]
@@ -0,0 +1,179 @@
+import collections
+import csv
+import datetime
+import io
+import os
+import zipfile
+
+import mock
+import pytest
+
+from dlgr.griduniverse import replay
+from dlgr.griduniverse.replay import KeyframeIndex, read_infos
+from dlgr.griduniverse.storage import StateEncoder
+
+ExportedInfo = collections.namedtuple(
+    "ExportedInfo", ["type", "creation_time", "details", "contents"]
+)
+
+START = datetime.datetime(2020, 1, 1, 12, 0, 0)
+
+
+def state(seconds, **details):
+    details.setdefault("round", 0)
+    return ExportedInfo(
+        "state", START + datetime.timedelta(seconds=seconds), details, ""
+    )
+
+
+def event(seconds, **details):
+    return ExportedInfo(
+        "event", START + datetime.timedelta(seconds=seconds), details, ""
+    )
+
+
+@pytest.fixture
+def events():
+    return [
+        event(0, type="connect"),
+        state(1, players=[{"id": 1}], walls=[[0, 0]], items=[{"id": 1}]),
+        event(2, type="move"),
+        state(3, players=[{"id": 1, "position": [1, 1]}]),
+        state(12, players=[{"id": 1, "position": [2, 2]}], items=[]),
+        state(14, players=[{"id": 1, "position": [3, 3]}]),
+        state(25, players=[{"id": 1, "position": [4, 4]}], walls=[]),
+    ]
+
+
+class TestKeyframeIndex(object):
+    def test_keyframes_hold_the_full_merged_state(self, events):
+        index = KeyframeIndex.build(events, interval=10)
+
+        assert [k.time for k in index.keyframes] == [
+            events[1].creation_time,
+            events[4].creation_time,
+            events[6].creation_time,
+        ]
+        middle = index.keyframes[1]
+        assert middle.state["players"] == [{"id": 1, "position": [2, 2]}]
+        # Walls carry over from the earlier state that last included them
+        assert middle.state["walls"] == [[0, 0]]
+        assert middle.state["items"] == []
+
+    def test_nearest_keyframe_at_or_before_target(self, events):
+        index = KeyframeIndex.build(events, interval=10)
+
+        assert index.nearest(START) is None
+        assert index.nearest(START + datetime.timedelta(seconds=13)) is index.keyframes[1]
+        assert index.nearest(events[6].creation_time) is index.keyframes[2]
+
+    def test_state_details_fall_back_to_contents(self):
+        old_export = ExportedInfo("state", START, None, '{"players": [], "round": 0}')
+
+        index = KeyframeIndex.build([old_export])
+
+        assert index.keyframes[0].state == {
+            "players": [],
+            "walls": [],
+            "items": [],
+            "round": 0,
+        }
+
+    def test_index_is_stored_alongside_export(self, events, tmp_path):
+        zip_path = tmp_path / "app.zip"
+        zip_path.write_bytes(b"")
+        built = []
+
+        def source():
+            built.append(True)
+            return events
+
+        first = KeyframeIndex.for_export(str(zip_path), source, interval=10)
+        second = KeyframeIndex.for_export(str(zip_path), source, interval=10)
+
+        assert (tmp_path / "app-keyframes.json").exists()
+        assert len(built) == 1
+        assert [k.time for k in second.keyframes] == [k.time for k in first.keyframes]
+        assert second.keyframes[1].state == first.keyframes[1].state
+
+    def test_index_is_rebuilt_for_a_different_interval(self, events, tmp_path):
+        zip_path = tmp_path / "app.zip"
+        zip_path.write_bytes(b"")
+        KeyframeIndex.for_export(str(zip_path), lambda: events, interval=10)
+
+        index = KeyframeIndex.for_export(str(zip_path), lambda: events, interval=1)
+
+        assert index.interval == 1
+        assert len(index) == 5
+
+    def test_compact_states_are_decoded(self, events):
+        encoder = StateEncoder(compression="zlib")
+        compact = []
+        for info in events:
+            if info.type == "state":
+                contents, details = encoder.encode(info.details)
+                info = ExportedInfo(info.type, info.creation_time, details, contents)
+            compact.append(info)
+
+        index = KeyframeIndex.build(compact, interval=10)
+
+        expected = KeyframeIndex.build(events, interval=10)
+        assert [k.state for k in index.keyframes] == [
+            k.state for k in expected.keyframes
+        ]
+
+
+@pytest.fixture
+def export(tmp_path):
+    """A dataset export whose info rows are out of creation time order."""
+    rows = [
+        (3, "2020-01-01 12:00:03.5", "state", '{"players": []}', ""),
+        (1, "2020-01-01 12:00:01", "event", "", '{"type": "connect"}'),
+        (4, "2020-01-01 12:00:02.25", "event", "", '{"type": "chat"}'),
+        (2, "2020-01-01 12:00:01", "event", "", ""),
+        (5, "2020-01-01 12:00:00.123456", "event", "", '{"type": "move"}'),
+    ]
+    table = io.StringIO()
+    writer = csv.writer(table)
+    writer.writerow(["id", "creation_time", "type", "contents", "details"])
+    writer.writerows(rows)
+    path = tmp_path / "export.zip"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("data/info.csv", table.getvalue())
+    return str(path)
+
+
+class TestReadInfos(object):
+    @pytest.mark.parametrize("chunk_bytes", [1, 20, 1000])
+    def test_rows_are_in_creation_time_order(self, export, chunk_bytes):
+        infos = list(read_infos(export, chunk_bytes=chunk_bytes))
+
+        assert [info.id for info in infos] == [5, 1, 2, 4, 3]
+        assert infos[0].creation_time == datetime.datetime(2020, 1, 1, 12, 0, 0, 123456)
+        assert infos[3].creation_time.microsecond == 250000
+
+    def test_chunks_are_limited_by_size(self, export):
+        with mock.patch.object(replay, "_spill", wraps=replay._spill) as spill:
+            list(read_infos(export, chunk_bytes=20))
+        # Rows of 15, 19, 16, 0 and 16 bytes
+        assert [len(call.args[0]) for call in spill.call_args_list] == [2, 3]
+
+        with mock.patch.object(replay, "_spill", wraps=replay._spill) as spill:
+            list(read_infos(export, chunk_bytes=1000))
+        spill.assert_not_called()
+
+    def test_details_are_decoded_on_access(self, export):
+        infos = {info.id: info for info in read_infos(export)}
+
+        assert infos[1].details == {"type": "connect"}
+        assert infos[2].details == {}
+        assert infos[3].details == {}
+        assert infos[3].contents == '{"players": []}'
+
+    def test_reads_dallinger_export(self):
+        path = os.path.join(os.path.dirname(__file__), "griduniverse_bots.zip")
+        infos = list(read_infos(path, chunk_bytes=100000))
+
+        assert len(infos) == 815
+        times = [info.creation_time for info in infos]
+        assert times == sorted(times)
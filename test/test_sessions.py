@@ -0,0 +1,68 @@
+import gevent
+import pytest
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+
+from dlgr.griduniverse.metrics import Metrics
+from dlgr.griduniverse.sessions import greenlet_session, released
+
+
+class TestGreenletSession(object):
+    @pytest.fixture
+    def metrics(self):
+        return Metrics()
+
+    @pytest.fixture
+    def session(self, tmpdir, metrics):
+        url = "sqlite:///{}".format(tmpdir.join("test.db"))
+        session = greenlet_session(
+            url, metrics=metrics, poolclass=QueuePool, pool_size=2, max_overflow=0
+        )
+        yield session
+        session.remove()
+        session.bind.dispose()
+
+    def test_each_greenlet_has_its_own_session(self, session):
+        greenlets = [gevent.spawn(session) for _ in range(2)]
+        gevent.joinall(greenlets)
+
+        sessions = [g.value for g in greenlets]
+        assert sessions[0] is not sessions[1]
+        assert session() is session()
+        assert session() not in sessions
+
+    def test_connections_are_shared_through_the_pool(self, session, metrics):
+        def query():
+            session.execute(text("SELECT 1"))
+            session.commit()
+
+        gevent.joinall([gevent.spawn(query) for _ in range(10)])
+
+        counters = metrics.serialize()["counters"]
+        assert counters["db.pool.checkouts"] == 10
+        assert counters["db.pool.connects"] <= 2
+        assert metrics.gauges["db.pool.open"] <= 2
+        assert metrics.gauges["db.pool.checked_out"] == 0
+
+    def test_read_only_greenlets_return_their_connection(self, tmpdir, metrics):
+        url = "sqlite:///{}".format(tmpdir.join("test.db"))
+        session = greenlet_session(
+            url,
+            metrics=metrics,
+            poolclass=QueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=1,
+        )
+
+        def read_only():
+            # Reads, and ends without committing
+            with released(session):
+                session.execute(text("SELECT 1"))
+                assert metrics.gauges["db.pool.checked_out"] == 1
+
+        for _ in range(3):
+            gevent.spawn(read_only).get()
+            assert metrics.gauges["db.pool.checked_out"] == 0
+
+        session.bind.dispose()
@@ -0,0 +1,263 @@
+import collections
+import copy
+
+import mock
+import pytest
+
+from dlgr.griduniverse.bots import AdvantageSeekingBot, FoodSeekingBot, RandomBot
+
+
+@pytest.fixture
+def sim_item_config(item_config):
+    config = copy.deepcopy(item_config)
+    config["blank"] = dict(config[1], item_id="blank", name="Blank", calories=0)
+    config["blank"]["item_count"] = 0
+    # Ripe immediately, so food seeking bots have targets
+    config[1]["maturation_speed"] = 100
+    return config
+
+
+@pytest.fixture
+def population(fresh_gridworld, sim_item_config):
+    from dlgr.griduniverse.experiment import Gridworld
+    from dlgr.griduniverse.simulation import BotPopulation
+
+    grid = Gridworld(
+        item_config=sim_item_config,
+        player_config={},
+        rows=15,
+        columns=15,
+        max_participants=12,
+        motion_speed_limit=8,
+    )
+    grid.spawn_items(1, 10)
+    return BotPopulation(grid)
+
+
+class TestBotPopulation(object):
+    def test_add_bots_spawns_players(self, population):
+        population.add_bots(5)
+        assert len(population.bots) == 5
+        assert set(population.bots) == set(population.grid.players)
+
+    def test_world_view_exposes_food_and_walls(self, population):
+        from dlgr.griduniverse.maze import Wall
+
+        population.grid.wall_locations[(0, 0)] = Wall(position=[0, 0])
+        view = population.world_view()
+        assert len(view["food"]) == 10
+        assert view["walls"] == [{"position": [0, 0]}]
+
+    @pytest.mark.parametrize(
+        "bot_class", [RandomBot, FoodSeekingBot, AdvantageSeekingBot]
+    )
+    def test_bots_move_in_process(self, population, bot_class):
+        population.add_bots(4, bot_class)
+        population.run(20)
+        assert population.ticks == 20
+        # Every key press became a message through the game's handlers
+        assert population.game.events_recorded > 0
+
+    def test_food_seeking_bots_score(self, population):
+        population.add_bots(3, FoodSeekingBot)
+        population.run(100)
+        assert sum(population.scores().values()) > 0
+
+    def test_round_stats_follow_play(self, population):
+        population.add_bots(3, FoodSeekingBot)
+        moves = population.run(100)
+        grid = population.grid
+
+        summary = grid.end_round_stats()
+
+        players = summary["players"]
+        assert summary["type"] == "round_summary"
+        assert sum(p["moves"] for p in players.values()) == moves
+        calories = sum(p["calories"] for p in players.values())
+        assert calories == pytest.approx(sum(population.scores().values()))
+        assert sum(sum(p["harvested"].values()) for p in players.values()) > 0
+        # Collection starts afresh for the next round
+        assert grid.round_stats.players == {}
+
+    def test_handlers_are_timed(self, population):
+        population.add_bots(2, FoodSeekingBot)
+        moves = population.run(10)
+
+        timings = population.game.metrics.serialize()["timings_ms"]
+        assert timings["handle.move"]["count"] >= moves > 0
+
+    def test_receive_rejects_early_moves_together(self, population):
+        population.add_bots(2)
+        game = population.game
+        population.grid.players[1].position = [5, 5]
+        population.grid.players[2].position = [10, 10]
+        raw_messages = [
+            (
+                1.0,
+                'griduniverse_ctrl:{"type": "move", "player_id": %d, '
+                '"move": "%s", "timestamp": 10}' % (player_id, move),
+            )
+            for player_id, move in [(1, "up"), (1, "down"), (1, "up"), (2, "left")]
+        ]
+        raw_messages.append((1.0, "other_channel:{}"))
+
+        game.receive(raw_messages)
+
+        rejections = [m for m in game.published if m["type"] == "move_rejection"]
+        assert rejections == [{"type": "move_rejection", "player_id": 1}]
+        stats = population.grid.round_stats.players
+        assert stats[1]["moves_rejected"] == 2
+        assert game.events_recorded == 4
+        assert game.metrics.counters["moves.coalesced"] == 1
+
+    def test_moves_are_acknowledged_by_sequence(self, population):
+        population.add_bots(1)
+        game = population.game
+        population.grid.players[1].position = [5, 5]
+        raw_messages = [
+            (
+                1.0,
+                'griduniverse_ctrl:{"type": "move", "player_id": 1, "move": "up", '
+                '"timestamp": 10, "sequence": %d}' % sequence,
+            )
+            for sequence in (1, 2)
+        ]
+
+        game.receive(raw_messages)
+
+        player = population.grid.players[1]
+        assert player.move_sequence == 2
+        assert player.serialize()["move_sequence"] == 2
+        rejections = [m for m in game.published if m["type"] == "move_rejection"]
+        assert rejections == [{"type": "move_rejection", "player_id": 1, "sequence": 2}]
+
+    def test_rejections_carry_the_highest_sequence(self, population):
+        population.add_bots(1)
+        game = population.game
+        population.grid.players[1].position = [5, 5]
+        raw_messages = [
+            (
+                1.0,
+                'griduniverse_ctrl:{"type": "move", "player_id": 1, "move": "up", '
+                '"timestamp": 10, "sequence": %d}' % sequence,
+            )
+            for sequence in (1, 2, 3)
+        ]
+
+        game.receive(raw_messages)
+
+        assert population.grid.players[1].move_sequence == 3
+        assert population.grid.round_stats.players[1]["moves_rejected"] == 2
+        rejections = [m for m in game.published if m["type"] == "move_rejection"]
+        assert rejections == [{"type": "move_rejection", "player_id": 1, "sequence": 3}]
+
+    def test_receive_skips_invalid_messages(self, population):
+        population.add_bots(1)
+        game = population.game
+
+        game.receive(
+            [
+                (1.0, "griduniverse_ctrl:{not json"),
+                (
+                    2.0,
+                    'griduniverse_ctrl:{"type": "chat", "player_id": 1, "contents": "hi"}',
+                ),
+            ]
+        )
+
+        assert [m["type"] for m in game.published] == ["chat"]
+        assert game.published[0]["message"]["server_time"] == 2.0
+
+    def test_receive_skips_messages_that_fail(self, population):
+        population.add_bots(1)
+        game = population.game
+
+        game.receive(
+            [
+                (
+                    1.0,
+                    'griduniverse_ctrl:{"type": "move", "player_id": 99, '
+                    '"move": "up"}',
+                ),
+                (
+                    2.0,
+                    'griduniverse_ctrl:{"type": "chat", "player_id": 1, "contents": "hi"}',
+                ),
+            ]
+        )
+
+        assert [m["type"] for m in game.published] == ["chat"]
+        assert game.events_recorded == 1
+
+    def test_moves_arent_rejected_in_replay_mode(self, population):
+        population.add_bots(1)
+        game = population.game
+        game.config["replay"] = True
+        move = 'griduniverse_ctrl:{"type": "move", "player_id": 1, "move": "up"}'
+
+        game.receive([(1.0, move), (1.0, move)])
+
+        assert game.published == collections.deque()
+        assert "moves_rejected" not in population.grid.round_stats.players.get(1, {})
+
+    def test_inbound_thread_outlives_errors_and_drains_the_queue(self, population):
+        import gevent
+
+        population.add_bots(1)
+        game = population.game
+        game.config["inbound_batch_interval"] = 0.01
+        chat = 'griduniverse_ctrl:{"type": "chat", "player_id": 1, "contents": "hi"}'
+        thread = gevent.spawn(game.inbound_thread)
+
+        with mock.patch.object(game, "receive", side_effect=[ValueError, None]):
+            game.send(chat)
+            gevent.sleep(0.05)
+        assert not thread.dead
+
+        game.send(chat)
+        population.grid.round = population.grid.num_rounds
+        thread.join(1)
+        assert thread.dead
+        assert [m["type"] for m in game.published] == ["chat"]
+
+        # Once the game is over, messages are handled as they arrive
+        game.send(chat)
+        assert [m["type"] for m in game.published] == ["chat", "chat"]
+
+
+class TestPolicyPopulation(object):
+    @pytest.fixture
+    def policy_population(self, population):
+        from dlgr.griduniverse.simulation import PolicyPopulation
+
+        return PolicyPopulation(population.grid)
+
+    def test_arrays(self, policy_population):
+        policy_population.add_agents(3)
+        agents, items, walls = policy_population.arrays()
+        assert agents.shape == (3, 2)
+        assert items.shape == (10, 2)
+        assert walls.shape == (15, 15)
+
+    def test_wall_bitmap_follows_replaced_walls(self, policy_population):
+        from dlgr.griduniverse.maze import Wall
+
+        grid = policy_population.grid
+        grid.wall_locations[(0, 0)] = Wall(position=[0, 0])
+        grid.walls_changed()
+        assert policy_population.wall_bitmap()[0, 0]
+
+        # As many walls as before, in another place
+        del grid.wall_locations[(0, 0)]
+        grid.wall_locations[(1, 1)] = Wall(position=[1, 1])
+        grid.walls_changed()
+        walls = policy_population.wall_bitmap()
+        assert walls[1, 1] and not walls[0, 0]
+
+    def test_food_seeking_policy_scores(self, policy_population):
+        from dlgr.griduniverse.policies import FoodSeekingPolicy
+
+        policy_population.policy = FoodSeekingPolicy()
+        policy_population.add_agents(3)
+        assert policy_population.run(100) > 0
+        assert sum(policy_population.scores().values()) > 0
@@ -0,0 +1,39 @@
+import mock
+
+from dlgr.griduniverse.stats import RoundStats
+
+
+class TestRoundStats(object):
+    def test_summary_includes_every_player(self):
+        stats = RoundStats(round=2)
+        stats.add(1, "moves")
+        stats.add(1, "moves")
+        stats.add(1, "moves_rejected")
+        stats.harvest(1, "hare", 5)
+        stats.transition(2, "stag")
+        stats.add(2, "donated", 3)
+        players = {
+            1: mock.Mock(id=1, score=5, payoff=0.5),
+            2: mock.Mock(id=2, score=1, payoff=0.1),
+            3: mock.Mock(id=3, score=0, payoff=0.0),
+        }
+
+        summary = stats.summary(players, game_over=True)
+
+        assert summary["type"] == "round_summary"
+        assert summary["round"] == 2
+        assert summary["game_over"] is True
+        assert summary["players"]["1"] == {
+            "moves": 2,
+            "moves_rejected": 1,
+            "calories": 5,
+            "donated": 0,
+            "received": 0,
+            "harvested": {"hare": 1},
+            "transitions": {},
+            "score": 5,
+            "payoff": 0.5,
+        }
+        assert summary["players"]["2"]["transitions"] == {"stag": 1}
+        assert summary["players"]["2"]["donated"] == 3
+        assert summary["players"]["3"]["moves"] == 0
@@ -0,0 +1,133 @@
+import json
+
+import pytest
+
+from dlgr.griduniverse.storage import (
+    StateDecoder,
+    StateEncoder,
+    decode_latest,
+    decode_state,
+    is_keyframe,
+)
+
+
+def player(id, position, score=0.0):
+    return {
+        "id": id,
+        "position": position,
+        "score": score,
+        "color": "BLUE",
+        "current_item": {"id": 7, "item_id": "stone", "remaining_uses": 1},
+    }
+
+
+@pytest.fixture
+def states():
+    return [
+        {
+            "round": 0,
+            "rows": 10,
+            "players": [player(1, [0, 0]), player(2, [5, 5])],
+            "walls": [[1, 1]],
+            "items": [{"id": 3, "position": [2, 2]}],
+        },
+        {"round": 0, "rows": 10, "players": [player(1, [0, 1]), player(2, [5, 5])]},
+        {
+            "round": 0,
+            "rows": 10,
+            "players": [player(1, [0, 1]), player(2, [5, 5], score=1.0)],
+            "items": [],
+        },
+        {"round": 1, "rows": 10, "players": [player(2, [5, 5], score=1.0)]},
+        {
+            "round": 1,
+            "rows": 10,
+            "players": [player(2, [5, 6], score=1.0), player(3, [9, 9])],
+        },
+    ]
+
+
+def round_trip(states, **kwargs):
+    encoder = StateEncoder(**kwargs)
+    stored = [encoder.encode(state) for state in states]
+    decoder = StateDecoder()
+    return stored, [decoder.decode(*row) for row in stored]
+
+
+class TestStateStorage(object):
+    def test_states_are_decoded_as_serialized(self, states):
+        stored, decoded = round_trip(states)
+
+        assert decoded == states
+
+    def test_only_changes_are_stored_between_keyframes(self, states):
+        stored, _ = round_trip(states)
+
+        contents, details = stored[1]
+        assert contents is None
+        assert not details["keyframe"]
+        assert details["state"] == {"players": [{"id": 1, "position": [0, 1]}]}
+        assert stored[3][1]["state"] == {"round": 1, "removed_players": [1]}
+
+    def test_keyframes_are_stored_periodically(self, states):
+        stored, decoded = round_trip(states, keyframe_interval=2)
+
+        # A keyframe is held back until a state includes walls and items
+        assert [details["keyframe"] for _, details in stored] == [
+            True,
+            False,
+            False,
+            False,
+            False,
+        ]
+        states[3].update(walls=[], items=[])
+        stored, decoded = round_trip(states, keyframe_interval=2)
+        assert [is_keyframe(details) for _, details in stored] == [
+            True,
+            False,
+            False,
+            True,
+            False,
+        ]
+        assert decode_state(*stored[3]) == states[3]
+        assert decoded == states
+
+    def test_compressed_states(self, states):
+        stored, decoded = round_trip(states, compression="zlib")
+
+        contents, details = stored[0]
+        assert details["compression"] == "zlib"
+        assert "state" not in details
+        assert len(contents) < len(json.dumps(states[0]))
+        assert decoded == states
+
+    def test_diffs_need_a_keyframe(self, states):
+        stored, _ = round_trip(states)
+
+        with pytest.raises(ValueError):
+            decode_state(*stored[1])
+
+    def test_latest_state_is_decoded_from_the_latest_keyframe(self, states):
+        states[3].update(walls=[], items=[])
+        stored, _ = round_trip(states, keyframe_interval=2)
+        read = []
+
+        def newest_first():
+            for row in reversed(stored):
+                read.append(row)
+                yield row
+
+        assert decode_latest(newest_first()) == states[-1]
+        # Nothing before the keyframe is read
+        assert read == stored[:2:-1]
+        assert decode_latest(iter(())) is None
+
+    def test_states_stored_in_full_are_returned_as_they_are(self, states):
+        decoder = StateDecoder()
+
+        assert decoder.decode(json.dumps(states[0]), states[0]) == states[0]
+        assert decoder.decode(json.dumps(states[1]), None) == states[1]
+
+    def test_unknown_compression(self):
+        with pytest.raises(ValueError):
+            StateEncoder(compression="lzma")